@@ -46,14 +46,43 @@ def setup_directory(app: Flask, testing: bool) -> str:  # pragma: no cover
     return key
 
 
-def create_app(testing: bool = False) -> Flask:
+def init_components(app: Flask):
+    """
+    Set up the database, grader and endpoints of the application.
+
+    Args:
+        app (Flask): The Flask application instance
+    """
+
+    # pylint: disable=import-outside-toplevel
+    from . import admission, awards, database, grader, metrics, problems, submissions, endpoints
+    from . import jobs
+
+    metrics.init_app(app)
+    database.init_app(app)
+    awards.init_app(app)
+    admission.init_app(app)
+    grader.init_app(app)
+    problems.init_app(app)
+    submissions.init_app(app)
+    app.register_blueprint(endpoints.bp)
+    jobs.init_app(app)
+
+
+def create_app(testing: bool = False, config: dict | None = None) -> Flask:
     """
     Application factory for the APLMOOC_Backend application.
 
+    Configuration values can be overridden with `FLASK_`-prefixed environment variables,
+    for example `FLASK_GRADER_POOL_SIZE=8`.
+
     Args:
         testing (bool, optional):
             Indicates whether to create a new, empty instance for testing purposes.
             Defaults to `False`.
+        config (dict, optional):
+            Configuration values overriding the defaults and the environment.
+            Defaults to `None`.
 
     Returns:
         Flask: the Flask application to run
@@ -65,18 +94,16 @@ def create_app(testing: bool = False) -> Flask:
 
     key = setup_directory(app, testing)
 
+    app.config.from_object("backend.config")
     app.config.from_mapping(
         TESTING=testing,
         SECRET_KEY=key,
-        SQLALCHEMY_DATABASE_URI="sqlite:///points.db",
     )
+    app.config.from_prefixed_env()
+    if config is not None:
+        app.config.from_mapping(config)
 
-    from . import database  # pylint: disable=import-outside-toplevel
-    database.db.init_app(app)
-    app.register_blueprint(database.bp)
-
-    from . import endpoints  # pylint: disable=import-outside-toplevel
-    app.register_blueprint(endpoints.bp)
+    init_components(app)
 
     @app.errorhandler(400)
     def error_400(error):
@@ -93,6 +120,11 @@ def create_app(testing: bool = False) -> Flask:
         del error
         return {"error": "Method Not Allowed"}, 405
 
+    @app.errorhandler(413)
+    def error_413(error):
+        del error
+        return {"error": "Payload Too Large"}, 413
+
     @app.errorhandler(415)
     def error_415(error):
         del error
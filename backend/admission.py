@@ -0,0 +1,128 @@
+"""This file provides admission control for the APL MOOC backend.
+
+Two limits protect the grader from bursts of submissions. Each user has a token
+bucket, so that a script resubmitting in a loop is slowed down without affecting
+other students. The number of gradings running at once is capped, so that a burst
+near a deadline is turned away while the server still responds quickly. The token
+buckets live in the database, so that they are shared by all server processes.
+The grading cap is instead split evenly between the server processes, each of
+which counts its own gradings in memory, so that admitting a submission costs a
+single database write. A rejected request receives
+HTTP 429 with a Retry-After header instead of timing out.
+"""
+
+import math
+import threading
+import time
+from contextlib import contextmanager
+from flask import Flask
+from . import database
+from . import metrics
+
+_settings = {
+    "enabled": False,
+    "max_in_flight": 16,
+    "user_rate": 0.5,
+    "user_burst": 10,
+    # Running average of grading time, used to estimate when a slot frees up
+    "grading_seconds": 1.0,
+    "in_flight": 0,
+}
+_lock = threading.Lock()
+
+
+class Overloaded(Exception):
+    """
+    Raised when a submission is turned away by admission control.
+    """
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Too many submissions, retry after {retry_after:.1f} seconds")
+        self.retry_after = retry_after
+
+
+def check_user(id_user: str):
+    """
+    Take a token from a user's submission rate limit.
+
+    Args:
+        id_user (str): The user ID
+
+    Raises:
+        Overloaded: If the user has submitted too often recently
+    """
+
+    if not _settings["enabled"]:
+        return
+
+    wait = database.take_token(f"user:{id_user}", _settings["user_rate"], _settings["user_burst"])
+    if wait > 0:
+        metrics.inc("aplmooc_admission_rejections_total", reason="user_rate")
+        raise Overloaded(wait)
+
+
+@contextmanager
+def grading_slot():
+    """
+    Context manager holding one of the grading slots of this server process
+    while its block runs.
+
+    Raises:
+        Overloaded: If the maximum number of gradings are already running
+    """
+
+    if not _settings["enabled"]:
+        yield
+        return
+
+    with _lock:
+        admitted = _settings["in_flight"] < _settings["max_in_flight"]
+        if admitted:
+            _settings["in_flight"] += 1
+    if not admitted:
+        metrics.inc("aplmooc_admission_rejections_total", reason="overloaded")
+        raise Overloaded(_settings["grading_seconds"])
+
+    start = time.monotonic()
+    try:
+        yield
+    finally:
+        elapsed = time.monotonic() - start
+        with _lock:
+            _settings["in_flight"] -= 1
+            _settings["grading_seconds"] = 0.9 * _settings["grading_seconds"] + 0.1 * elapsed
+
+
+def too_many_requests(error: Overloaded):
+    """
+    Respond to a rejected submission with HTTP 429.
+
+    Args:
+        error (Overloaded): The rejection
+
+    Returns:
+        The error response, with the whole number of seconds to wait in Retry-After
+    """
+
+    retry_after = max(1, math.ceil(error.retry_after))
+    return {"error": "Too Many Requests"}, 429, {"Retry-After": str(retry_after)}
+
+
+def init_app(app: Flask):
+    """
+    Configure admission control from the application config.
+
+    Args:
+        app (Flask): The Flask application instance
+    """
+
+    if app.config["ADMISSION_USER_RATE"] <= 0:
+        raise ValueError("ADMISSION_USER_RATE must be positive")
+
+    _settings["enabled"] = app.config["ADMISSION_ENABLED"]
+    _settings["max_in_flight"] = max(
+        1, app.config["ADMISSION_MAX_IN_FLIGHT"] // app.config["ADMISSION_WORKERS"],
+    )
+    _settings["user_rate"] = app.config["ADMISSION_USER_RATE"]
+    _settings["user_burst"] = app.config["ADMISSION_USER_BURST"]
+    app.register_error_handler(Overloaded, too_many_requests)
@@ -0,0 +1,378 @@
+"""This file provides the write-behind buffer for point awards in the APL MOOC backend.
+
+By default every graded submission commits its award before responding, which
+costs one synchronous disk write per submission, serialised across workers on
+SQLite. With a write-behind durability mode, awards are instead collected in
+memory, keeping only the highest award per user and problem, and a background
+thread writes them in one transaction every few milliseconds or once enough have
+been collected. Pending awards are also written when the process exits.
+
+The `AWARDS_DURABILITY` setting chooses the trade-off:
+
+- `sync` commits each award before responding, as if there were no buffer.
+- `group` commits awards together, but each response still waits for the commit.
+  If the commit takes longer than `AWARDS_GROUP_TIMEOUT`, the award is written
+  on its own instead.
+- `async` responds before the commit, so awards pending when a worker crashes are lost.
+
+In every mode, graded submissions are counted in memory and written to the
+per-problem attempt counters every `STATS_FLUSH_INTERVAL` seconds. Each process
+also remembers the points it has read or written, up to `AWARDS_KNOWN_POINTS`
+of them. Points are never lowered, so an award no higher than remembered points
+changes nothing and is dropped without touching the database, and an award
+found to change nothing once the locks are held is rolled back. Either way, an
+award that does not change any points writes nothing.
+
+`/get` adds the awards still pending in this process to the stored totals, so a
+student sees their new points as soon as their submission has been graded. Only
+this process knows about its pending awards: a `/get` served by another worker
+shows the new points once they are committed, after at most `AWARDS_FLUSH_INTERVAL`.
+"""
+
+import atexit
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from flask import Flask, current_app
+from . import database
+from . import metrics
+
+DURABILITY_MODES = ("sync", "group", "async")
+
+_settings = {
+    "durability": "sync",
+    "buffer": None,
+    "attempts": None,
+    "group_timeout": 5,
+    "known": {},
+    "known_size": 100000,
+}
+
+
+def _remember(points: dict):
+    known = _settings["known"]
+    if len(known) + len(points) > _settings["known_size"]:
+        known.clear()
+    known.update(points)
+
+
+def _forward(source: Future, target: Future):
+    if source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(None)
+
+
+class AwardBuffer:  # pylint: disable=too-many-instance-attributes
+    """
+    Collects point awards and writes them in batches from a background thread.
+    """
+
+    def __init__(self, app: Flask, interval: float = 0.05, size: int = 500):
+        """
+        Args:
+            app (Flask): The Flask application instance whose database the awards are written to
+            interval (float, optional): Seconds between writes. Defaults to 0.05.
+            size (int, optional): Number of pending awards that triggers an early write.
+                Defaults to 500.
+        """
+
+        self.app = app
+        self.interval = interval
+        self.size = size
+        self.changes = 0
+        self._awards = {}
+        self._writing = {}
+        self._batch = Future()
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._write_lock = threading.Lock()
+        self._thread = None
+        self._stopping = False
+
+    def add(self, id_user: str, id_problem: str, points: int) -> Future:
+        """
+        Queue an award, keeping only the highest pending award per user and problem.
+
+        Args:
+            id_user (str): The user ID
+            id_problem (str): The problem ID
+            points (int): The number of points to award
+
+        Returns:
+            Future: Completes once the award has been committed
+        """
+
+        key = (id_user, id_problem)
+        with self._wake:
+            self._awards[key] = max(self._awards.get(key, points), points)
+            self.changes += 1
+            if len(self._awards) >= self.size:
+                self._wake.notify()
+
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._write_forever, name="aplmooc-awards", daemon=True,
+                )
+                self._thread.start()
+            return self._batch
+
+    def pending(self) -> dict:
+        """
+        Get the awards not yet committed.
+
+        Returns:
+            dict: The highest pending award, keyed by (user ID, problem ID)
+        """
+
+        with self._lock:
+            pending = dict(self._writing)
+            for key, points in self._awards.items():
+                pending[key] = max(pending.get(key, points), points)
+            return pending
+
+    def write(self):
+        """
+        Commit all pending awards in one transaction.
+        If the transaction fails, the awards stay pending and are retried by the next write.
+        """
+
+        with self._write_lock, self.app.app_context():
+            with self._lock:
+                awards, batch = self._awards, self._batch
+                self._awards, self._batch = {}, Future()
+                self._writing = awards
+            if not awards:
+                batch.set_result(None)
+                return
+
+            try:
+                _remember(database.insert_points_batch(awards))
+            except Exception:  # pylint: disable=broad-exception-caught
+                database.db.session.rollback()
+                metrics.inc("aplmooc_award_write_failures_total")
+                current_app.logger.exception("Writing %d awards failed", len(awards))
+                with self._lock:
+                    for key, points in awards.items():
+                        self._awards[key] = max(self._awards.get(key, points), points)
+                    self._batch.add_done_callback(lambda done: _forward(done, batch))
+                    self._writing = {}
+                return
+
+            with self._lock:
+                self._writing = {}
+            batch.set_result(None)
+
+    def _write_forever(self):
+        while True:
+            with self._wake:
+                self._wake.wait_for(
+                    lambda: self._stopping or len(self._awards) >= self.size, self.interval,
+                )
+                stopping = self._stopping
+            self.write()
+            if stopping:
+                return
+
+    def stop(self):
+        """
+        Write the pending awards and stop the background thread.
+        """
+
+        with self._wake:
+            self._stopping = True
+            self._wake.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+        self.write()
+
+
+class AttemptCounter:  # pylint: disable=too-many-instance-attributes
+    """
+    Counts graded submissions in memory and writes the counts from a background thread.
+    """
+
+    def __init__(self, app: Flask, interval: float = 5):
+        """
+        Args:
+            app (Flask): The Flask application instance whose database the counts are written to
+            interval (float, optional): Seconds between writes. Defaults to 5.
+        """
+
+        self.app = app
+        self.interval = interval
+        self._attempts = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._write_lock = threading.Lock()
+        self._thread = None
+        self._stopping = False
+
+    def add(self, id_problem: str):
+        """
+        Count a graded submission.
+
+        Args:
+            id_problem (str): The problem ID
+        """
+
+        with self._lock:
+            self._attempts[id_problem] = self._attempts.get(id_problem, 0) + 1
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._write_forever, name="aplmooc-attempts", daemon=True,
+                )
+                self._thread.start()
+
+    def write(self):
+        """
+        Add the counted submissions to the stored counters.
+        If the transaction fails, the counts are kept and retried by the next write.
+        """
+
+        with self._write_lock, self.app.app_context():
+            with self._lock:
+                attempts, self._attempts = self._attempts, {}
+            if not attempts:
+                return
+
+            try:
+                database.record_attempts(attempts)
+            except Exception:  # pylint: disable=broad-exception-caught
+                database.db.session.rollback()
+                current_app.logger.exception("Writing attempts of %d problems failed",
+                                             len(attempts))
+                with self._lock:
+                    for id_problem, count in attempts.items():
+                        self._attempts[id_problem] = self._attempts.get(id_problem, 0) + count
+
+    def _write_forever(self):
+        while True:
+            with self._wake:
+                self._wake.wait_for(lambda: self._stopping, self.interval)
+                stopping = self._stopping
+            self.write()
+            if stopping:
+                return
+
+    def stop(self):
+        """
+        Write the counted submissions and stop the background thread.
+        """
+
+        with self._wake:
+            self._stopping = True
+            self._wake.notify()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+        self.write()
+
+
+def insert_points(id_user: str, id_problem: str, points: int):
+    """
+    Award a user a certain number of points for a specific problem, in the configured
+    durability mode. If the user already has more points, nothing changes.
+
+    Args:
+        id_user (str): The user ID
+        id_problem (str): The problem ID
+        points (int): The number of points to award
+    """
+
+    if _settings["attempts"] is not None:
+        _settings["attempts"].add(id_problem)
+
+    key = (id_user, id_problem)
+    if points <= _settings["known"].get(key, -1):
+        return
+
+    buffer = _settings["buffer"]
+    if buffer is None:
+        _remember(database.insert_points_batch({key: points}))
+        return
+
+    written = buffer.add(id_user, id_problem, points)
+    if _settings["durability"] == "group":
+        try:
+            written.result(_settings["group_timeout"])
+        except FutureTimeoutError:
+            metrics.inc("aplmooc_award_group_timeouts_total")
+            _remember(database.insert_points_batch({key: points}))
+
+
+def pending_totals() -> tuple[int, dict]:
+    """
+    Compute the point totals of the users with awards pending in this process,
+    as they will be once the awards are committed.
+    Awards pending in other processes are not included.
+
+    Returns:
+        int: A counter identifying the pending awards, which changes with every new award
+        dict: The point total of each user with pending awards, keyed by user ID
+    """
+
+    buffer = _settings["buffer"]
+    if buffer is None:
+        return 0, {}
+
+    changes, pending = buffer.changes, buffer.pending()
+    if not pending:
+        return changes, {}
+
+    points = database.get_user_points(sorted({id_user for id_user, _ in pending}))
+    for key, award in pending.items():
+        points[key] = max(points.get(key, award), award)
+
+    totals = {}
+    for (id_user, _), award in points.items():
+        totals[id_user] = totals.get(id_user, 0) + award
+    return changes, totals
+
+
+def flush():
+    """
+    Commit the awards and attempt counts pending in this process.
+    """
+
+    for pending in (_settings["buffer"], _settings["attempts"]):
+        if pending is not None:
+            pending.write()
+
+
+def stop():
+    """
+    Commit the awards and attempt counts pending in this process and stop buffering.
+    """
+
+    for name in ("buffer", "attempts"):
+        pending, _settings[name] = _settings[name], None
+        if pending is not None:
+            pending.stop()
+
+
+atexit.register(stop)
+
+
+def init_app(app: Flask):
+    """
+    Configure the durability mode of point awards from the application config.
+
+    Args:
+        app (Flask): The Flask application instance
+    """
+
+    durability = app.config["AWARDS_DURABILITY"]
+    if durability not in DURABILITY_MODES:
+        raise ValueError(f"Unknown awards durability mode {durability!r}")
+
+    stop()
+    _settings["durability"] = durability
+    _settings["group_timeout"] = app.config["AWARDS_GROUP_TIMEOUT"]
+    _settings["known"] = {}
+    _settings["known_size"] = app.config["AWARDS_KNOWN_POINTS"]
+    _settings["attempts"] = AttemptCounter(app, app.config["STATS_FLUSH_INTERVAL"])
+    if durability != "sync":
+        _settings["buffer"] = AwardBuffer(
+            app, app.config["AWARDS_FLUSH_INTERVAL"], app.config["AWARDS_FLUSH_SIZE"],
+        )
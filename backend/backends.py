@@ -0,0 +1,236 @@
+"""This file provides the execution backends used by the APL MOOC grader.
+
+An execution backend runs a complete APL program and returns a dictionary in the
+format of the dyalog.run execute API: `stdout`, `stderr`, `timed_out` and `status_value`.
+Backends that already have the test framework loaded set `preloads_framework`,
+in which case the grader sends only the submission itself.
+
+Running a program first waits for a free connection or interpreter, for at most
+`acquire_timeout` seconds, and only then starts the clock on the run itself, so
+that queueing in this process is not mistaken for a slow execution backend.
+"""
+
+import asyncio
+import math
+import os
+import shlex
+import shutil
+import signal
+import tempfile
+import time
+import msgpack
+from websockets.exceptions import ConnectionClosed
+from . import metrics
+from .pool import ConnectionPool, PoolTimeout
+
+
+class ExecutionBackend:
+    """
+    The interface implemented by all execution backends.
+    """
+
+    preloads_framework = False
+
+    async def execute(self, code: str, timeout: float, deadline: float | None = None) -> dict:
+        """
+        Run a complete APL program.
+
+        Args:
+            code (str): The APL code to run
+            timeout (float): The time limit for execution in seconds
+            deadline (float, optional):
+                Seconds to wait for the response once a connection or interpreter
+                is acquired. Defaults to no limit.
+
+        Returns:
+            dict: The response in the format of the dyalog.run execute API
+
+        Raises:
+            PoolTimeout: If no connection or interpreter became free in time
+            asyncio.TimeoutError: If the response did not arrive before the deadline
+        """
+
+        raise NotImplementedError
+
+    async def close(self):
+        """
+        Release any connections or processes held by the backend.
+        """
+
+
+class DyalogRunBackend(ExecutionBackend):
+    """
+    Runs code remotely on the dyalog.run service over pooled websocket connections.
+    """
+
+    def __init__(self, url: str, *, acquire_timeout: float | None = None, **pool_options):
+        self.pool = ConnectionPool(url, **pool_options)
+        self.acquire_timeout = acquire_timeout
+
+    async def execute(self, code: str, timeout: float, deadline: float | None = None) -> dict:
+        payload = msgpack.packb({
+            "language": "dyalog_apl",
+            "code": code,
+            # The time limit has always been sent to dyalog.run in whole seconds
+            "timeout": max(1, math.ceil(timeout)),
+        })
+
+        for attempt in range(2):
+            sent = False
+            try:
+                start = time.perf_counter()
+                async with self.pool.connection(self.acquire_timeout) as websocket:
+                    acquired = time.perf_counter()
+                    metrics.observe(metrics.STAGE_SECONDS, acquired - start, stage="connect")
+                    with metrics.timer(metrics.STAGE_SECONDS, stage="send"):
+                        await asyncio.wait_for(websocket.send(payload), deadline)
+                    sent = True
+                    if deadline is not None:
+                        deadline -= time.perf_counter() - acquired
+                    with metrics.timer(metrics.STAGE_SECONDS, stage="recv"):
+                        response_raw = await asyncio.wait_for(websocket.recv(), deadline)
+                break
+            except ConnectionClosed:
+                # A pooled connection may be closed by the server while idle, but once the
+                # request is sent the server may already be running it, so it is not sent again
+                if attempt or sent:
+                    raise
+
+        response = msgpack.unpackb(response_raw, raw=False, use_list=False)
+        response.update({
+            "stdout": response["stdout"].decode(),
+            "stderr": response["stderr"].decode(),
+        })
+        return response
+
+    async def close(self):
+        await self.pool.close()
+
+
+class LocalInterpreterPool(ExecutionBackend):  # pylint: disable=too-many-instance-attributes
+    """
+    Runs code on pre-started APL interpreter processes on this host.
+
+    Each process is started in its own session and scratch directory inside the
+    sandbox command, under resource limits set with `prlimit`, and receives the test
+    framework on standard input as soon as it starts. A submission is then appended
+    to the same input stream, and the process is discarded after that single
+    submission or when it times out, while a replacement is started in the
+    background. If a process cannot be started, the error is passed on to the
+    submission waiting for it.
+
+    The sandbox command is a prefix such as `unshare` and `setpriv`, `bwrap` or
+    `nsjail` that runs the interpreter as another user without network access.
+    `{user}` in the sandbox command is replaced by `user`, which is given ownership
+    of the scratch directory.
+    """
+
+    preloads_framework = True
+
+    def __init__(self, command: str | list, framework: str, *,  # pylint: disable=too-many-arguments
+                 sandbox: str | list = (), user: int | None = None, size: int = 4,
+                 limits: dict | None = None, acquire_timeout: float | None = None):
+        self.command = shlex.split(command) if isinstance(command, str) else list(command)
+        self.framework = framework
+        sandbox = shlex.split(sandbox) if isinstance(sandbox, str) else list(sandbox)
+        self.sandbox = [part.format(user=user) for part in sandbox]
+        self.user = user
+        self.size = size
+        self.limits = {"core": 0} if limits is None else limits
+        self.acquire_timeout = acquire_timeout
+        self._ready = None
+        self._starting = set()
+
+    def _limited_command(self) -> list:
+        # The limits are set by prlimit rather than in the forked child, which is unsafe
+        # in a process with many threads
+        limits = [f"--{resource}={value}" for resource, value in self.limits.items()]
+        return [*self.sandbox, "prlimit", *limits, "--", *self.command]
+
+    async def _start(self):
+        workdir = tempfile.mkdtemp(prefix="aplmooc-")
+        process = None
+        try:
+            if self.user is not None:
+                os.chown(workdir, self.user, self.user)
+            process = await asyncio.create_subprocess_exec(
+                *self._limited_command(),
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                cwd=workdir,
+                env={"PATH": os.environ.get("PATH", ""), "HOME": workdir, "LANG": "C.UTF-8"},
+                start_new_session=True,
+            )
+            process.stdin.write(self.framework.encode())
+            await process.stdin.drain()
+        except Exception as error:  # pylint: disable=broad-exception-caught
+            if process is None:
+                shutil.rmtree(workdir, ignore_errors=True)
+            else:
+                self._discard(process, workdir)
+                await process.wait()
+            await self._ready.put(error)
+            return
+        await self._ready.put((process, workdir))
+
+    def _replenish(self):
+        if self._ready is None:
+            self._ready = asyncio.Queue()
+
+        missing = self.size - self._ready.qsize() - len(self._starting)
+        for _ in range(missing):
+            task = asyncio.get_running_loop().create_task(self._start())
+            self._starting.add(task)
+            task.add_done_callback(self._starting.discard)
+
+    @staticmethod
+    def _discard(process, workdir: str):
+        if process.returncode is None:
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:  # pragma: no cover
+                pass
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    async def execute(self, code: str, timeout: float, deadline: float | None = None) -> dict:
+        # The interpreter is killed at the time limit, so the run cannot outlast the deadline
+        del deadline
+        self._replenish()
+        try:
+            started = await asyncio.wait_for(self._ready.get(), self.acquire_timeout)
+        except asyncio.TimeoutError as error:
+            raise PoolTimeout from error
+        self._replenish()
+        if isinstance(started, Exception):
+            raise started
+        process, workdir = started
+
+        try:
+            stdout, stderr = await asyncio.wait_for(
+                process.communicate(f"{code}\n⎕OFF\n".encode()),
+                timeout,
+            )
+        except asyncio.TimeoutError:
+            self._discard(process, workdir)
+            await process.wait()
+            return {"stdout": "", "stderr": "", "timed_out": True, "status_value": 0}
+
+        self._discard(process, workdir)
+        return {
+            "stdout": stdout.decode(errors="replace"),
+            "stderr": stderr.decode(errors="replace"),
+            "timed_out": False,
+            "status_value": process.returncode,
+        }
+
+    async def close(self):
+        for task in list(self._starting):
+            task.cancel()
+        while self._ready is not None and not self._ready.empty():
+            started = self._ready.get_nowait()
+            if isinstance(started, Exception):
+                continue
+            process, workdir = started
+            self._discard(process, workdir)
+            await process.wait()
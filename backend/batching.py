@@ -0,0 +1,203 @@
+"""This file provides batched execution of submissions for the APL MOOC grader.
+
+When many submissions are waiting, the batcher packs several of them into one
+interpreter run, so that starting the interpreter and loading the test framework
+is paid once per batch rather than once per submission. Each submission is tested
+in turn and prints its result on a line tagged with a random batch nonce and its
+position, from which the results are handed back to the individual callers.
+
+The submissions of a batch share one interpreter, so they are not isolated from
+each other: a submission can change `⎕SE`, including the test framework, and
+write files, and so change how the later submissions of its batch are graded.
+Batching is therefore only allowed when every submitter is trusted, which has to
+be confirmed with `GRADER_BATCH_TRUSTED`. Before each submission, every name in
+`#` is erased, the system variables are set back to their defaults and
+`⎕SE.Test` is loaded again from `⎕SE.T`, which keeps well-behaved submissions
+from affecting each other by accident.
+
+A submission without a result line, for example because an earlier entry crashed
+the interpreter or the batch timed out, is run again on its own, so that failures
+are attributed only to the submission that caused them. Results printed before
+a batch timed out are kept, and a batch never runs longer than its entries would
+have taken on their own.
+"""
+
+import asyncio
+import json
+import secrets
+
+# Puts the workspace back into the state the test framework expects, before each batch entry
+RESET_WORKSPACE = (
+    "⎕EX ⎕NL⍳9\n"
+    "⎕IO←1\n"
+    "⎕ML←1\n"
+    "⎕PP←10\n"
+    "⎕CT←1E¯14\n"
+    "⎕DCT←1E¯28\n"
+    "⎕FR←645\n"
+    "⎕DIV←0\n"
+    "⎕SE.Test←0(220⌶)¯2(219⌶)⎕SE.T\n"
+)
+
+
+class SubmissionBatcher:  # pylint: disable=too-many-instance-attributes
+    """
+    Collects submissions for up to `linger` seconds or `size` submissions,
+    whichever comes first, and runs them together.
+    """
+
+    def __init__(self, *, run, execute_single, prologue, encode,  # pylint: disable=too-many-arguments
+                 size: int, linger: float, timeout: int):
+        """
+        Args:
+            run: Coroutine function running an APL program with a time limit
+            execute_single: Coroutine function running one submission on its own with a time limit
+            prologue: Function returning the APL code that sets up the test framework
+            encode: Function encoding a submission as APL code defining `user_code` and `opts`
+            size (int): The maximum number of submissions in a batch
+            linger (float): The maximum number of seconds to wait for a batch to fill up
+            timeout (int): The time limit for a whole batch in seconds
+        """
+
+        self.run = run
+        self.execute_single = execute_single
+        self.prologue = prologue
+        self.encode = encode
+        self.size = size
+        self.linger = linger
+        self.timeout = timeout
+        self._pending = {}
+        self._timers = {}
+        self.batches = 0
+        self.fallbacks = 0
+
+    async def execute(self, code: str, options_aplcode: str, timeout: float) -> dict:
+        """
+        Run one submission as part of a batch.
+        Only submissions with the same time limit are batched together.
+
+        Args:
+            code (str): The APL code submitted by the user
+            options_aplcode (str): The encoded options of the problem
+            timeout (float): The time limit of the submission in seconds
+
+        Returns:
+            dict: The response for this submission, as if it had been run on its own
+        """
+
+        running = asyncio.get_running_loop()
+        future = running.create_future()
+        pending = self._pending.setdefault(timeout, [])
+        pending.append((code, options_aplcode, future))
+
+        if len(pending) >= self.size:
+            self._flush(timeout)
+        elif timeout not in self._timers:
+            self._timers[timeout] = running.call_later(self.linger, self._flush, timeout)
+
+        return await future
+
+    def _flush(self, timeout: float):
+        timer = self._timers.pop(timeout, None)
+        if timer is not None:
+            timer.cancel()
+
+        entries = self._pending.pop(timeout, [])
+        if entries:
+            asyncio.get_running_loop().create_task(self._run_batch(entries, timeout))
+
+    def build_program(self, nonce: str, entries: list) -> str:
+        """
+        Build one APL program testing several submissions in turn.
+
+        Args:
+            nonce (str): The random tag of this batch's result lines
+            entries (list): The (code, options_aplcode) pairs of the submissions
+
+        Returns:
+            str: The APL program
+        """
+
+        program = [self.prologue(), "⎕PW←32767\n"]
+        for index, (code, options_aplcode) in enumerate(entries):
+            # Undo what a well-behaved previous submission left behind before testing the next one
+            program.append(RESET_WORKSPACE)
+            program.append(self.encode(code, options_aplcode))
+            program.append(f"⎕←'{nonce}:{index}:',1⎕JSON opts ⎕SE.Test.Run user_code\n")
+        return "".join(program)
+
+    @staticmethod
+    def split_output(nonce: str, stdout: str) -> dict:
+        """
+        Find the result line of each submission in the output of a batch.
+        Submissions with a missing or repeated result line are left out.
+
+        Args:
+            nonce (str): The random tag of this batch's result lines
+            stdout (str): The output of the batch
+
+        Returns:
+            dict: The result line of each submission, keyed by its position in the batch
+        """
+
+        results = {}
+        repeated = set()
+        for line in stdout.splitlines():
+            tag, _, output = line.partition(":")
+            if tag != nonce:
+                continue
+            index, _, output = output.partition(":")
+            if index in results:
+                repeated.add(index)
+            results[index] = output
+
+        return {int(index): output for index, output in results.items() if index not in repeated}
+
+    async def _run_batch(self, entries: list, timeout: float):
+        if len(entries) == 1:
+            code, options_aplcode, future = entries[0]
+            await self._settle(future, self.execute_single(code, options_aplcode, timeout))
+            return
+
+        self.batches += 1
+        nonce = secrets.token_hex(8)
+        program = self.build_program(nonce, [entry[:2] for entry in entries])
+
+        try:
+            # A batch is never cut shorter than the time limit of a single entry,
+            # nor runs longer than all its entries would have on their own
+            response = await self.run(
+                program, min(max(self.timeout, timeout), timeout * len(entries)),
+            )
+            outputs = self.split_output(nonce, response["stdout"])
+        except Exception:  # pylint: disable=broad-exception-caught
+            outputs = {}
+
+        retries = []
+        for index, (code, options_aplcode, future) in enumerate(entries):
+            output = outputs.get(index)
+            if output is None:
+                retries.append(self._settle(
+                    future, self.execute_single(code, options_aplcode, timeout),
+                ))
+                continue
+            try:
+                json.loads(output)
+            except ValueError:
+                retries.append(self._settle(
+                    future, self.execute_single(code, options_aplcode, timeout),
+                ))
+                continue
+            future.set_result({
+                "stdout": output, "stderr": "", "timed_out": False, "status_value": 0,
+            })
+
+        self.fallbacks += len(retries)
+        await asyncio.gather(*retries)
+
+    @staticmethod
+    async def _settle(future: asyncio.Future, coro):
+        try:
+            future.set_result(await coro)
+        except Exception as error:  # pylint: disable=broad-exception-caught
+            future.set_exception(error)
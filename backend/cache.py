@@ -0,0 +1,211 @@
+"""This file provides the persistent caches of the APL MOOC backend.
+
+Cache entries are stored in the CacheEntries table, so that all server processes
+share them. Each cache has its own namespace in the table, a time-to-live for
+its entries, and a maximum size above which the least recently used entries
+are evicted. Values are stored as JSON.
+
+To keep writes off the lookup path, the last use of an entry is only recorded
+once the previous record is older than a fraction of the TTL, so eviction order
+is approximate to within that time.
+"""
+
+import hashlib
+import json
+import time
+from sqlalchemy.exc import IntegrityError
+from . import metrics
+from .database import db, upsert, CacheEntries
+
+MISSING = object()
+
+
+def hash_key(*parts: str) -> str:
+    """
+    Derive a fixed-length cache key from arbitrary strings, such as secret tokens or source code.
+
+    Args:
+        *parts (str): The strings identifying the cached value
+
+    Returns:
+        str: A hexadecimal SHA-256 digest of the parts
+    """
+
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class TTLCache:  # pylint: disable=too-many-instance-attributes
+    """
+    A size-bounded cache with expiring entries, backed by the database.
+
+    The hit and miss counters count lookups made by this process, which are also
+    exported as the `aplmooc_cache_lookups_total` metric labelled by namespace.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self, namespace: str, ttl: float, max_entries: int, evict_every: int = 100,
+        touch_fraction: float = 0.1,
+    ):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.touch_after = ttl * touch_fraction
+        self.max_entries = max_entries
+        self.evict_every = evict_every
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+
+    def get(self, key: str, default=MISSING, count: bool = True):
+        """
+        Look up a value in the cache.
+
+        Args:
+            key (str): The cache key
+            default (optional):
+                The value returned if the key is not cached or has expired.
+                Defaults to `cache.MISSING`, to distinguish cached None values.
+            count (bool, optional):
+                Whether to count the lookup as a hit or miss, which repeated polling
+                for the same key should not. Defaults to `True`.
+
+        Returns:
+            The cached value, or `default`
+        """
+
+        now = time.time()
+        entry = db.session.get(CacheEntries, (self.namespace, key))
+
+        if entry is None or entry.expires <= now:
+            if count:
+                self.misses += 1
+                metrics.inc("aplmooc_cache_lookups_total", cache=self.namespace, result="miss")
+            # End the read transaction, as a miss is usually followed by slow work
+            # that should not hold a database connection
+            db.session.commit()
+            return default
+
+        if count:
+            self.hits += 1
+            metrics.inc("aplmooc_cache_lookups_total", cache=self.namespace, result="hit")
+        value = json.loads(entry.value)
+        if now - entry.last_used > self.touch_after:
+            entry.last_used = now
+        db.session.commit()
+        return value
+
+    def set(self, key: str, value, ttl: float | None = None):
+        """
+        Store a value in the cache, replacing any existing value.
+
+        Args:
+            key (str): The cache key
+            value: A JSON-serialisable value
+            ttl (float, optional): Seconds until the entry expires. Defaults to the cache TTL.
+        """
+
+        now = time.time()
+        entry = CacheEntries(
+            namespace=self.namespace,
+            key=key,
+            value=json.dumps(value),
+            expires=now + (self.ttl if ttl is None else ttl),
+            last_used=now,
+        )
+
+        try:
+            db.session.merge(entry)
+            db.session.commit()
+        except IntegrityError:  # pragma: no cover
+            # Another process stored the same key concurrently
+            db.session.rollback()
+
+        self._writes += 1
+        if self._writes % self.evict_every == 0:
+            self.evict()
+
+    def add(self, key: str, value, ttl: float | None = None) -> bool:
+        """
+        Store a value in the cache only if the key is not cached or has expired.
+        Only one of several processes adding the same key at once succeeds.
+
+        Args:
+            key (str): The cache key
+            value: A JSON-serialisable value
+            ttl (float, optional): Seconds until the entry expires. Defaults to the cache TTL.
+
+        Returns:
+            bool: Whether the value was stored
+        """
+
+        now = time.time()
+        statement = upsert(CacheEntries).values(
+            namespace=self.namespace,
+            key=key,
+            value=json.dumps(value),
+            expires=now + (self.ttl if ttl is None else ttl),
+            last_used=now,
+        )
+        statement = statement.on_conflict_do_update(
+            index_elements=["namespace", "key"],
+            set_={
+                "value": statement.excluded.value,
+                "expires": statement.excluded.expires,
+                "last_used": statement.excluded.last_used,
+            },
+            where=CacheEntries.expires <= now,
+        )
+
+        added = db.session.execute(statement).rowcount
+        db.session.commit()
+        return bool(added)
+
+    def delete(self, key: str):
+        """
+        Remove a value from the cache.
+
+        Args:
+            key (str): The cache key
+        """
+
+        db.session.execute(
+            db.delete(CacheEntries)
+            .where(CacheEntries.namespace==self.namespace)
+            .where(CacheEntries.key==key)
+        )
+        db.session.commit()
+
+    def evict(self):
+        """
+        Remove expired entries, then the least recently used entries above the size limit.
+        """
+
+        db.session.execute(
+            db.delete(CacheEntries)
+            .where(CacheEntries.namespace==self.namespace)
+            .where(CacheEntries.expires <= time.time())
+        )
+
+        oldest = (
+            db.select(CacheEntries.key)
+            .where(CacheEntries.namespace==self.namespace)
+            .order_by(CacheEntries.last_used.desc())
+            .offset(self.max_entries)
+        )
+        db.session.execute(
+            db.delete(CacheEntries)
+            .where(CacheEntries.namespace==self.namespace)
+            .where(CacheEntries.key.in_(oldest))
+        )
+        db.session.commit()
+
+    def clear(self):
+        """
+        Remove all entries of this cache.
+        """
+
+        db.session.execute(db.delete(CacheEntries).where(CacheEntries.namespace==self.namespace))
+        db.session.commit()
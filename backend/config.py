@@ -0,0 +1,113 @@
+"""This file contains the default configuration of the APL MOOC backend.
+
+Every value can be overridden with a `FLASK_`-prefixed environment variable,
+for example `FLASK_GRADER_POOL_SIZE=8`. The README describes each setting.
+"""
+
+import os
+
+# Database
+SQLALCHEMY_DATABASE_URI = "sqlite:///points.db"
+SQLALCHEMY_ENGINE_OPTIONS = {}
+DATABASE_READ_URI = None
+DATABASE_POOL_SIZE = 8
+DATABASE_MAX_OVERFLOW = 16
+DATABASE_POOL_RECYCLE = 1800
+DATABASE_POOL_PRE_PING = True
+SQLITE_JOURNAL_MODE = "wal"
+SQLITE_SYNCHRONOUS = "normal"
+SQLITE_BUSY_TIMEOUT = 30000
+
+# Point awards
+AWARDS_DURABILITY = "sync"
+AWARDS_FLUSH_INTERVAL = 0.05
+AWARDS_FLUSH_SIZE = 500
+AWARDS_GROUP_TIMEOUT = 5
+AWARDS_KNOWN_POINTS = 100000
+STATS_FLUSH_INTERVAL = 5
+
+# Score export
+EXPORT_BATCH_SIZE = 1000
+
+# Problems
+PROBLEMS_DIR = "problems"
+PROBLEMS_CHECK_INTERVAL = 5
+
+# Submissions
+MAX_CODE_SIZE = 64 * 1024
+
+# Code execution
+GRADER_BACKEND = "dyalog_run"
+GRADER_URL = "wss://dyalog.run/api/v0/ws/execute"
+GRADER_POOL_SIZE = 16
+GRADER_POOL_MAX_IDLE = 60
+GRADER_POOL_PING_AFTER = 5
+GRADER_LOCAL_COMMAND = "dyalog -script DYALOG_NOPOPUPS=1"
+GRADER_LOCAL_POOL_SIZE = os.cpu_count() or 1
+GRADER_LOCAL_SANDBOX = (
+    "unshare --net --ipc --uts --pid --mount-proc --kill-child "
+    "setpriv --reuid={user} --regid={user} --clear-groups --no-new-privs --"
+)
+GRADER_LOCAL_USER = 65534
+GRADER_LOCAL_MEMORY_LIMIT = 1024
+GRADER_LOCAL_CPU_LIMIT = 60
+GRADER_LOCAL_FILE_LIMIT = 16
+GRADER_LOCAL_PROCESS_LIMIT = 1024
+GRADER_BATCH_SIZE = 1
+GRADER_BATCH_LINGER = 0.05
+GRADER_BATCH_TIMEOUT = 10
+GRADER_BATCH_TRUSTED = False
+GRADER_DEADLINE_MARGIN = 5
+GRADER_ACQUIRE_TIMEOUT = 30
+
+# Execution time limits
+GRADER_TIME_LIMIT = 5
+GRADER_ADAPTIVE_TIME_LIMIT = False
+GRADER_TIME_LIMIT_MULTIPLE = 3
+GRADER_TIME_LIMIT_MIN = 1
+GRADER_TIME_LIMIT_SAMPLES = 100
+
+# Resilience to a slow or failing execution backend
+GRADER_HEDGE_ENABLED = True
+GRADER_HEDGE_QUANTILE = 0.95
+GRADER_HEDGE_MAX_FRACTION = 0.1
+GRADER_BREAKER_ENABLED = True
+GRADER_BREAKER_THRESHOLD = 0.5
+GRADER_BREAKER_WINDOW = 20
+GRADER_BREAKER_MIN_CALLS = 10
+GRADER_BREAKER_COOLDOWN = 10
+
+# mooc.fi user lookups
+MOOC_API = "https://www.mooc.fi/api/v8"
+MOOC_CACHE_TTL = 300
+MOOC_CACHE_NEGATIVE_TTL = 30
+MOOC_CACHE_SIZE = 10000
+
+# Grading result memoisation
+RESULT_CACHE_ENABLED = True
+RESULT_CACHE_TTL = 7 * 24 * 3600
+RESULT_CACHE_SIZE = 50000
+
+# Coalescing of identical submissions graded at the same time
+COALESCE_ENABLED = True
+COALESCE_LEASE = 30
+COALESCE_POLL_INTERVAL = 0.1
+
+# Submission queue
+QUEUE_ENABLED = False
+QUEUE_WORKERS = 4
+QUEUE_POLL_INTERVAL = 0.2
+QUEUE_LEASE = 60
+QUEUE_MAX_ATTEMPTS = 5
+QUEUE_RETRY_DELAY = 5
+QUEUE_MAX_WAIT = 30
+
+# Admission control
+ADMISSION_ENABLED = True
+ADMISSION_MAX_IN_FLIGHT = 64
+ADMISSION_WORKERS = int(os.environ.get("GUNICORN_WORKERS", "4"))
+ADMISSION_USER_RATE = 0.5
+ADMISSION_USER_BURST = 10
+
+# Metrics
+METRICS_FLUSH_INTERVAL = 5
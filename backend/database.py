@@ -1,3 +1,4 @@
+# pylint: disable=too-many-lines
 """This file provides the APL MOOC backend database models and functions.
 
 Each database function performs one task, such as reading
@@ -7,11 +8,18 @@ IDs and points are valid in the functions calling the database functions.
 """
 
 import os
+import hashlib
 import json
-from flask import Blueprint
+import time
+import uuid
+import click
+from flask import Blueprint, Flask, current_app
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import UniqueConstraint, event
+from sqlalchemy import (
+    Integer, String, UniqueConstraint, case, cast, create_engine, event, inspect, literal, text,
+)
 from sqlalchemy.sql import func
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
 from sqlalchemy.engine import Connection
 from sqlalchemy.schema import Table
@@ -34,19 +42,130 @@ class Points(db.Model):  # pylint: disable=too-few-public-methods
 
     id: Mapped[int] = mapped_column(primary_key=True)
     id_user: Mapped[str] = mapped_column()
-    id_problem: Mapped[str] = mapped_column()
+    id_problem: Mapped[str] = mapped_column(index=True)
     points: Mapped[int] = mapped_column()
     __table_args__ = (UniqueConstraint("id_user", "id_problem", name="unique_user_problem"),)
 
 
+class UserTotals(db.Model):  # pylint: disable=too-few-public-methods
+    """
+    The model for the UserTotals database table, which holds each user's point total.
+    It is kept up to date by `insert_points` and can be rebuilt from Points with `rebuild_totals`.
+    """
+
+    id_user: Mapped[str] = mapped_column(primary_key=True)
+    points: Mapped[int] = mapped_column()
+    seq: Mapped[int] = mapped_column(index=True, default=0)
+
+
+class ProblemStats(db.Model):  # pylint: disable=too-few-public-methods
+    """
+    The model for the ProblemStats database table, which holds counters per problem.
+    `attempts` counts graded submissions, and `points_0` to `points_2` count the users
+    whose best result is that many points. It is kept up to date by `insert_points`.
+    """
+
+    id_problem: Mapped[str] = mapped_column(primary_key=True)
+    attempts: Mapped[int] = mapped_column(default=0)
+    points_0: Mapped[int] = mapped_column(default=0)
+    points_1: Mapped[int] = mapped_column(default=0)
+    points_2: Mapped[int] = mapped_column(default=0)
+
+
 class Problems(db.Model):  # pylint: disable=too-few-public-methods
     """
     The model for the Problems database table.
+    `content_hash` is the hash of the problem file the configuration was read from,
+    and `version` is increased every time the configuration changes.
     """
 
     id: Mapped[int] = mapped_column(primary_key=True)
     id_problem: Mapped[str] = mapped_column(unique=True)
     config: Mapped[str] = mapped_column()
+    content_hash: Mapped[str | None] = mapped_column()
+    version: Mapped[int] = mapped_column(default=1)
+
+
+class Meta(db.Model):  # pylint: disable=too-few-public-methods
+    """
+    The model for the Meta database table, which holds key-value state such as version stamps.
+    """
+
+    key: Mapped[str] = mapped_column(primary_key=True)
+    value: Mapped[str] = mapped_column()
+
+
+class Jobs(db.Model):  # pylint: disable=too-few-public-methods
+    """
+    The model for the Jobs database table, which holds queued submissions.
+    A queued job is not claimed before its `updated` time, which lies in the future
+    while a failed attempt waits to be retried.
+    """
+
+    id: Mapped[str] = mapped_column(primary_key=True)
+    id_user: Mapped[str] = mapped_column()
+    id_problem: Mapped[str] = mapped_column()
+    code: Mapped[str] = mapped_column()
+    status: Mapped[str] = mapped_column(index=True)
+    points: Mapped[int | None] = mapped_column()
+    feedback: Mapped[str | None] = mapped_column()
+    attempts: Mapped[int] = mapped_column(default=0)
+    created: Mapped[float] = mapped_column()
+    updated: Mapped[float] = mapped_column()
+
+
+class CacheEntries(db.Model):  # pylint: disable=too-few-public-methods
+    """
+    The model for the CacheEntries database table, shared by all caches in `backend.cache`.
+    """
+
+    namespace: Mapped[str] = mapped_column(primary_key=True)
+    key: Mapped[str] = mapped_column(primary_key=True)
+    value: Mapped[str] = mapped_column()
+    expires: Mapped[float] = mapped_column()
+    last_used: Mapped[float] = mapped_column(index=True)
+
+
+class RateLimits(db.Model):  # pylint: disable=too-few-public-methods
+    """
+    The model for the RateLimits database table, which holds a token bucket per rate-limited key.
+    """
+
+    key: Mapped[str] = mapped_column(primary_key=True)
+    tokens: Mapped[float] = mapped_column()
+    updated: Mapped[float] = mapped_column()
+
+
+# Columns added to tables since they were first released, with the definition they are added with
+ADDED_COLUMNS = {
+    "problems": {
+        "content_hash": "VARCHAR",
+        "version": "INTEGER NOT NULL DEFAULT 1",
+    },
+}
+
+# These tables are initialised together with state in Meta, so Meta must be created first
+Problems.__table__.add_is_dependent_on(Meta.__table__)
+UserTotals.__table__.add_is_dependent_on(Meta.__table__)
+
+
+@event.listens_for(UserTotals.__table__, "after_create")
+def init_points_sequence(target: Table, connection: Connection, **kwargs):
+    """
+    Starts the change sequence of the point totals at zero.
+
+    Args:
+        target (Table): The table variable automatically provided by Flask
+        connection (Connection): The connection variable automatically provided by Flask
+        **kwargs: Any other arguments. Ignored.
+    """
+
+    del target, kwargs
+
+    meta = Meta.__table__
+    connection.execute(meta.delete().where(meta.c.key=="points_seq"))
+    connection.execute(meta.insert(), {"key": "points_seq", "value": "0"})
+    bump_version(connection, "points_epoch")
 
 
 @event.listens_for(Problems.__table__, "after_create")
@@ -60,30 +179,184 @@ def init_problems(target: Table, connection: Connection, **kwargs):
         **kwargs: Any other arguments. Ignored.
     """
 
-    del kwargs
+    del target, kwargs
 
-    connection.execute(target.delete())
+    sync_problem_files(connection, current_app.config["PROBLEMS_DIR"])
 
-    problem_files = [
-        os.path.join("problems", file) for file in os.listdir("problems")
-        if os.path.isfile(os.path.join("problems", file))
-        and os.path.splitext(file)[-1].lower() == ".json"
-    ]
 
-    for filename in problem_files:
-        with open(filename, "r", encoding="utf-8") as f:
-            problem_config = json.load(f)
+def sync_problem_files(connection: Connection, problems_dir: str) -> dict:
+    """
+    Bring the Problems table up to date with the problem files in a directory.
+
+    Only files whose content hash is not in the table are parsed, and only the
+    problems they define are written, increasing their version. Problems without
+    a file are removed. If anything changed, the `problems_version` stamp is
+    bumped, so that server processes reload the changed problems.
+
+    Files that are not valid problem configurations are logged and skipped, and no
+    problems are removed while any file is invalid, so that the problem of a file
+    being edited keeps its current row. Of several files defining the same problem,
+    only the first in name order is used.
+
+    Args:
+        connection (Connection): The connection to write with, in the caller's transaction
+        problems_dir (str): The directory of problem configuration files
+
+    Returns:
+        dict:
+            The IDs of the added, updated and removed problems,
+            and the names of the invalid and duplicate files
+    """
+
+    problems = Problems.__table__
+    existing = {
+        row.id_problem: row.content_hash
+        for row in connection.execute(db.select(problems.c.id_problem, problems.c.content_hash))
+    }
+    known_hashes = {content_hash: id_problem for id_problem, content_hash in existing.items()}
+
+    sources = {}
+    changed = {}
+    invalid, duplicates = [], []
+    for entry in sorted(os.scandir(problems_dir), key=lambda entry: entry.name):
+        if not entry.is_file() or os.path.splitext(entry.name)[-1].lower() != ".json":
+            continue
 
-        id_problem = problem_config.get("id")
-        if id_problem is None:  # pragma: no cover
+        content_hash, id_problem, problem_config = _read_problem_file(entry.path, known_hashes)
+        if id_problem is None:
+            current_app.logger.warning("Skipping invalid problem file %s", entry.name)
+            invalid.append(entry.name)
             continue
 
-        connection.execute(target.insert(), {
+        if id_problem in sources:
+            current_app.logger.warning(
+                "Skipping problem file %s, which defines %s like %s",
+                entry.name, id_problem, sources[id_problem],
+            )
+            duplicates.append(entry.name)
+            continue
+        sources[id_problem] = entry.name
+        if problem_config is None:
+            continue
+
+        changed[id_problem] = {
             "id_problem": id_problem,
             "config": json.dumps(problem_config),
-        })
+            "content_hash": content_hash,
+            "version": 1,
+        }
+
+    removed = [] if invalid else sorted(set(existing) - set(sources))
+    if removed:
+        connection.execute(problems.delete().where(problems.c.id_problem.in_(removed)))
+
+    if changed:
+        statement = upsert(Problems)
+        connection.execute(statement.on_conflict_do_update(
+            index_elements=["id_problem"],
+            set_={
+                "config": statement.excluded.config,
+                "content_hash": statement.excluded.content_hash,
+                "version": problems.c.version + 1,
+            },
+        ), list(changed.values()))
+
+    if changed or removed:
+        bump_version(connection, "problems_version")
 
-    connection.commit()
+    return {
+        "added": sorted(id_problem for id_problem in changed if id_problem not in existing),
+        "updated": sorted(id_problem for id_problem in changed if id_problem in existing),
+        "removed": removed,
+        "invalid": invalid,
+        "duplicates": duplicates,
+    }
+
+
+def _read_problem_file(path: str, known_hashes: dict) -> tuple:
+    # Returns the content hash, problem ID and configuration, which is None if the file is
+    # already in the table, or an ID of None if the file is not a valid problem configuration
+    with open(path, "rb") as f:
+        content = f.read()
+    content_hash = hashlib.sha256(content).hexdigest()
+    if content_hash in known_hashes:
+        return content_hash, known_hashes[content_hash], None
+
+    try:
+        problem_config = json.loads(content)
+        return content_hash, problem_config["id"], problem_config
+    except (ValueError, TypeError, KeyError):
+        return content_hash, None, None
+
+
+def bump_version(connection: Connection, key: str):
+    """
+    Replace a version stamp in the Meta table with a new unique value,
+    signalling other processes to reload any state derived from it.
+
+    Args:
+        connection (Connection): The connection to write with
+        key (str): The name of the version stamp
+    """
+
+    meta = Meta.__table__
+    connection.execute(meta.delete().where(meta.c.key==key))
+    connection.execute(meta.insert(), {"key": key, "value": uuid.uuid4().hex})
+
+
+def configure_sqlite(dbapi_connection, connection_record, app: Flask):
+    """
+    Tune a new SQLite connection for concurrent writers in several server processes.
+
+    Args:
+        dbapi_connection: The new DB-API connection
+        connection_record: The connection pool record. Ignored.
+        app (Flask): The Flask application instance
+    """
+
+    del connection_record
+
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={app.config['SQLITE_JOURNAL_MODE']}")
+    cursor.execute(f"PRAGMA synchronous={app.config['SQLITE_SYNCHRONOUS']}")
+    cursor.execute(f"PRAGMA busy_timeout={int(app.config['SQLITE_BUSY_TIMEOUT'])}")
+    cursor.close()
+
+
+def init_app(app: Flask):
+    """
+    Set up the database connections for the application.
+
+    Args:
+        app (Flask): The Flask application instance
+    """
+
+    engine_options = {
+        "pool_size": app.config["DATABASE_POOL_SIZE"],
+        "max_overflow": app.config["DATABASE_MAX_OVERFLOW"],
+        "pool_recycle": app.config["DATABASE_POOL_RECYCLE"],
+        "pool_pre_ping": app.config["DATABASE_POOL_PRE_PING"],
+        **app.config["SQLALCHEMY_ENGINE_OPTIONS"],
+    }
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options
+
+    db.init_app(app)
+    app.register_blueprint(bp)
+
+    engines = []
+    with app.app_context():
+        engines.append(db.engine)
+    if app.config["DATABASE_READ_URI"]:
+        # Not a Flask-SQLAlchemy bind, as no tables are created in the replica
+        engines.append(create_engine(app.config["DATABASE_READ_URI"], **engine_options))
+        app.extensions["aplmooc_read_engine"] = engines[-1]
+
+    for engine in engines:
+        if engine.dialect.name == "sqlite":
+            event.listen(
+                engine, "connect",
+                lambda connection, record: configure_sqlite(connection, record, app),
+            )
 
 
 @bp.cli.command("init_db")
@@ -96,6 +369,171 @@ def init_db():
 
     db.create_all()
 
+    # create_all skips existing tables, so add columns and indexes introduced since separately
+    with db.engine.begin() as connection:
+        add_missing_columns(connection)
+    for index in Points.__table__.indexes:
+        index.create(db.engine, checkfirst=True)
+
+    # Tables derived from Points start out empty when added to an existing database,
+    # so fill them from the points already awarded
+    if not is_empty(Points):
+        if is_empty(UserTotals):
+            rebuild_user_totals()
+        if is_empty(ProblemStats):
+            rebuild_problem_stats()
+
+
+def is_empty(model: type[db.Model]) -> bool:
+    """
+    Check whether a table has no rows.
+
+    Args:
+        model (type): The model of the table
+
+    Returns:
+        bool: True if the table has no rows
+    """
+
+    row = db.session.execute(db.select(literal(1)).select_from(model).limit(1)).first()
+    db.session.commit()
+    return row is None
+
+
+def add_missing_columns(connection: Connection) -> list:
+    """
+    Add the columns in `ADDED_COLUMNS` to existing tables created without them.
+
+    Args:
+        connection (Connection): The connection to write with, in the caller's transaction
+
+    Returns:
+        list: The added columns, as "table.column"
+    """
+
+    inspector = inspect(connection)
+    added = []
+    for table, columns in ADDED_COLUMNS.items():
+        existing = {column["name"] for column in inspector.get_columns(table)}
+        for column, definition in columns.items():
+            if column not in existing:
+                connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {definition}"))
+                added.append(f"{table}.{column}")
+    return added
+
+
+@bp.cli.command("sync_problems")
+@click.option("--watch", is_flag=True, help="Keep checking the problem files for changes.")
+@click.option("--interval", default=2.0, show_default=True,
+              help="Seconds between checks when watching.")
+def sync_problems(watch: bool, interval: float):
+    """
+    Updates the Problems table from the problem files, writing only the changed problems.
+
+    To run this command, run `flask --app backend sync_problems` in the console.
+    """
+
+    while True:
+        with db.engine.begin() as connection:
+            changes = sync_problem_files(connection, current_app.config["PROBLEMS_DIR"])
+
+        for change, problems in changes.items():
+            for id_problem in problems:
+                click.echo(f"{change} {id_problem}")
+
+        if not watch:
+            break
+        time.sleep(interval)
+
+
+@bp.cli.command("rebuild_totals")
+def rebuild_totals():
+    """
+    Recomputes every user's point total from the Points table.
+
+    To run this command, run `flask --app backend rebuild_totals` in the console.
+    """
+
+    rebuild_user_totals()
+
+
+@bp.cli.command("rebuild_stats")
+def rebuild_stats():
+    """
+    Recomputes the per-problem outcome counts from the Points table.
+
+    To run this command, run `flask --app backend rebuild_stats` in the console.
+    """
+
+    rebuild_problem_stats()
+
+
+def rebuild_user_totals():
+    """
+    Replaces the contents of the UserTotals table with totals computed from the Points table.
+    """
+
+    seq = next_points_seq()
+    db.session.execute(db.delete(UserTotals))
+    db.session.execute(
+        db.insert(UserTotals).from_select(
+            ["id_user", "points", "seq"],
+            db.select(Points.id_user, func.sum(Points.points), literal(seq))
+            .group_by(Points.id_user),
+        )
+    )
+    db.session.commit()
+
+
+def rebuild_problem_stats():
+    """
+    Recomputes the outcome counts in the ProblemStats table from the Points table.
+    Attempt counts cannot be recomputed, so they are kept, but raised to at least
+    the number of users who attempted the problem.
+    """
+
+    counts = {}
+    for id_problem, points, users in db.session.execute(
+        db.select(Points.id_problem, Points.points, func.count())
+        .group_by(Points.id_problem, Points.points)
+    ):
+        counts.setdefault(id_problem, {"points_0": 0, "points_1": 0, "points_2": 0})
+        counts[id_problem][f"points_{points}"] = users
+
+    db.session.execute(db.update(ProblemStats).values(points_0=0, points_1=0, points_2=0))
+    for id_problem, outcomes in counts.items():
+        stats = db.session.get(ProblemStats, id_problem) or ProblemStats(
+            id_problem=id_problem, attempts=0,
+        )
+        for column, users in outcomes.items():
+            setattr(stats, column, users)
+        stats.attempts = max(stats.attempts, sum(outcomes.values()))
+        db.session.add(stats)
+    db.session.commit()
+
+
+def get_problem_stats(id_problem: str | None = None) -> list:
+    """
+    Gets the attempt and outcome counters of each problem.
+
+    Args:
+        id_problem (str, optional): Only return the counters of this problem. Defaults to all.
+
+    Returns:
+        list: A list of dictionaries containing the counters of each problem
+    """
+
+    query = db.select(*ProblemStats.__table__.columns).order_by(ProblemStats.id_problem)
+    if id_problem is not None:
+        query = query.where(ProblemStats.id_problem==id_problem)
+
+    return [{
+        "id_problem": stats.id_problem,
+        "attempts": stats.attempts,
+        "users": stats.points_0 + stats.points_1 + stats.points_2,
+        "outcomes": {"0": stats.points_0, "1": stats.points_1, "2": stats.points_2},
+    } for stats in read(query)]
+
 
 def get_problem_config(id_problem: str) -> dict | None:
     """
@@ -121,18 +559,140 @@ def get_problem_config(id_problem: str) -> dict | None:
     return json.loads(result)
 
 
-def get_all_points() -> list:
+def get_all_problem_configs(ids: list | None = None) -> dict:
+    """
+    Returns the problem configurations of all problems from the Problems table.
+
+    Args:
+        ids (list, optional): Only return the configurations of these problems. Defaults to all.
+
+    Returns:
+        dict: The parsed JSON configuration of each problem, keyed by problem ID
+    """
+
+    query = db.select(Problems.id_problem, Problems.config)
+    if ids is not None:
+        query = query.where(Problems.id_problem.in_(ids))
+
+    results = db.session.execute(query).all()
+    return {row[0]: json.loads(row[1]) for row in results}
+
+
+def get_problem_versions() -> dict:
+    """
+    Returns the version of each problem in the Problems table.
+
+    Returns:
+        dict: The version of each problem, keyed by problem ID
+    """
+
+    results = db.session.execute(db.select(Problems.id_problem, Problems.version)).all()
+    return {row[0]: row[1] for row in results}
+
+
+def read(statement, **kwargs):
+    """
+    Execute a read-only statement, on the read replica if one is configured.
+    Only use this for reads that may lag slightly behind the latest writes.
+
+    Args:
+        statement: The statement to execute
+        **kwargs: Any other arguments of `Session.execute`
+
+    Returns:
+        Result: The result of the statement
+    """
+
+    engine = current_app.extensions.get("aplmooc_read_engine") or db.engine
+    return db.session.execute(statement, bind_arguments={"bind": engine}, **kwargs)
+
+
+def advisory_lock(name: str):
+    """
+    Serialise the transactions taking the same lock, until the current transaction ends.
+    SQLite already serialises all writing transactions, so the lock is only taken on PostgreSQL.
+
+    Args:
+        name (str): The name of the lock
+    """
+
+    if db.engine.dialect.name == "postgresql":
+        key = int.from_bytes(hashlib.sha256(name.encode()).digest()[:8], "big", signed=True)
+        db.session.execute(db.select(func.pg_advisory_xact_lock(key)))
+
+
+def get_version(key: str) -> str | None:
+    """
+    Returns a version stamp from the Meta table.
+
+    Args:
+        key (str): The name of the version stamp
+
+    Returns:
+        str: The current version stamp, or None if it has never been set
+    """
+
+    return db.session.execute(db.select(Meta.value).where(Meta.key==key)).scalar()
+
+
+def get_points_seq() -> tuple[str, int]:
+    """
+    Gets the current position of the change sequence of the point totals.
+    The sequence increases every time a user's total changes.
+
+    Returns:
+        str: A random stamp identifying this database, which changes if the sequence restarts
+        int: The current sequence number
+    """
+
+    rows = dict(read(
+        db.select(Meta.key, Meta.value)
+        .where(Meta.key.in_(("points_epoch", "points_seq")))
+    ).all())
+    return rows.get("points_epoch", ""), int(rows.get("points_seq", 0))
+
+
+def next_points_seq(count: int = 1) -> int:
+    """
+    Advance the change sequence of the point totals.
+    The change is not committed, so that it is part of the caller's transaction.
+
+    Args:
+        count (int, optional): The number of sequence numbers to take. Defaults to 1.
+
+    Returns:
+        int: The new sequence number, the last of those taken
+    """
+
+    return int(db.session.execute(
+        db.update(Meta)
+        .where(Meta.key=="points_seq")
+        .values(value=cast(cast(Meta.value, Integer) + count, String))
+        .returning(Meta.value)
+    ).scalar())
+
+
+def get_all_points(since: int | None = None) -> list:
     """
     Gets all the point totals per user from the database.
 
+    Args:
+        since (int, optional):
+            Only return the totals that changed after this sequence number.
+            Defaults to returning all totals.
+
     Returns:
         list: A list of dictionaries containing the user IDs and total points
     """
 
-    results =  db.session.execute(
-        db.select(Points.id_user, func.sum(Points.points))
-        .group_by(Points.id_user)
-    ).all()
+    query = (
+        db.select(UserTotals.id_user, UserTotals.points)
+        .order_by(UserTotals.id_user)
+    )
+    if since is not None:
+        query = query.where(UserTotals.seq > since)
+
+    results = read(query).all()
 
     return [{
         "id_user": row[0],
@@ -140,34 +700,446 @@ def get_all_points() -> list:
     } for row in results]
 
 
+def get_user_points(id_users: list) -> dict:
+    """
+    Gets the points of some users for each problem they have attempted, from the primary database.
+
+    Args:
+        id_users (list): The user IDs
+
+    Returns:
+        dict: The points of each user for each problem, keyed by (user ID, problem ID)
+    """
+
+    results = db.session.execute(
+        db.select(Points.id_user, Points.id_problem, Points.points)
+        .where(Points.id_user.in_(id_users))
+    ).all()
+    return {(row[0], row[1]): row[2] for row in results}
+
+
+def iter_points(after: str | None = None, limit: int | None = None, batch_size: int = 1000):
+    """
+    Iterates over the point totals per user in user ID order, without loading them all at once.
+    Rows are fetched from a server-side cursor in batches of `batch_size`.
+
+    Args:
+        after (str, optional): Only return users whose ID sorts after this one. Defaults to `None`.
+        limit (int, optional): The maximum number of users to return. Defaults to no limit.
+        batch_size (int, optional): The number of rows fetched at a time. Defaults to 1000.
+
+    Yields:
+        tuple: The user ID and total points of each user
+    """
+
+    query = (
+        db.select(UserTotals.id_user, UserTotals.points)
+        .order_by(UserTotals.id_user)
+        .execution_options(yield_per=batch_size)
+    )
+    if after is not None:
+        query = query.where(UserTotals.id_user > after)
+    if limit is not None:
+        query = query.limit(limit)
+
+    for row in read(query):
+        yield row[0], row[1]
+
+
+def upsert(model: type[Base]):
+    """
+    Start an INSERT statement supporting `on_conflict_do_update` for the database in use.
+
+    Args:
+        model (type[Base]): The model to insert into
+
+    Returns:
+        Insert: The dialect-specific insert statement
+    """
+
+    if db.engine.dialect.name == "postgresql":
+        return postgresql.insert(model)
+    return sqlite.insert(model)
+
+
 def insert_points(id_user: str, id_problem: str, points: int):
     """
     Award a user a certain number of points for a specific problem.
     If the number of points to award is less than what the user already has, nothing happens.
 
+    Each call counts as an attempt at the problem. The server counts attempts in
+    memory instead, see `awards.insert_points`.
+
     Args:
         id_user (str): The user ID
         id_problem (str): The problem ID
         points (int): The number of points to award
     """
 
-    current = db.session.execute(
-        db.select(Points)
-        .where(Points.id_user==id_user)
-        .where(Points.id_problem==id_problem)
-    ).scalar()
+    insert_points_batch({(id_user, id_problem): points})
+    record_attempts({id_problem: 1})
+
+
+def insert_points_batch(awards: dict, chunk_size: int = 500) -> dict:
+    """
+    Award points for many graded submissions in a single transaction.
+    If the number of points to award is less than what a user already has, that award is ignored.
+
+    The statements of the batch are shared by all its awards, so that a batch
+    costs little more than a single award. The transaction holds the locks that
+    keep concurrent awards from several server processes from racing. If no award
+    raises a user's best score, the transaction is rolled back, so nothing is written.
+
+    Args:
+        awards (dict): The number of points to award, keyed by (user ID, problem ID)
+        chunk_size (int, optional): The maximum number of users per query. Defaults to 500.
+
+    Returns:
+        dict: The points of the awarded users after the batch, keyed by (user ID, problem ID)
+    """
+
+    # Creating the counters of the problems first takes the write lock, so the previous
+    # points read next cannot be changed by another process before the awards.
+    # Locks are taken in a fixed order, so that concurrent batches cannot deadlock.
+    for id_problem in sorted({id_problem for _, id_problem in awards}):
+        record_attempt(id_problem, 0)
+
+    users = sorted({id_user for id_user, _ in awards})
+    # PostgreSQL locks rows rather than the database, so also serialise awards to the
+    # same user, whose total changes by the difference to the points read next
+    for id_user in users:
+        advisory_lock(f"user:{id_user}")
 
-    if current is None:
-        db.session.add(Points(
-            id_user = id_user,
-            id_problem = id_problem,
-            points = points,
-        ))
+    previous = {}
+    for start in range(0, len(users), chunk_size):
+        previous.update(
+            ((row[0], row[1]), row[2]) for row in db.session.execute(
+                db.select(Points.id_user, Points.id_problem, Points.points)
+                .where(Points.id_user.in_(users[start:start + chunk_size]))
+            )
+        )
+
+    changed = {
+        key: points for key, points in awards.items()
+        if key not in previous or points > previous[key]
+    }
+    if not changed:
+        db.session.rollback()
+        return previous
+
+    statement = upsert(Points)
+    db.session.execute(statement.on_conflict_do_update(
+        index_elements=["id_user", "id_problem"],
+        set_={"points": statement.excluded.points},
+        where=statement.excluded.points > Points.points,
+    ), _parameters([
+        {"id_user": id_user, "id_problem": id_problem, "points": points}
+        for (id_user, id_problem), points in sorted(changed.items())
+    ]))
+
+    outcomes = {}
+    for (id_user, id_problem), points in changed.items():
+        counters = outcomes.setdefault(id_problem, {})
+        counters[points] = counters.get(points, 0) + 1
+        if (id_user, id_problem) in previous:
+            counters[previous[id_user, id_problem]] = counters.get(
+                previous[id_user, id_problem], 0) - 1
+    for id_problem, counters in sorted(outcomes.items()):
+        update_outcomes(id_problem, counters)
+
+    increases = _total_increases(changed, previous)
+    if increases:
+        add_user_totals(increases)
+    db.session.commit()
+    return {**previous, **changed}
+
+
+def _total_increases(changed: dict, previous: dict) -> dict:
+    # A user's first award adds them to the totals even if it is worth no points,
+    # while later awards only change the totals if they raise a best score
+    known = {id_user for id_user, _ in previous}
+    increases = {}
+    for (id_user, id_problem), points in changed.items():
+        increase = points - previous.get((id_user, id_problem), 0)
+        if increase or id_user not in known:
+            increases[id_user] = increases.get(id_user, 0) + increase
+    return increases
+
+
+def _parameters(rows: list) -> list | dict:
+    # A single row is executed as one statement, which skips the batching overhead
+    # of executemany for the common case of a single award
+    return rows[0] if len(rows) == 1 else rows
+
+
+def update_outcomes(id_problem: str, changes: dict):
+    """
+    Move users between the outcome counters of a problem in the ProblemStats table.
+    The change is not committed, so that it is part of the caller's transaction.
+
+    Args:
+        id_problem (str): The problem ID
+        changes (dict): The change of each counter, keyed by points
+    """
+
+    values = {
+        f"points_{points}": getattr(ProblemStats, f"points_{points}") + change
+        for points, change in changes.items() if change
+    }
+    if values:
+        db.session.execute(
+            db.update(ProblemStats).where(ProblemStats.id_problem==id_problem).values(**values)
+        )
+
+
+def record_attempt(id_problem: str, count: int = 1):
+    """
+    Count graded submissions in the ProblemStats table.
+    The change is not committed, so that it is part of the caller's transaction.
+
+    Args:
+        id_problem (str): The problem ID
+        count (int, optional): The number of graded submissions. Defaults to 1.
+    """
+
+    statement = upsert(ProblemStats).values(
+        id_problem=id_problem, attempts=count, points_0=0, points_1=0, points_2=0,
+    )
+    db.session.execute(statement.on_conflict_do_update(
+        index_elements=["id_problem"],
+        set_={"attempts": ProblemStats.attempts + count},
+    ))
+
+
+def record_attempts(attempts: dict):
+    """
+    Count graded submissions of several problems in the ProblemStats table, and commit.
+
+    Args:
+        attempts (dict): The number of graded submissions, keyed by problem ID
+    """
+
+    for id_problem, count in sorted(attempts.items()):
+        record_attempt(id_problem, count)
+    db.session.commit()
+
+
+def add_user_totals(increases: dict):
+    """
+    Add to some users' point totals in the UserTotals table.
+    The change is not committed, so that it is part of the caller's transaction.
+
+    Args:
+        increases (dict): The points to add to each total, keyed by user ID
+    """
+
+    id_users = sorted(increases)
+    # Each changed total takes the next number of the change sequence
+    last = next_points_seq(len(id_users))
+    statement = upsert(UserTotals)
+    db.session.execute(statement.on_conflict_do_update(
+        index_elements=["id_user"],
+        set_={"points": UserTotals.points + statement.excluded.points,
+              "seq": statement.excluded.seq},
+    ), _parameters([
+        {"id_user": id_user, "points": increases[id_user],
+         "seq": last - len(id_users) + index + 1}
+        for index, id_user in enumerate(id_users)
+    ]))
+
+
+def enqueue_job(id_user: str, id_problem: str, code: str) -> str:
+    """
+    Add a submission to the grading queue.
+
+    Args:
+        id_user (str): The user ID
+        id_problem (str): The problem ID
+        code (str): The submitted APL code
+
+    Returns:
+        str: The ID of the new job
+    """
+
+    now = time.time()
+    job = Jobs(
+        id=uuid.uuid4().hex,
+        id_user=id_user,
+        id_problem=id_problem,
+        code=code,
+        status="queued",
+        created=now,
+        updated=now,
+    )
+    db.session.add(job)
+    db.session.commit()
+    return job.id
+
+
+def claim_job() -> Jobs | None:
+    """
+    Take the oldest queued job and mark it as running.
+    Only one caller can claim a given job, even across processes.
+
+    Returns:
+        Jobs: The claimed job, or None if the queue is empty
+    """
+
+    while True:
+        id_job = db.session.execute(
+            db.select(Jobs.id)
+            .where(Jobs.status=="queued")
+            .where(Jobs.updated <= time.time())
+            .order_by(Jobs.created)
+            .limit(1)
+        ).scalar()
+
+        if id_job is None:
+            db.session.commit()
+            return None
+
+        claimed = db.session.execute(
+            db.update(Jobs)
+            .where(Jobs.id==id_job)
+            .where(Jobs.status=="queued")
+            .values(status="running", attempts=Jobs.attempts + 1, updated=time.time())
+        ).rowcount
         db.session.commit()
-        return
 
-    if current.points >= points:
-        return
+        if claimed:
+            return db.session.get(Jobs, id_job)
+
+
+def finish_job(id_job: str, points: int | None, feedback: str, status: str = "done"):
+    """
+    Store the outcome of a job.
+
+    Args:
+        id_job (str): The job ID
+        points (int): The number of points awarded, or None if grading failed
+        feedback (str): The feedback to show to the student
+        status (str, optional): The final status of the job. Defaults to "done".
+    """
+
+    db.session.execute(
+        db.update(Jobs)
+        .where(Jobs.id==id_job)
+        .values(status=status, points=points, feedback=feedback, updated=time.time())
+    )
+    db.session.commit()
+
+
+def defer_job(id_job: str, delay: float):
+    """
+    Return a running job to the queue, to be claimed again after a delay.
+
+    Args:
+        id_job (str): The job ID
+        delay (float): Seconds before the job may be claimed again
+    """
+
+    db.session.execute(
+        db.update(Jobs)
+        .where(Jobs.id==id_job)
+        .where(Jobs.status=="running")
+        .values(status="queued", updated=time.time() + delay)
+    )
+    db.session.commit()
+
+
+def requeue_stale_jobs(lease: float, max_attempts: int) -> int:
+    """
+    Return jobs left running by a crashed or restarted worker to the queue.
+    Jobs that have already been attempted too many times are marked as failed.
+
+    Args:
+        lease (float): Seconds after which a running job is considered abandoned
+        max_attempts (int): The number of attempts after which a job fails
+
+    Returns:
+        int: The number of jobs returned to the queue
+    """
+
+    stale = time.time() - lease
+    db.session.execute(
+        db.update(Jobs)
+        .where(Jobs.status=="running")
+        .where(Jobs.updated < stale)
+        .where(Jobs.attempts >= max_attempts)
+        .values(status="failed", feedback="Grading failed, please submit again.")
+    )
+    requeued = db.session.execute(
+        db.update(Jobs)
+        .where(Jobs.status=="running")
+        .where(Jobs.updated < stale)
+        .values(status="queued")
+    ).rowcount
+    db.session.commit()
+    return requeued
+
+
+def get_job(id_job: str) -> Jobs | None:
+    """
+    Get a job from the grading queue.
+
+    Args:
+        id_job (str): The job ID
+
+    Returns:
+        Jobs: The job, or None if the job ID is not found
+    """
+
+    job = db.session.get(Jobs, id_job)
+    db.session.commit()
+    return job
+
+
+def count_queued_jobs() -> int:
+    """
+    Count the jobs waiting in the grading queue.
+
+    Returns:
+        int: The number of queued jobs
+    """
+
+    return db.session.execute(
+        db.select(func.count())
+        .select_from(Jobs)
+        .where(Jobs.status=="queued")
+    ).scalar()
+
+
+def take_token(key: str, rate: float, burst: float) -> float:
+    """
+    Take a token from a token bucket, which refills at `rate` tokens per second up to `burst`.
+    Taking the token is a single atomic statement, so buckets can be shared by several processes.
+
+    Args:
+        key (str): The key of the bucket
+        rate (float): The number of tokens added to the bucket per second
+        burst (float): The capacity of the bucket
+
+    Returns:
+        float: Zero if a token was taken, otherwise the number of seconds until one is available
+    """
+
+    now = time.time()
+    available = RateLimits.tokens + (now - RateLimits.updated) * rate
+    refilled = case((available > burst, burst), else_=available)
+
+    statement = upsert(RateLimits).values(key=key, tokens=burst - 1, updated=now)
+    statement = statement.on_conflict_do_update(
+        index_elements=["key"],
+        set_={"tokens": refilled - 1, "updated": now},
+        where=refilled >= 1,
+    )
+
+    taken = db.session.execute(statement).rowcount
+    if taken:
+        db.session.commit()
+        return 0
 
-    current.points = points
+    bucket = db.session.get(RateLimits, key)
     db.session.commit()
+    tokens = min(burst, bucket.tokens + (now - bucket.updated) * rate)
+    return max(0.0, (1 - tokens) / rate)
@@ -5,14 +5,24 @@ and call the database and grader functions to perform functionality.
 Swagger documentation can be generated from the function docstrings.
 """
 
-import asyncio
 import base64
+import binascii
+import csv
+import io
+import json
+import time
+import zlib
 from flask import (
-    Blueprint, request, abort
+    Blueprint, current_app, request, abort, stream_with_context
 )
 
+from . import admission
+from . import awards
 from . import grader
 from . import database
+from . import metrics
+from . import submissions
+from .problems import registry
 
 bp = Blueprint("endpoints", __name__, url_prefix="/")
 
@@ -32,12 +42,43 @@ def index():
     return {"message": "success"}, 200
 
 
+@bp.route("/metrics", methods=("GET",))
+def get_metrics():
+    """
+    Get the latency, throughput and error metrics of all server processes.
+    The metrics are in the Prometheus text format and include a histogram of
+    the time spent in each stage of handling submissions.
+    ---
+    parameters:
+    responses:
+        200:
+            description: The metrics in the Prometheus text format
+    """
+
+    extra_gauges = {}
+    if current_app.config["QUEUE_ENABLED"]:
+        extra_gauges["aplmooc_queue_depth"] = database.count_queued_jobs()
+
+    return metrics.render(extra_gauges), 200, {
+        "Content-Type": "text/plain; version=0.0.4; charset=utf-8",
+    }
+
+
 @bp.route("/get", methods=("GET",))
 def get():
     """
     Get the students' point totals from the database.
+    Responses carry an ETag that changes whenever any total changes, and requests
+    with a matching If-None-Match header receive an empty HTTP 304 response.
+    With the `since` parameter, only the totals that changed after the given
+    sequence number are returned.
     ---
     parameters:
+        - name: since
+          description: The `seq` value of a previous response
+          in: query
+          type: int
+          required: false
     definitions:
         Points:
             type: object
@@ -46,6 +87,9 @@ def get():
                     type: array
                     items:
                         $ref: '#/definitions/UserPoints'
+                seq:
+                    type: int
+                    description: The sequence number of the latest change included in the response
         UserPoints:
             type: object
             properties:
@@ -59,11 +103,162 @@ def get():
             schema:
                 $ref: '#/definitions/Points'
             examples:
-                example: [{"id_user": "1", "points": "2"}, {"id_user": "3", "points": "7"}]
+                example: {"points": [{"id_user": "1", "points": "2"}, {"id_user": "3", "points": "7"}], "seq": 12}
+        304:
+            description: No totals have changed since the response with the given ETag
+    """  # pylint: disable=line-too-long
+
+    since = request.args.get("since", type=int)
+    epoch, seq = database.get_points_seq()
+    changes, pending = awards.pending_totals()
+    etag = f"{epoch}-{seq}-{changes}" if pending else f"{epoch}-{seq}"
+
+    if request.if_none_match.contains(etag):
+        return "", 304, {"ETag": f'"{etag}"'}
+
+    if since is not None and since > seq:
+        # The cursor comes from a previous database, so everything has changed
+        since = None
+
+    points = database.get_all_points(since)
+    if pending:
+        # Include the awards of this process that are not yet written
+        totals = {row["id_user"]: row["points"] for row in points} | pending
+        points = [{"id_user": id_user, "points": totals[id_user]} for id_user in sorted(totals)]
+    return {"points": points, "seq": seq}, 200, {"ETag": f'"{etag}"'}
+
+
+@bp.route("/stats", methods=("GET",))
+def stats():
     """
+    Get the number of attempts and outcomes for each problem.
+    The counters are maintained as points are awarded, so the response time
+    does not grow with the number of submissions. Attempts are written by each
+    worker every `STATS_FLUSH_INTERVAL` seconds, so recent ones may be missing.
+    ---
+    parameters:
+        - name: id_problem
+          description: Only return the statistics of this problem
+          in: query
+          type: string
+          required: false
+    definitions:
+        ProblemStats:
+            type: object
+            properties:
+                id_problem:
+                    type: string
+                attempts:
+                    type: int
+                    description: The number of graded submissions
+                users:
+                    type: int
+                    description: The number of users who attempted the problem
+                outcomes:
+                    type: object
+                    description: The number of users whose best result is 0, 1 or 2 points
+    responses:
+        200:
+            description: A JSON object containing the statistics of each problem
+            schema:
+                type: object
+                properties:
+                    problems:
+                        type: array
+                        items:
+                            $ref: '#/definitions/ProblemStats'
+            examples:
+                example: {"problems": [{"id_problem": "ch1_p1", "attempts": 12, "users": 5, "outcomes": {"0": 1, "1": 1, "2": 3}}]}
+    """  # pylint: disable=line-too-long
+
+    return {"problems": database.get_problem_stats(request.args.get("id_problem"))}, 200
+
+
+def _export_lines(rows, export_format: str):
+    if export_format == "csv":
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(("id_user", "points"))
+        for row in rows:
+            writer.writerow(row)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    else:
+        for id_user, points in rows:
+            yield json.dumps({"id_user": id_user, "points": points}) + "\n"
+
 
-    points = database.get_all_points()
-    return {"points": points}, 200
+def _export_chunks(lines, compress: bool, chunk_size: int = 65536):
+    # Join small lines into larger chunks, so each write to the client carries many rows
+    compressor = zlib.compressobj(wbits=31) if compress else None
+    chunk, size = [], 0
+    for line in lines:
+        chunk.append(line)
+        size += len(line)
+        if size >= chunk_size:
+            data = "".join(chunk).encode()
+            yield compressor.compress(data) if compressor else data
+            chunk, size = [], 0
+
+    data = "".join(chunk).encode()
+    yield compressor.compress(data) + compressor.flush() if compressor else data
+
+
+@bp.route("/export", methods=("GET",))
+def export():
+    """
+    Export the students' point totals as a stream of rows, sorted by user ID.
+    Memory use does not grow with the number of students. To page through the totals,
+    pass the user ID of the last row received as `after`; a page with fewer
+    than `limit` rows is the last one. The response is compressed if the client
+    accepts gzip encoding.
+    ---
+    parameters:
+        - name: format
+          description: The row format, `ndjson` (default) or `csv`
+          in: query
+          type: string
+          required: false
+        - name: after
+          description: Only export users whose ID sorts after this one
+          in: query
+          type: string
+          required: false
+        - name: limit
+          description: The maximum number of users to export
+          in: query
+          type: int
+          required: false
+    responses:
+        200:
+            description: One row per user with the user ID and total points
+            examples:
+                ndjson: '{"id_user": "1", "points": 2}'
+                csv: 'id_user,points'
+        400:
+            description: The format or limit is invalid
+    """
+
+    export_format = request.args.get("format", "ndjson")
+    after = request.args.get("after")
+    limit = request.args.get("limit", type=int)
+
+    if export_format not in ("ndjson", "csv") or (limit is not None and limit < 0):
+        abort(400)
+
+    compress = "gzip" in request.accept_encodings
+    rows = database.iter_points(after, limit, current_app.config["EXPORT_BATCH_SIZE"])
+    chunks = _export_chunks(_export_lines(rows, export_format), compress)
+
+    headers = {
+        "Content-Type": "text/csv; charset=utf-8" if export_format == "csv"
+        else "application/x-ndjson",
+        "Vary": "Accept-Encoding",
+    }
+    if compress:
+        headers["Content-Encoding"] = "gzip"
+    return stream_with_context(chunks), 200, headers
 
 
 @bp.route("/submit", methods=("POST",))
@@ -108,6 +303,14 @@ def submit():
                 passed_all: {"feedback": "Congratulations! All tests passed. ", "message": "Code successfully executed!"}
                 passed_partial: {"feedback": "Passed basic tests, well done! For extra points, consider cases like 'weights' as left argument and 'table.csv' as right argument.", "message": "Code successfully executed!"}
                 failed_prohibited: {"feedback": "Basic test failed. An error occured. ⌸ found in source, which is prohibited for this problem.", "message": "Code successfully executed!"}
+        400:
+            description: A parameter is missing or invalid, or the code is not base64-encoded UTF-8
+        413:
+            description: The code is larger than the maximum code size
+        429:
+            description: Too many submissions, by this user or in total. The Retry-After header gives the seconds to wait.
+        503:
+            description: The grader is failing or not answering. The Retry-After header gives the seconds to wait.
     """  # pylint: disable=line-too-long
 
     # Read and parse parameters
@@ -119,27 +322,99 @@ def submit():
     if not all((id_problem, mooc_token, code_encoded)):
         abort(400)
 
-    id_user = grader.get_user_id(mooc_token)
+    # Base64 encodes three bytes in four characters
+    if len(code_encoded) > (current_app.config["MAX_CODE_SIZE"] + 2) // 3 * 4:
+        abort(413)
+    try:
+        code_bytes = base64.b64decode(code_encoded, validate=True)
+        code = code_bytes.decode("utf-8")
+    except (binascii.Error, UnicodeDecodeError):
+        abort(400)
+    if len(code_bytes) > current_app.config["MAX_CODE_SIZE"]:
+        abort(413)
+
+    with metrics.timer(metrics.STAGE_SECONDS, stage="user_lookup"):
+        id_user = grader.get_user_id(mooc_token)
     if not id_user:
         abort(400)
 
-    code = base64.b64decode(code_encoded).decode("utf-8")
-    config = database.get_problem_config(id_problem)
+    with metrics.timer(metrics.STAGE_SECONDS, stage="problem_lookup"):
+        problem = registry.get(id_problem)
 
-    if config is None:
+    if problem is None:
         abort(400)
 
+    admission.check_user(id_user)
+
+    if current_app.config["QUEUE_ENABLED"]:
+        id_job = database.enqueue_job(id_user, id_problem, code)
+        return {"job_id": id_job, "status": "queued"}, 202
+
     # Run grader evaluation
 
-    result, feedback = asyncio.run(grader.evaluate(code, config))
-
-    match result:
-        case grader.GradingStatus.PASSED_BASIC:
-            database.insert_points(id_user, id_problem, 1)
-            return {"points": 1, "feedback": f"Passed basic tests, well done! {feedback}"}, 200
-        case grader.GradingStatus.PASSED_ALL:
-            database.insert_points(id_user, id_problem, 2)
-            return {"points": 2, "feedback": "All tests passed!"}, 200
-        case grader.GradingStatus.ERROR | grader.GradingStatus.FAILED | _:
-            database.insert_points(id_user, id_problem, 0)
-            return {"points": 0, "feedback": feedback}, 200
+    return submissions.grade(id_user, problem, code), 200
+
+
+@bp.route("/result/<id_job>", methods=("GET",))
+def result(id_job: str):
+    """
+    Get the outcome of a queued submission.
+    If the `wait` query parameter is given, the request waits up to that many seconds
+    for grading to finish before responding.
+    ---
+    parameters:
+        - name: id_job
+          description: The job ID returned by the submit endpoint
+          in: path
+          type: string
+          required: true
+        - name: wait
+          description: The maximum number of seconds to wait for the result
+          in: query
+          type: number
+          required: false
+    definitions:
+        JobResult:
+            type: object
+            properties:
+                job_id:
+                    type: string
+                status:
+                    type: string
+                    description: One of queued, running, done or failed
+                points:
+                    type: int
+                    description: How many points were awarded for submission, once done
+                feedback:
+                    type: string
+                    description: A message to display to the user, once done or failed
+    responses:
+        200:
+            description: A JSON object containing the status of the job and, once finished, its outcome
+            schema:
+                $ref: '#/definitions/JobResult'
+            examples:
+                queued: {"job_id": "0f8fad5bd9cb469fa16570867728950e", "status": "queued"}
+                done: {"job_id": "0f8fad5bd9cb469fa16570867728950e", "status": "done", "points": 2, "feedback": "All tests passed!"}
+        404:
+            description: The job does not exist
+    """  # pylint: disable=line-too-long
+
+    wait = min(request.args.get("wait", 0, type=float), current_app.config["QUEUE_MAX_WAIT"])
+    deadline = time.monotonic() + wait
+
+    while True:
+        job = database.get_job(id_job)
+        if job is None:
+            abort(404)
+
+        if job.status in ("done", "failed") or time.monotonic() >= deadline:
+            break
+        time.sleep(current_app.config["QUEUE_POLL_INTERVAL"])
+
+    body = {"job_id": job.id, "status": job.status}
+    if job.status == "done":
+        body["points"] = job.points
+    if job.status in ("done", "failed"):
+        body["feedback"] = job.feedback
+    return body, 200
@@ -1,164 +1,647 @@
-"""This file provides the grading logic for the APL MOOC backend.
-
-The functions here are responsible for running APL code using dyalog.run,
-as well as encoding submitted user code into the APL workspace
-used by dyalog.run during testing.
-"""
-
-import json
-from enum import Enum
-import msgpack
-import requests
-from websockets import connect
-from grader.grader_namespace import setup_framework
-
-MOOC_API = "https://www.mooc.fi/api/v8"
-
-
-class GradingStatus(Enum):
-    """An enum for the outcome of grading operations."""
-    FAILED = 0
-    PASSED_BASIC = 1
-    PASSED_ALL = 2
-    ERROR = 3
-
-
-async def run_apl(code: str) -> dict:
-    """
-    Safely runs arbitrary APL code using the dyalog.run service.
-
-    Args:
-        code (str): The APL code to run
-    
-    Returns:
-        dict: The parsed response from the dyalog.run service
-    """
-
-    async with connect("wss://dyalog.run/api/v0/ws/execute") as websocket:
-        payload = msgpack.packb({
-            "language": "dyalog_apl",
-            "code": code,
-            "timeout": 5,
-        })
-        await websocket.send(payload)
-
-        response_raw = await websocket.recv()
-        response = msgpack.unpackb(response_raw, raw=False, use_list=False)
-        response.update({
-            "stdout": response["stdout"].decode(),
-            "stderr": response["stderr"].decode(),
-        })
-        return response
-
-
-async def evaluate(code: str, options: dict) -> tuple[GradingStatus, str]:
-    """
-    Evaluate an APL code submission
-
-    Args:
-        code (str): The APL code to run
-        options (dict): A dictionary of options as described in grader/README.md
-
-    Returns:
-        GradingStatus:
-            A value describing whether tests passed fully, passed partially,
-            failed, or errors were encountered.
-        str:
-            Information about the evaluation
-    """
-
-    # Wrap user code in text definition
-    code_aplstring = json.dumps(code.replace("'", "''"))
-    options_aplstring = json.dumps(options).replace("'", "''")
-    code_aplcode = f"\nuser_code←0⎕JSON'{code_aplstring}'\n"
-    options_aplcode = f"\nopts←0⎕JSON'{options_aplstring}'\n"
-
-    # Bundle grader framework, user code and execution options as a string
-    epilogue = "⎕←1⎕JSON opts ⎕SE.Test.Run user_code"
-    submission = f"{setup_framework}{code_aplcode}{options_aplcode}{epilogue}"
-
-    # Evaluate the code using dyalog.run
-    response = await run_apl(submission)
-
-    # Parse the response data
-    if response["timed_out"]:
-        return GradingStatus.ERROR, "Execution timed out (>5s)"
-
-    if response["status_value"] != 0:  # pragma: no cover
-        return GradingStatus.ERROR, response["stderr"]
-
-    output = json.loads(response["stdout"])
-
-    if "error" in output:
-        return GradingStatus.ERROR, output["report"]
-
-    if output["status"] == 2:
-        return GradingStatus.PASSED_ALL, ""
-
-    return (
-        GradingStatus(output["status"]),
-        "Failed test: " +
-        (f"{output['larg']} as left argument and " if "larg" in output else "") +
-        (f"{output['rarg']} as right argument." if "rarg" in output else "")
-    )
-
-
-def get_user_details(mooc_token: str) -> dict | None:
-    """
-    Get details for a user based on their mooc.fi token.
-
-    Args:
-        mooc_token (str): The user's mooc.fi token
-    
-    Returns:
-        dict:
-            All of the user's information retrieved from mooc.fi,
-            or None if the user does not exist
-    """
-
-    body = {
-        "operationName": "UserInfo",
-        "variables": {"search": None},
-        "query": \
-"""
-query UserInfo($search: String) {
-  currentUser(search: $search) {
-    id
-    full_name
-    email
-    student_number
-    username
-  }
-}
-"""
-    }
-
-    response = requests.post(MOOC_API, json=body, timeout=5, headers={
-        "Authorization": f"Bearer {mooc_token}",
-    })
-
-    if response.status_code != 200:
-        return None
-
-    return response.json()["data"]["currentUser"]
-
-
-def get_user_id(mooc_token: str) -> str | None:
-    """
-    Get a user's ID based on their mooc.fi token.
-
-    Args:
-        mooc_token (str): The user's mooc.fi token
-    
-    Returns:
-        str:
-            The user's mooc.fi user ID,
-            or None if the user does not exist
-    """
-
-    user_details = get_user_details(mooc_token)
-
-    if not user_details:
-        return None
-
-    return user_details.get("id")
+"""This file provides the grading logic for the APL MOOC backend.
+
+The functions here are responsible for running APL code using dyalog.run
+or another configured execution backend, as well as encoding submitted
+user code into the APL workspace used during testing.
+"""
+
+import asyncio
+import json
+import time
+import weakref
+from dataclasses import dataclass
+from enum import Enum
+import requests
+from requests.adapters import HTTPAdapter
+from flask import Flask
+from grader.grader_namespace import setup_framework
+from . import cache
+from . import metrics
+from . import sharding
+from .batching import SubmissionBatcher
+from .backends import DyalogRunBackend, ExecutionBackend, LocalInterpreterPool
+from .pool import EventLoopThread, PoolTimeout
+from .resilience import (
+    CircuitBreaker, GraderUnavailable, HedgeBudget, LatencyWindow, grader_unavailable, hedged,
+)
+
+MOOC_API = "https://www.mooc.fi/api/v8"
+DYALOG_RUN_API = "wss://dyalog.run/api/v0/ws/execute"
+
+# The event loop shared by all requests handled by this worker process
+loop = EventLoopThread()
+
+_settings = {
+    "backend": (DyalogRunBackend, {"url": DYALOG_RUN_API}),
+    "mooc_api": MOOC_API,
+    "user_cache": cache.TTLCache("mooc_users", ttl=300, max_entries=10000),
+    "negative_ttl": 30,
+    "batch_size": 1,
+    "batch_linger": 0.05,
+    "batch_timeout": 10,
+    "time_limit": 5,
+    "deadline_margin": 5,
+    "hedge_quantile": 0.95,
+    "latencies": {},
+    "hedge_budget": HedgeBudget(),
+    "breaker": CircuitBreaker(),
+}
+_backends = weakref.WeakKeyDictionary()
+_batchers = weakref.WeakKeyDictionary()
+
+# Keep-alive connections to mooc.fi shared by all requests handled by this worker process
+session = requests.Session()
+session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=64))
+
+
+class GradingStatus(Enum):
+    """An enum for the outcome of grading operations."""
+    FAILED = 0
+    PASSED_BASIC = 1
+    PASSED_ALL = 2
+    ERROR = 3
+
+
+@dataclass(frozen=True)
+class SourceRules:
+    """
+    The rules a submission's source code must follow, checked before the code is run.
+
+    They repeat the first checks of `Test.Run` in grader/grader.apln with identical
+    feedback, so that a submission failing them never costs a round trip to the interpreter.
+    """
+
+    prohibited: str = ""
+    prohibited_chars: frozenset = frozenset()
+
+    @classmethod
+    def from_options(cls, options: dict) -> "SourceRules":
+        """
+        Prepare the rules of a problem.
+
+        Args:
+            options (dict): A dictionary of options as described in grader/README.md
+
+        Returns:
+            SourceRules: The rules, ready to check submissions against
+        """
+
+        prohibited = options.get("x") or ""
+        return cls(prohibited=prohibited, prohibited_chars=frozenset(prohibited))
+
+    def check(self, code: str) -> tuple[GradingStatus, str] | None:
+        """
+        Check a submission against the rules.
+
+        Args:
+            code (str): The APL code submitted by the user
+
+        Returns:
+            tuple:
+                The outcome and feedback the test framework would give,
+                or None if the submission follows the rules and has to be run
+        """
+
+        if not code.replace(" ", ""):
+            return GradingStatus.ERROR, "Empty submission"
+
+        if self.prohibited_chars.isdisjoint(code):
+            return None
+
+        # The framework reports the prohibited characters in the order of the option
+        found = "".join(char for char in self.prohibited if char in code)
+        verb = "is" if len(found) == 1 else "are"
+        return (
+            GradingStatus.ERROR,
+            f"{found} found in source, which {verb} prohibited for this problem.",
+        )
+
+
+def init_app(app: Flask):
+    """
+    Configure the grader from the application config.
+
+    Args:
+        app (Flask): The Flask application instance
+    """
+
+    _settings["mooc_api"] = app.config["MOOC_API"]
+    _settings["negative_ttl"] = app.config["MOOC_CACHE_NEGATIVE_TTL"]
+    _settings["user_cache"] = cache.TTLCache(
+        "mooc_users",
+        ttl=app.config["MOOC_CACHE_TTL"],
+        max_entries=app.config["MOOC_CACHE_SIZE"],
+    )
+
+    match app.config["GRADER_BACKEND"]:
+        case "local":
+            if not app.config["GRADER_LOCAL_SANDBOX"]:
+                raise ValueError(
+                    "The local backend runs untrusted submissions on this host, "
+                    "so GRADER_BACKEND 'local' requires GRADER_LOCAL_SANDBOX"
+                )
+            backend = (LocalInterpreterPool, {
+                "command": app.config["GRADER_LOCAL_COMMAND"],
+                "framework": setup_framework,
+                "sandbox": app.config["GRADER_LOCAL_SANDBOX"],
+                "user": app.config["GRADER_LOCAL_USER"],
+                "size": app.config["GRADER_LOCAL_POOL_SIZE"],
+                "limits": {
+                    "as": app.config["GRADER_LOCAL_MEMORY_LIMIT"] * 1024 * 1024,
+                    "core": 0,
+                    "cpu": app.config["GRADER_LOCAL_CPU_LIMIT"],
+                    "fsize": app.config["GRADER_LOCAL_FILE_LIMIT"] * 1024 * 1024,
+                    "nproc": app.config["GRADER_LOCAL_PROCESS_LIMIT"],
+                },
+                "acquire_timeout": app.config["GRADER_ACQUIRE_TIMEOUT"],
+            })
+        case "dyalog_run":
+            backend = (DyalogRunBackend, {
+                "url": app.config["GRADER_URL"],
+                "size": app.config["GRADER_POOL_SIZE"],
+                "max_idle": app.config["GRADER_POOL_MAX_IDLE"],
+                "ping_after": app.config["GRADER_POOL_PING_AFTER"],
+                "acquire_timeout": app.config["GRADER_ACQUIRE_TIMEOUT"],
+            })
+        case other:
+            raise ValueError(f"Unknown grader backend {other!r}")
+
+    if app.config["GRADER_BATCH_SIZE"] > 1 and not app.config["GRADER_BATCH_TRUSTED"]:
+        raise ValueError(
+            "Batched submissions share an interpreter and can affect each other's grades, "
+            "so GRADER_BATCH_SIZE above 1 requires GRADER_BATCH_TRUSTED"
+        )
+    _settings["batch_size"] = app.config["GRADER_BATCH_SIZE"]
+    _settings["batch_linger"] = app.config["GRADER_BATCH_LINGER"]
+    _settings["batch_timeout"] = app.config["GRADER_BATCH_TIMEOUT"]
+    _batchers.clear()
+
+    _settings["time_limit"] = app.config["GRADER_TIME_LIMIT"]
+    _settings["deadline_margin"] = app.config["GRADER_DEADLINE_MARGIN"]
+    _settings["hedge_quantile"] = (
+        app.config["GRADER_HEDGE_QUANTILE"] if app.config["GRADER_HEDGE_ENABLED"] else None
+    )
+    _settings["latencies"] = {}
+    _settings["hedge_budget"] = HedgeBudget(app.config["GRADER_HEDGE_MAX_FRACTION"])
+    _settings["breaker"] = CircuitBreaker(
+        threshold=app.config["GRADER_BREAKER_THRESHOLD"],
+        window=app.config["GRADER_BREAKER_WINDOW"],
+        min_calls=app.config["GRADER_BREAKER_MIN_CALLS"],
+        cooldown=app.config["GRADER_BREAKER_COOLDOWN"],
+    ) if app.config["GRADER_BREAKER_ENABLED"] else None
+    app.register_error_handler(GraderUnavailable, grader_unavailable)
+
+    if backend != _settings["backend"]:
+        _settings["backend"] = backend
+        for backend_loop, instance in list(_backends.items()):
+            if backend_loop.is_running():
+                asyncio.run_coroutine_threadsafe(instance.close(), backend_loop)
+        _backends.clear()
+
+
+def get_backend() -> ExecutionBackend:
+    """
+    Get the configured execution backend belonging to the running event loop.
+
+    Returns:
+        ExecutionBackend: The execution backend
+    """
+
+    running = asyncio.get_running_loop()
+    backend = _backends.get(running)
+    if backend is None:
+        backend_class, options = _settings["backend"]
+        backend = backend_class(**options)
+        _backends[running] = backend
+    return backend
+
+
+def get_batcher() -> SubmissionBatcher:
+    """
+    Get the submission batcher belonging to the running event loop.
+
+    Returns:
+        SubmissionBatcher: The submission batcher
+    """
+
+    running = asyncio.get_running_loop()
+    batcher = _batchers.get(running)
+    if batcher is None:
+        batcher = SubmissionBatcher(
+            run=run_apl,
+            execute_single=execute_single,
+            prologue=framework_code,
+            encode=encode_submission,
+            size=_settings["batch_size"],
+            linger=_settings["batch_linger"],
+            timeout=_settings["batch_timeout"],
+        )
+        _batchers[running] = batcher
+    return batcher
+
+
+async def run_apl(code: str, timeout: float = 5) -> dict:
+    """
+    Safely runs arbitrary APL code using the configured execution backend,
+    by default the dyalog.run service.
+
+    A request still unanswered after the usual response time of requests with the
+    same time limit is sent again on another connection, unless too many recent
+    requests were, and the first answer is used. Requests are not sent while
+    the circuit breaker is open after too many failures. Waiting for a free
+    connection or interpreter does not count towards the deadline, and giving up
+    on the wait is not counted as a failure by the circuit breaker.
+
+    Args:
+        code (str): The APL code to run
+        timeout (float, optional): The time limit for execution in seconds. Defaults to 5.
+    
+    Returns:
+        dict: The parsed response from the execution backend
+
+    Raises:
+        GraderUnavailable:
+            If the execution backend failed or did not answer in time,
+            has failed too often recently, or no connection or interpreter became free
+    """
+
+    breaker = _settings["breaker"]
+    latencies = _settings["latencies"].setdefault(timeout, LatencyWindow())
+    probe = breaker.before_call() if breaker else False
+    quantile = _settings["hedge_quantile"]
+    delay = latencies.quantile(quantile) if quantile is not None else None
+
+    start = time.perf_counter()
+    success = False
+    try:
+        response = await hedged(
+            lambda: get_backend().execute(code, timeout, timeout + _settings["deadline_margin"]),
+            delay,
+            _settings["hedge_budget"],
+        )
+        success = True
+    except PoolTimeout as error:
+        # Every connection or interpreter of this worker is busy, but the backend may be fine
+        success = None
+        metrics.inc("aplmooc_grader_failures_total", reason=type(error).__name__)
+        raise GraderUnavailable(1) from error
+    except Exception as error:
+        metrics.inc("aplmooc_grader_failures_total", reason=type(error).__name__)
+        raise GraderUnavailable(1) from error
+    finally:
+        if breaker and success is None:
+            breaker.skip(probe)
+        elif breaker:
+            breaker.record(success, probe)
+
+    # Timed out runs reflect the submission, not the speed of the backend
+    if not response["timed_out"]:
+        latencies.add(time.perf_counter() - start)
+    return response
+
+
+def time_limit(options: dict) -> float:
+    """
+    Get the time limit of a problem.
+
+    Args:
+        options (dict): A dictionary of options as described in grader/README.md
+
+    Returns:
+        float: The `time_limit` option in seconds, or the configured default
+    """
+
+    return options.get("time_limit", _settings["time_limit"])
+
+
+def compile_options(options: dict) -> str:
+    """
+    Encode problem options as APL code defining the `opts` namespace.
+
+    Args:
+        options (dict): A dictionary of options as described in grader/README.md
+
+    Returns:
+        str: The APL code fragment
+    """
+
+    options_aplstring = json.dumps(options).replace("'", "''")
+    return f"\nopts←0⎕JSON'{options_aplstring}'\n"
+
+
+def compile_shards(options: dict) -> tuple[tuple[str, str], ...]:
+    """
+    Split the test cases of a problem into the shards set by its `shards` option.
+
+    Args:
+        options (dict): A dictionary of options as described in grader/README.md
+
+    Returns:
+        tuple:
+            The test set and options encoded by `compile_options` of each shard,
+            or an empty tuple if the problem is not sharded
+    """
+
+    return tuple(
+        (tests, compile_options(shard_options))
+        for tests, shard_options in sharding.split_tests(options, options.get("shards", 1))
+    )
+
+
+async def execute(code: str, options: dict, options_aplcode: str | None = None,
+                  timeout: float | None = None,
+                  shards: tuple[tuple[str, str], ...] | None = None) -> dict:
+    """
+    Run the test framework on an APL code submission.
+    Submissions are only batched with others that have the same time limit. The shards of a sharded
+    problem are not batched, and each has the time limit of the problem.
+
+    Args:
+        code (str): The APL code to run
+        options (dict): A dictionary of options as described in grader/README.md
+        options_aplcode (str, optional):
+            The options already encoded by `compile_options`.
+            Defaults to encoding `options` on every call.
+        timeout (float, optional):
+            The time limit for execution in seconds.
+            Defaults to the time limit of the problem.
+        shards (tuple, optional):
+            The shards already prepared by `compile_shards`.
+            Defaults to preparing them from `options` on every call.
+
+    Returns:
+        dict: The response from the execution backend
+    """
+
+    if shards is None:
+        shards = compile_shards(options) if options.get("shards", 1) > 1 else ()
+    if shards:
+        return await execute_sharded(code, shards, timeout or time_limit(options))
+
+    if options_aplcode is None:
+        options_aplcode = compile_options(options)
+
+    timeout = timeout or time_limit(options)
+    if _settings["batch_size"] > 1:
+        return await get_batcher().execute(code, options_aplcode, timeout)
+
+    return await execute_single(code, options_aplcode, timeout)
+
+
+def encode_submission(code: str, options_aplcode: str) -> str:
+    """
+    Encode a submission as APL code defining `user_code` and `opts`.
+
+    Args:
+        code (str): The APL code submitted by the user
+        options_aplcode (str): The options encoded by `compile_options`
+
+    Returns:
+        str: The APL code fragment
+    """
+
+    # Wrap user code in text definition
+    code_aplstring = json.dumps(code.replace("'", "''"))
+    code_aplcode = f"\nuser_code←0⎕JSON'{code_aplstring}'\n"
+    return f"{code_aplcode}{options_aplcode}"
+
+
+def framework_code() -> str:
+    """
+    Get the APL code setting up the test framework, unless the backend has it preloaded.
+
+    Returns:
+        str: The APL code fragment
+    """
+
+    return "" if get_backend().preloads_framework else setup_framework
+
+
+async def execute_single(code: str, options_aplcode: str, timeout: float | None = None) -> dict:
+    """
+    Run the test framework on one submission in its own interpreter run.
+
+    Args:
+        code (str): The APL code to run
+        options_aplcode (str): The options encoded by `compile_options`
+        timeout (float, optional):
+            The time limit for execution in seconds. Defaults to the configured time limit.
+
+    Returns:
+        dict: The response from the execution backend
+    """
+
+    # Bundle grader framework, user code and execution options as a string
+    epilogue = "⎕←1⎕JSON opts ⎕SE.Test.Run user_code"
+    submission = f"{framework_code()}{encode_submission(code, options_aplcode)}{epilogue}"
+
+    # Evaluate the code using dyalog.run
+    return await run_apl(submission, timeout or _settings["time_limit"])
+
+
+async def execute_sharded(code: str, shards: tuple[tuple[str, str], ...],
+                          timeout: float) -> dict:
+    """
+    Run the shards of a submission in parallel, each in its own interpreter run.
+
+    Args:
+        code (str): The APL code to run
+        shards (tuple): The shards prepared by `compile_shards`
+        timeout (float): The time limit for each shard in seconds
+
+    Returns:
+        dict: The response the serial run of all test cases would have given
+    """
+
+    tasks = [
+        asyncio.ensure_future(execute_single(code, options_aplcode, timeout))
+        for _, options_aplcode in shards
+    ]
+    try:
+        responses = await asyncio.gather(*tasks)
+    finally:
+        # Also cancels the other shards if one of them fails
+        for task in tasks:
+            task.cancel()
+
+    metrics.inc("aplmooc_sharded_runs_total")
+    return sharding.merge_responses([tests for tests, _ in shards], responses)
+
+
+def is_deterministic(response: dict) -> bool:
+    """
+    Check whether a response reflects only the submission and problem,
+    rather than the state of the execution backend, and can therefore be reused.
+
+    Args:
+        response (dict): The response from the execution backend
+
+    Returns:
+        bool: False if execution timed out or the interpreter failed, True otherwise
+    """
+
+    return not response["timed_out"] and response["status_value"] == 0
+
+
+def parse_response(response: dict, timeout: float | None = None) -> tuple[GradingStatus, str]:
+    """
+    Interpret the response of the test framework.
+
+    Args:
+        response (dict): The response from the execution backend
+        timeout (float, optional):
+            The time limit the code ran with, in seconds. Defaults to the configured time limit.
+
+    Returns:
+        GradingStatus:
+            A value describing whether tests passed fully, passed partially,
+            failed, or errors were encountered.
+        str:
+            Information about the evaluation
+    """
+
+    if response["timed_out"]:
+        timeout = timeout or _settings["time_limit"]
+        return GradingStatus.ERROR, f"Execution timed out (>{timeout:g}s)"
+
+    if response["status_value"] != 0:  # pragma: no cover
+        return GradingStatus.ERROR, response["stderr"]
+
+    output = json.loads(response["stdout"])
+
+    if "error" in output:
+        return GradingStatus.ERROR, output["report"]
+
+    if output["status"] == 2:
+        return GradingStatus.PASSED_ALL, ""
+
+    return (
+        GradingStatus(output["status"]),
+        "Failed test: " +
+        (f"{output['larg']} as left argument and " if "larg" in output else "") +
+        (f"{output['rarg']} as right argument." if "rarg" in output else "")
+    )
+
+
+async def evaluate(code: str, options: dict, options_aplcode: str | None = None,
+                   rules: SourceRules | None = None) -> tuple[GradingStatus, str]:
+    """
+    Evaluate an APL code submission.
+    Submissions breaking the problem's source rules are rejected without running them.
+
+    Args:
+        code (str): The APL code to run
+        options (dict): A dictionary of options as described in grader/README.md
+        options_aplcode (str, optional):
+            The options already encoded by `compile_options`.
+            Defaults to encoding `options` on every call.
+        rules (SourceRules, optional):
+            The source rules already prepared by `SourceRules.from_options`.
+            Defaults to preparing them from `options` on every call.
+
+    Returns:
+        GradingStatus:
+            A value describing whether tests passed fully, passed partially,
+            failed, or errors were encountered.
+        str:
+            Information about the evaluation
+    """
+
+    if rules is None:
+        rules = SourceRules.from_options(options)
+
+    rejection = rules.check(code)
+    if rejection is not None:
+        return rejection
+
+    timeout = time_limit(options)
+    response = await execute(code, options, options_aplcode, timeout)
+    return parse_response(response, timeout)
+
+
+def _query_user_info(mooc_token: str) -> requests.Response:
+    body = {
+        "operationName": "UserInfo",
+        "variables": {"search": None},
+        "query": \
+"""
+query UserInfo($search: String) {
+  currentUser(search: $search) {
+    id
+    full_name
+    email
+    student_number
+    username
+  }
+}
+"""
+    }
+
+    return session.post(_settings["mooc_api"], json=body, timeout=5, headers={
+        "Authorization": f"Bearer {mooc_token}",
+    })
+
+
+def get_user_details(mooc_token: str) -> dict | None:
+    """
+    Get details for a user based on their mooc.fi token.
+
+    Args:
+        mooc_token (str): The user's mooc.fi token
+    
+    Returns:
+        dict:
+            All of the user's information retrieved from mooc.fi,
+            or None if the user does not exist
+    """
+
+    response = _query_user_info(mooc_token)
+
+    if response.status_code != 200:
+        return None
+
+    return response.json()["data"]["currentUser"]
+
+
+def get_user_id(mooc_token: str) -> str | None:
+    """
+    Get a user's ID based on their mooc.fi token.
+
+    Lookups are cached by a hash of the token. Tokens that mooc.fi rejects
+    are cached for a shorter time, and lookups failing for other reasons are not cached.
+
+    Args:
+        mooc_token (str): The user's mooc.fi token
+    
+    Returns:
+        str:
+            The user's mooc.fi user ID,
+            or None if the user does not exist
+    """
+
+    user_cache = _settings["user_cache"]
+    key = cache.hash_key(mooc_token)
+
+    id_user = user_cache.get(key)
+    if id_user is not cache.MISSING:
+        return id_user
+
+    try:
+        response = _query_user_info(mooc_token)
+    except requests.RequestException:
+        metrics.inc("aplmooc_mooc_failures_total", reason="error")
+        raise
+
+    if response.status_code in (401, 403):
+        metrics.inc("aplmooc_mooc_failures_total", reason="rejected")
+        user_cache.set(key, None, ttl=_settings["negative_ttl"])
+        return None
+
+    if response.status_code != 200:
+        metrics.inc("aplmooc_mooc_failures_total", reason="status")
+        return None
+
+    user_details = response.json()["data"]["currentUser"]
+    id_user = user_details.get("id") if user_details else None
+    user_cache.set(key, id_user, ttl=None if id_user else _settings["negative_ttl"])
+    return id_user
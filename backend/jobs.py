@@ -0,0 +1,126 @@
+"""This file provides the background grading workers for the APL MOOC backend.
+
+When the submission queue is enabled, `/submit` only stores the submission in the
+Jobs table and returns its job ID. Worker threads in each server process claim
+queued jobs, grade them and store the outcome, which students poll from `/result`.
+Because the queue lives in the database, jobs survive server restarts.
+
+A job that cannot be graded because the grader is unavailable or all grading
+slots are taken goes back to the queue and is retried after a growing delay,
+rather than holding on to its worker, until it runs out of attempts.
+"""
+
+import threading
+from flask import Flask
+from sqlalchemy.exc import SQLAlchemyError
+from . import admission
+from . import database
+from . import grader
+from . import submissions
+from .problems import registry
+
+_settings = {
+    "max_attempts": 5,
+    "retry_delay": 5,
+}
+_workers = []
+
+
+def process_job(job: database.Jobs):
+    """
+    Grade a claimed job and store its outcome.
+
+    Args:
+        job (Jobs): The job to grade
+    """
+
+    problem = registry.get(job.id_problem)
+    if problem is None:
+        database.finish_job(job.id, None, "Problem not found.", status="failed")
+        return
+
+    id_job, attempts = job.id, job.attempts
+    try:
+        response = submissions.grade(job.id_user, problem, job.code)
+    except (admission.Overloaded, grader.GraderUnavailable) as error:
+        database.db.session.rollback()
+        if attempts >= _settings["max_attempts"]:
+            database.finish_job(
+                id_job, None, "The grader is unavailable, please submit again.", status="failed",
+            )
+            return
+        # Background jobs wait for a grading slot or the grader instead of being turned away
+        delay = _settings["retry_delay"] * 2 ** (attempts - 1)
+        database.defer_job(id_job, max(delay, error.retry_after))
+        return
+    except Exception:  # pylint: disable=broad-exception-caught
+        database.db.session.rollback()
+        database.finish_job(
+            id_job, None, "Grading failed, please submit again.", status="failed",
+        )
+        return
+
+    database.finish_job(id_job, response["points"], response["feedback"])
+
+
+class Worker(threading.Thread):
+    """
+    A daemon thread that grades jobs from the queue until stopped.
+    """
+
+    def __init__(self, app: Flask, index: int):
+        super().__init__(name=f"aplmooc-grading-{index}", daemon=True)
+        self.app = app
+        self.stopping = threading.Event()
+
+    def run(self):
+        config = self.app.config
+        with self.app.app_context():
+            while not self.stopping.is_set():
+                try:
+                    database.requeue_stale_jobs(
+                        config["QUEUE_LEASE"], config["QUEUE_MAX_ATTEMPTS"],
+                    )
+                    job = database.claim_job()
+                except SQLAlchemyError:
+                    # The database may be locked by another worker or not yet initialised
+                    database.db.session.rollback()
+                    job = None
+
+                if job is None:
+                    self.stopping.wait(config["QUEUE_POLL_INTERVAL"])
+                    continue
+                process_job(job)
+
+
+def stop_workers():
+    """
+    Stop the grading workers of this process and wait for them to finish their current job.
+    """
+
+    for worker in _workers:
+        worker.stopping.set()
+    for worker in _workers:
+        worker.join()
+    _workers.clear()
+
+
+def init_app(app: Flask):
+    """
+    Start the grading workers for this process if the submission queue is enabled.
+
+    Args:
+        app (Flask): The Flask application instance
+    """
+
+    stop_workers()
+    _settings["max_attempts"] = app.config["QUEUE_MAX_ATTEMPTS"]
+    _settings["retry_delay"] = app.config["QUEUE_RETRY_DELAY"]
+
+    if not app.config["QUEUE_ENABLED"]:
+        return
+
+    for index in range(app.config["QUEUE_WORKERS"]):
+        worker = Worker(app, index)
+        worker.start()
+        _workers.append(worker)
@@ -0,0 +1,423 @@
+"""This file provides the metrics of the APL MOOC backend.
+
+Each server process records its counters, gauges and latency histograms in
+memory, which costs one lock and a few additions per observation. A background
+thread writes a snapshot of them to the `metrics` directory of the instance folder
+every few seconds, and `/metrics` sums the snapshots of all worker processes into
+the Prometheus text format.
+
+Snapshots are named by process id and process start time, so that a process reusing
+the id of an exited one does not take over its snapshot. The counters and histograms
+of exited processes are folded into one retained snapshot, so that they do not go
+backwards when gunicorn replaces a worker, and their gauges are dropped. The
+directory is cleared when the server starts.
+"""
+
+import bisect
+import fcntl
+import json
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+from flask import Flask
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+METRICS = {
+    "aplmooc_stage_seconds": ("histogram", "Time spent in each stage of handling a submission"),
+    "aplmooc_gradings_total": ("counter", "Graded submissions by outcome"),
+    "aplmooc_grading_timeouts_total": ("counter", "Submissions whose execution timed out"),
+    "aplmooc_mooc_failures_total": ("counter", "Failed mooc.fi user lookups by reason"),
+    "aplmooc_cache_lookups_total": ("counter", "Cache lookups by cache and result"),
+    "aplmooc_coalesced_total": ("counter", "Submissions sharing a concurrent identical grading"),
+    "aplmooc_admission_rejections_total": ("counter", "Submissions turned away by reason"),
+    "aplmooc_grader_failures_total": ("counter", "Failed execution backend requests by error"),
+    "aplmooc_hedges_total": ("counter", "Duplicated slow grader requests by which answered first"),
+    "aplmooc_breaker_trips_total": ("counter", "Times the grader circuit breaker opened"),
+    "aplmooc_sharded_runs_total": ("counter", "Submissions graded in parallel shards"),
+    "aplmooc_award_write_failures_total": ("counter", "Failed writes of buffered point awards"),
+    "aplmooc_award_group_timeouts_total": ("counter", "Group awards written on their own"),
+    "aplmooc_gradings_in_flight": ("gauge", "Submissions currently being executed"),
+    "aplmooc_queue_depth": ("gauge", "Jobs waiting in the submission queue"),
+}
+
+STAGE_SECONDS = "aplmooc_stage_seconds"
+RETIRED = "retired.json"
+
+_settings = {"directory": None, "interval": 5}
+
+
+def format_labels(labels: dict) -> str:
+    """
+    Render labels in the Prometheus text format, without the surrounding braces.
+
+    Args:
+        labels (dict): The label names and values
+
+    Returns:
+        str: The rendered labels, sorted by name
+    """
+
+    def escape(value) -> str:
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    return ",".join(f'{name}="{escape(value)}"' for name, value in sorted(labels.items()))
+
+
+class Recorder:
+    """
+    The metrics recorded by this process.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self._flusher = None
+
+    def reset(self):
+        """
+        Forget all recorded values, for example in a newly forked process.
+        """
+
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        if self._flusher is not None and not self._flusher.is_alive():
+            # The flushing thread does not survive a fork
+            self._flusher = None
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        """
+        Increase a counter.
+
+        Args:
+            name (str): The metric name
+            amount (float, optional): The amount to add. Defaults to 1.
+            **labels: The label values of the series
+        """
+
+        key = (name, format_labels(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+        self._start_flusher()
+
+    def add(self, name: str, amount: float, **labels):
+        """
+        Move a gauge up or down.
+
+        Args:
+            name (str): The metric name
+            amount (float): The amount to add, negative to subtract
+            **labels: The label values of the series
+        """
+
+        key = (name, format_labels(labels))
+        with self._lock:
+            self.gauges[key] = self.gauges.get(key, 0) + amount
+        self._start_flusher()
+
+    def observe(self, name: str, value: float, **labels):
+        """
+        Record an observation in a histogram.
+
+        Args:
+            name (str): The metric name
+            value (float): The observed value, usually in seconds
+            **labels: The label values of the series
+        """
+
+        key = (name, format_labels(labels))
+        index = bisect.bisect_left(BUCKETS, value)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                # One count per bucket and one for +Inf, then the sum of all values
+                histogram = self.histograms[key] = [0] * (len(BUCKETS) + 2)
+            histogram[index] += 1
+            histogram[-1] += value
+        self._start_flusher()
+
+    @contextmanager
+    def timer(self, name: str, **labels):
+        """
+        Context manager recording the duration of its block in a histogram.
+
+        Args:
+            name (str): The metric name
+            **labels: The label values of the series
+        """
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    @contextmanager
+    def in_flight(self, name: str, **labels):
+        """
+        Context manager counting its block in a gauge while it runs.
+
+        Args:
+            name (str): The metric name
+            **labels: The label values of the series
+        """
+
+        self.add(name, 1, **labels)
+        try:
+            yield
+        finally:
+            self.add(name, -1, **labels)
+
+    def snapshot(self) -> dict:
+        """
+        Copy the recorded values into a JSON-serialisable form.
+
+        Returns:
+            dict: The counters, gauges and histograms as lists of [name, labels, value]
+        """
+
+        with self._lock:
+            return {
+                "counters": [[*key, value] for key, value in self.counters.items()],
+                "gauges": [[*key, value] for key, value in self.gauges.items()],
+                "histograms": [[*key, list(value)] for key, value in self.histograms.items()],
+            }
+
+    def flush(self):
+        """
+        Write the snapshot of this process to the metrics directory.
+        """
+
+        directory = _settings["directory"]
+        if directory is None:
+            return
+
+        pid = os.getpid()
+        path = os.path.join(directory, f"{pid}-{_process_start(pid) or 0}.json")
+        temporary = f"{path}.{threading.get_ident()}.tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(temporary, path)
+
+    def _start_flusher(self):
+        if self._flusher is not None or _settings["directory"] is None:
+            return
+
+        with self._lock:
+            if self._flusher is not None:
+                return
+            self._flusher = threading.Thread(
+                target=self._flush_forever, name="aplmooc-metrics", daemon=True,
+            )
+            self._flusher.start()
+
+    def _flush_forever(self):
+        while True:
+            time.sleep(_settings["interval"])
+            try:
+                self.flush()
+            except OSError:  # pragma: no cover
+                pass
+
+
+recorder = Recorder()
+os.register_at_fork(after_in_child=recorder.reset)
+
+inc = recorder.inc
+add = recorder.add
+observe = recorder.observe
+timer = recorder.timer
+in_flight = recorder.in_flight
+
+
+def _process_start(pid: int) -> str | None:
+    # The start time in clock ticks since boot, which differs between processes
+    # that reuse the same process id
+    try:
+        with open(f"/proc/{pid}/stat", "r", encoding="utf-8") as f:
+            return f.read().rsplit(")", 1)[1].split()[19]
+    except (OSError, IndexError):
+        return None
+
+
+def _process_alive(pid: int, start: str) -> bool:
+    if os.path.isdir("/proc"):
+        return _process_start(pid) == start
+
+    try:  # pragma: no cover
+        os.kill(pid, 0)
+    except ProcessLookupError:  # pragma: no cover
+        return False
+    except PermissionError:  # pragma: no cover
+        return True
+    return True  # pragma: no cover
+
+
+@contextmanager
+def _locked(directory: str):
+    with open(os.path.join(directory, ".lock"), "a", encoding="utf-8") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _merge(totals: dict, snapshot: dict, gauges: bool = True):
+    for name, labels, value in snapshot["counters"]:
+        totals["counters"][name, labels] = totals["counters"].get((name, labels), 0) + value
+    if gauges:
+        for name, labels, value in snapshot["gauges"]:
+            totals["gauges"][name, labels] = totals["gauges"].get((name, labels), 0) + value
+    for name, labels, value in snapshot["histograms"]:
+        summed = totals["histograms"].setdefault((name, labels), [0] * len(value))
+        for index, item in enumerate(value):
+            summed[index] += item
+
+
+def _read_snapshots(directory: str) -> list:
+    """
+    Read the snapshots of running processes, folding those of exited ones into the
+    retained snapshot. Must be called holding the directory lock.
+    """
+
+    snapshots = []
+    retired = {"counters": {}, "gauges": {}, "histograms": {}}
+    exited = []
+    for filename in os.listdir(directory):
+        stem, extension = os.path.splitext(filename)
+        pid, _, start = stem.partition("-")
+        if extension != ".json" or not (filename == RETIRED or pid.isdigit() and start):
+            continue
+        path = os.path.join(directory, filename)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):  # pragma: no cover
+            continue
+
+        if filename == RETIRED:
+            _merge(retired, snapshot)
+        elif _process_alive(int(pid), start):
+            snapshots.append(snapshot)
+        else:
+            _merge(retired, snapshot, gauges=False)
+            exited.append(path)
+
+    retained = {
+        kind: [[*key, value] for key, value in retired[kind].items()]
+        for kind in ("counters", "gauges", "histograms")
+    }
+    if exited:
+        path = os.path.join(directory, RETIRED)
+        with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(retained, f)
+        os.replace(f"{path}.tmp", path)
+        for path in exited:
+            os.remove(path)
+
+    snapshots.append(retained)
+    return snapshots
+
+
+def collect() -> dict:
+    """
+    Sum the snapshots of all worker processes, including a fresh one of this process.
+
+    Returns:
+        dict: The summed counters, gauges and histograms, keyed by (name, labels)
+    """
+
+    recorder.flush()
+    directory = _settings["directory"]
+    if directory is None:
+        snapshots = [recorder.snapshot()]
+    else:
+        with _locked(directory):
+            snapshots = _read_snapshots(directory)
+
+    totals = {"counters": {}, "gauges": {}, "histograms": {}}
+    for snapshot in snapshots:
+        _merge(totals, snapshot)
+
+    return totals
+
+
+def clear(directory: str):
+    """
+    Remove all metrics snapshots, for example before the server starts its workers.
+
+    Args:
+        directory (str): The metrics directory
+    """
+
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory, exist_ok=True)
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def render(extra_gauges: dict | None = None) -> str:
+    """
+    Render the metrics of all worker processes in the Prometheus text format.
+
+    Args:
+        extra_gauges (dict, optional):
+            Gauges measured at scrape time rather than recorded, keyed by metric name.
+            Defaults to `None`.
+
+    Returns:
+        str: The metrics page
+    """
+
+    totals = collect()
+    for name, value in (extra_gauges or {}).items():
+        totals["gauges"][name, ""] = value
+
+    series = {}
+    for kind in ("counters", "gauges", "histograms"):
+        for (name, labels), value in totals[kind].items():
+            series.setdefault(name, []).append((labels, value))
+
+    lines = []
+    for name, (kind, description) in METRICS.items():
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in sorted(series.get(name, [])):
+            if kind != "histogram":
+                lines.append(f"{name}{{{labels}}} {_format_value(value)}" if labels
+                             else f"{name} {_format_value(value)}")
+                continue
+
+            prefix = f"{labels}," if labels else ""
+            cumulative = 0
+            for bound, count in zip((*BUCKETS, "+Inf"), value[:-1]):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {_format_value(cumulative)}')
+            suffix = f"{{{labels}}}" if labels else ""
+            lines.append(f"{name}_sum{suffix} {_format_value(value[-1])}")
+            lines.append(f"{name}_count{suffix} {_format_value(cumulative)}")
+
+    return "\n".join(lines) + "\n"
+
+
+def init_app(app: Flask):
+    """
+    Configure where this process writes its metrics snapshots.
+
+    Args:
+        app (Flask): The Flask application instance
+    """
+
+    directory = os.path.join(app.instance_path, "metrics")
+    os.makedirs(directory, exist_ok=True)
+    _settings["directory"] = directory
+    _settings["interval"] = app.config["METRICS_FLUSH_INTERVAL"]
@@ -0,0 +1,258 @@
+"""This file provides pooled websocket connections for the APL MOOC backend.
+
+Opening a websocket to dyalog.run costs a TCP, TLS and websocket handshake,
+so each worker process keeps a bounded set of warm connections and reuses them
+across submissions. The connections belong to a long-lived event loop running
+in a background thread, which is shared by every request the worker handles.
+"""
+
+import asyncio
+import threading
+import time
+from contextlib import asynccontextmanager
+from websockets import connect
+from websockets.exceptions import WebSocketException
+
+
+class PoolTimeout(Exception):
+    """
+    Raised when no connection or interpreter becomes free in time.
+    """
+
+
+class EventLoopThread:
+    """
+    A long-lived asyncio event loop running in a daemon thread.
+
+    The thread is started lazily on first use, so that creating the object
+    before gunicorn forks its workers does not leak a thread into the parent.
+    """
+
+    def __init__(self):
+        self._loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        """
+        The running event loop, starting it first if needed.
+
+        Returns:
+            asyncio.AbstractEventLoop: The event loop owned by this thread
+        """
+
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(
+                    target=self._loop.run_forever,
+                    name="aplmooc-event-loop",
+                    daemon=True,
+                )
+                self._thread.start()
+        return self._loop
+
+    def run(self, coro, timeout: float | None = None):
+        """
+        Run a coroutine on the event loop and wait for its result.
+
+        Args:
+            coro: The coroutine to run
+            timeout (float, optional): Seconds to wait for the result. Defaults to no limit.
+
+        Returns:
+            The return value of the coroutine
+        """
+
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    def stop(self):
+        """
+        Stop the event loop and wait for its thread to finish.
+        """
+
+        with self._lock:
+            if self._thread is None:
+                return
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop.close()
+            self._thread = None
+            self._loop = None
+
+
+class ConnectionPool:  # pylint: disable=too-many-instance-attributes
+    """
+    A bounded pool of websocket connections to a single URL.
+
+    At most `size` connections are checked out at once; further callers wait
+    for a connection to be returned. Connections idle for longer than `ping_after`
+    seconds are health checked with a websocket ping before reuse, and failed
+    connection attempts are retried with exponential backoff.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        url: str,
+        *,
+        size: int = 4,
+        max_idle: float = 60,
+        ping_after: float = 5,
+        ping_timeout: float = 5,
+        connect_timeout: float = 10,
+        connect_retries: int = 3,
+        backoff_initial: float = 0.25,
+        backoff_max: float = 10,
+    ):
+        self.url = url
+        self.size = size
+        self.max_idle = max_idle
+        self.ping_after = ping_after
+        self.ping_timeout = ping_timeout
+        self.connect_timeout = connect_timeout
+        self.connect_retries = connect_retries
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+
+        self._idle = []  # (websocket, time returned to the pool)
+        self._semaphore = None
+        self._backoff = 0
+        self._next_attempt = 0
+        self.connects = 0
+        self.reuses = 0
+
+    async def _connect(self):
+        attempt = 0
+        while True:
+            delay = self._next_attempt - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            try:
+                websocket = await asyncio.wait_for(
+                    connect(self.url, max_size=None),
+                    self.connect_timeout,
+                )
+            except (OSError, asyncio.TimeoutError, WebSocketException):
+                attempt += 1
+                self._backoff = min(
+                    self.backoff_max,
+                    self._backoff * 2 if self._backoff else self.backoff_initial,
+                )
+                self._next_attempt = time.monotonic() + self._backoff
+                if attempt >= self.connect_retries:
+                    raise
+                continue
+
+            self._backoff = 0
+            self._next_attempt = 0
+            self.connects += 1
+            return websocket
+
+    async def _healthy(self, websocket, idle_since: float) -> bool:
+        if websocket.close_code is not None:
+            return False
+
+        idle = time.monotonic() - idle_since
+        if idle > self.max_idle:
+            return False
+
+        # A connection that was answering a moment ago is very likely still open
+        if idle <= self.ping_after:
+            return True
+
+        try:
+            pong = await websocket.ping()
+            await asyncio.wait_for(pong, self.ping_timeout)
+        except (asyncio.TimeoutError, WebSocketException, OSError):
+            return False
+
+        return True
+
+    async def acquire(self, wait: float | None = None):
+        """
+        Check out a connection, reusing a healthy idle one if possible.
+
+        Args:
+            wait (float, optional):
+                Seconds to wait for a connection to be returned if all are checked out.
+                Defaults to no limit.
+
+        Returns:
+            A connected websocket client
+
+        Raises:
+            PoolTimeout: If no connection was returned in time
+        """
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.size)
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), wait)
+        except asyncio.TimeoutError as error:
+            raise PoolTimeout from error
+
+        try:
+            while self._idle:
+                websocket, idle_since = self._idle.pop()
+                if await self._healthy(websocket, idle_since):
+                    self.reuses += 1
+                    return websocket
+                await websocket.close()
+
+            return await self._connect()
+        except BaseException:
+            self._semaphore.release()
+            raise
+
+    async def release(self, websocket, discard: bool = False):
+        """
+        Return a connection to the pool.
+
+        Args:
+            websocket: A connection obtained from `acquire`
+            discard (bool, optional):
+                Close the connection instead of keeping it for reuse,
+                for example after a protocol error. Defaults to `False`.
+        """
+
+        try:
+            if discard or websocket.close_code is not None:
+                await websocket.close()
+            else:
+                self._idle.append((websocket, time.monotonic()))
+        finally:
+            self._semaphore.release()
+
+    @asynccontextmanager
+    async def connection(self, wait: float | None = None):
+        """
+        Context manager that checks out a connection and returns it afterwards.
+        The connection is discarded if the block raises an exception.
+
+        Args:
+            wait (float, optional):
+                Seconds to wait for a connection to be returned if all are checked out.
+                Defaults to no limit.
+
+        Yields:
+            A connected websocket client
+        """
+
+        websocket = await self.acquire(wait)
+        try:
+            yield websocket
+        except BaseException:
+            await self.release(websocket, discard=True)
+            raise
+        await self.release(websocket)
+
+    async def close(self):
+        """
+        Close all idle connections.
+        """
+
+        while self._idle:
+            websocket, _ = self._idle.pop()
+            await websocket.close()
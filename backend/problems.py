@@ -0,0 +1,204 @@
+"""This file provides the in-memory problem registry of the APL MOOC backend.
+
+Problem configurations only change when the problem set is reloaded, so each
+server process parses and validates them once and keeps them in memory, together
+with their options already encoded as APL code for the grader, their source
+rules prepared for checking submissions and their test cases split into shards
+if they are sharded. The registry checks the `problems_version` stamp in the
+database at most every few seconds. When it changes, only the problems whose
+version in the Problems table has changed are parsed again, and problems removed
+from the table are dropped.
+"""
+
+import hashlib
+import json
+import threading
+import time
+from dataclasses import dataclass
+from types import MappingProxyType
+from flask import Flask, current_app
+from sqlalchemy.exc import OperationalError
+from . import database
+from . import grader
+
+REQUIRED_KEYS = ("id", "entrypoint", "tests", "reference")
+
+
+def freeze(value):
+    """
+    Recursively convert parsed JSON into read-only mappings and tuples.
+
+    Args:
+        value: A value parsed from JSON
+
+    Returns:
+        The same value, made immutable
+    """
+
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+@dataclass(frozen=True)
+class Problem:
+    """
+    A parsed and validated problem configuration.
+    """
+
+    id: str
+    config: MappingProxyType
+    version: str
+    options_aplcode: str
+    rules: grader.SourceRules
+    shards: tuple = ()
+
+    @classmethod
+    def from_config(cls, config: dict) -> "Problem":
+        """
+        Validate a problem configuration and prepare it for grading.
+
+        Args:
+            config (dict): The parsed JSON configuration of the problem
+
+        Returns:
+            Problem: The prepared problem
+
+        Raises:
+            ValueError: If the configuration is missing required keys
+        """
+
+        missing = [key for key in REQUIRED_KEYS if key not in config]
+        if missing or "basic" not in config["tests"]:
+            missing = missing or ["tests.basic"]
+            raise ValueError(f"Problem {config.get('id')!r} is missing {', '.join(missing)}")
+
+        time_limit = config.get("time_limit", 1)
+        if isinstance(time_limit, bool) or not isinstance(time_limit, (int, float)) \
+                or time_limit <= 0:
+            raise ValueError(f"Problem {config.get('id')!r} has an invalid time_limit")
+
+        shards = config.get("shards", 1)
+        if isinstance(shards, bool) or not isinstance(shards, int) or shards < 1:
+            raise ValueError(f"Problem {config.get('id')!r} has an invalid shards count")
+
+        serialised = json.dumps(config, sort_keys=True)
+        return cls(
+            id=config["id"],
+            config=freeze(config),
+            version=hashlib.sha256(serialised.encode()).hexdigest()[:16],
+            options_aplcode=grader.compile_options(config),
+            rules=grader.SourceRules.from_options(config),
+            shards=grader.compile_shards(config),
+        )
+
+
+class ProblemRegistry:
+    """
+    The problems known to this process, reloaded when the problem set changes.
+    """
+
+    def __init__(self, check_interval: float = 5):
+        self.check_interval = check_interval
+        self.version = None
+        self._problems = {}
+        self._versions = {}
+        self._checked = 0
+        self._lock = threading.Lock()
+
+    def reload(self):
+        """
+        Load the problems that changed in the Problems table since the last reload,
+        and forget those that were removed.
+        Invalid problem configurations are logged and skipped.
+        """
+
+        version = database.get_version("problems_version")
+        versions = database.get_problem_versions()
+        changed = [
+            id_problem for id_problem, problem_version in versions.items()
+            if self._versions.get(id_problem) != problem_version
+        ]
+
+        problems = {
+            id_problem: problem for id_problem, problem in self._problems.items()
+            if id_problem in versions and id_problem not in changed
+        }
+        if changed:
+            ids = changed if self._versions else None
+            for id_problem, config in database.get_all_problem_configs(ids).items():
+                try:
+                    problems[id_problem] = Problem.from_config(config)
+                except ValueError as error:
+                    current_app.logger.warning("Skipping invalid problem: %s", error)
+
+        self._problems = problems
+        self._versions = versions
+        self.version = version
+
+    def refresh(self):
+        """
+        Reload the problems if the version stamp in the database has changed.
+        The database is checked at most once every `check_interval` seconds.
+        """
+
+        now = time.monotonic()
+        if now - self._checked < self.check_interval:
+            return
+
+        with self._lock:
+            if now - self._checked < self.check_interval:
+                return
+            if self.version is None or database.get_version("problems_version") != self.version:
+                self.reload()
+            # Marked only once loaded, so that other threads wait for the first load
+            self._checked = now
+
+    def get(self, id_problem: str) -> Problem | None:
+        """
+        Look up a problem by its ID.
+
+        Args:
+            id_problem (str): The problem ID
+
+        Returns:
+            Problem: The problem, or None if the problem ID is not found
+        """
+
+        self.refresh()
+        return self._problems.get(id_problem)
+
+    def clear(self):
+        """
+        Forget all problems, so that they are reloaded on the next lookup.
+        """
+
+        self._problems = {}
+        self._versions = {}
+        self.version = None
+        self._checked = 0
+
+
+registry = ProblemRegistry()
+
+
+def init_app(app: Flask):
+    """
+    Configure the problem registry and load the problems, if the database is initialised.
+
+    Args:
+        app (Flask): The Flask application instance
+    """
+
+    registry.check_interval = app.config["PROBLEMS_CHECK_INTERVAL"]
+    registry.clear()
+
+    with app.app_context():
+        try:
+            registry.refresh()
+        except OperationalError:
+            # The database has not been initialised yet
+            database.db.session.rollback()
+            registry.clear()
@@ -0,0 +1,266 @@
+"""This file provides the resilience of the APL MOOC grader to a slow or failing execution backend.
+
+Requests that take longer than usual are hedged: once a request has been waiting
+for longer than a high quantile of recent response times, an identical request is
+sent on a second connection, and whichever answers first is used. This cuts the
+slow tail of dyalog.run at the cost of a few percent more executions. Response
+times are compared among requests with the same time limit, and a budget caps
+the share of recent requests that are hedged, so that requests which are always
+slow, such as those of a slow problem, are not each sent twice.
+
+A circuit breaker watches the outcome of recent requests. When too many of them
+fail, further submissions are turned away at once with HTTP 503 instead of each
+waiting for its own failure. After a cooldown, a single probe request is let
+through, and the breaker closes again if it succeeds.
+"""
+
+import asyncio
+import math
+import threading
+import time
+from collections import deque
+from . import metrics
+
+
+class GraderUnavailable(Exception):
+    """
+    Raised when the execution backend is failing and submissions cannot be graded.
+    """
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Grader unavailable, retry after {retry_after:.1f} seconds")
+        self.retry_after = retry_after
+
+
+class LatencyWindow:
+    """
+    The response times of the most recent requests.
+    """
+
+    def __init__(self, size: int = 200, min_samples: int = 20):
+        self.min_samples = min_samples
+        self._latencies = deque(maxlen=size)
+
+    def add(self, latency: float):
+        """
+        Record the response time of a request.
+
+        Args:
+            latency (float): The response time in seconds
+        """
+
+        self._latencies.append(latency)
+
+    def quantile(self, q: float) -> float | None:
+        """
+        Estimate a quantile of the recent response times.
+
+        Args:
+            q (float): The quantile, between 0 and 1
+
+        Returns:
+            float: The quantile in seconds, or None if too few requests have been recorded
+        """
+
+        if len(self._latencies) < self.min_samples:
+            return None
+        latencies = sorted(self._latencies)
+        return latencies[min(len(latencies) - 1, math.ceil(q * len(latencies)) - 1)]
+
+
+class HedgeBudget:
+    """
+    Limits the share of recent requests that are hedged.
+    """
+
+    def __init__(self, fraction: float = 0.1, window: int = 200):
+        self.fraction = fraction
+        self._hedged = deque(maxlen=window)
+
+    def allow(self) -> bool:
+        """
+        Check whether another request may be hedged.
+
+        Returns:
+            bool: Whether fewer than `fraction` of the recent requests were hedged
+        """
+
+        return sum(self._hedged) < self.fraction * max(len(self._hedged), 1)
+
+    def record(self, duplicated: bool):
+        """
+        Record whether a request was hedged.
+
+        Args:
+            duplicated (bool): Whether a duplicate of the request was sent
+        """
+
+        self._hedged.append(duplicated)
+
+
+class CircuitBreaker:
+    """
+    Fails fast once the error rate of recent requests crosses a threshold.
+
+    The breaker is closed while requests succeed. It opens when at least `min_calls`
+    of the last `window` requests were recorded and more than `threshold` of them
+    failed. After `cooldown` seconds it lets one probe request through, and closes if
+    the probe succeeds or opens for another cooldown if it fails.
+    """
+
+    def __init__(self, *, threshold: float = 0.5, window: int = 20, min_calls: int = 10,
+                 cooldown: float = 10):
+        self.threshold = threshold
+        self.min_calls = min_calls
+        self.cooldown = cooldown
+        self._outcomes = deque(maxlen=window)
+        self._opened = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        """
+        The state of the breaker: `closed`, `open` or `half_open`.
+        """
+
+        if self._opened is None:
+            return "closed"
+        if self._probing or time.monotonic() - self._opened >= self.cooldown:
+            return "half_open"
+        return "open"
+
+    def before_call(self) -> bool:
+        """
+        Check whether a request may be sent.
+
+        Returns:
+            bool: True if the request is the probe of a half-open breaker
+
+        Raises:
+            GraderUnavailable: If the breaker is open, or another request is probing
+        """
+
+        with self._lock:
+            if self._opened is None:
+                return False
+
+            remaining = self._opened + self.cooldown - time.monotonic()
+            if remaining > 0 or self._probing:
+                raise GraderUnavailable(max(remaining, 1))
+
+            self._probing = True
+            return True
+
+    def record(self, success: bool, probe: bool = False):
+        """
+        Record the outcome of a request.
+
+        Args:
+            success (bool): Whether the execution backend answered
+            probe (bool, optional): Whether the request was the probe of a half-open breaker.
+                Defaults to `False`.
+        """
+
+        with self._lock:
+            if probe:
+                self._probing = False
+                if success:
+                    self._opened = None
+                    self._outcomes.clear()
+                else:
+                    self._opened = time.monotonic()
+                return
+
+            self._outcomes.append(success)
+            if self._opened is not None or len(self._outcomes) < self.min_calls:
+                return
+            failures = self._outcomes.count(False)
+            if failures > self.threshold * len(self._outcomes):
+                self._opened = time.monotonic()
+                metrics.inc("aplmooc_breaker_trips_total")
+
+    def skip(self, probe: bool = False):
+        """
+        Forget a request whose outcome says nothing about the execution backend,
+        such as one that gave up waiting for a free connection.
+
+        Args:
+            probe (bool, optional): Whether the request was the probe of a half-open breaker.
+                Defaults to `False`.
+        """
+
+        if probe:
+            with self._lock:
+                self._probing = False
+
+    def reset(self):
+        """
+        Close the breaker and forget all recorded outcomes.
+        """
+
+        with self._lock:
+            self._outcomes.clear()
+            self._opened = None
+            self._probing = False
+
+
+async def hedged(call, delay: float | None, budget: HedgeBudget | None = None):
+    """
+    Await a request, sending a duplicate if the first has not answered after `delay` seconds.
+    The first successful answer is returned and the other request is cancelled.
+
+    Args:
+        call: Function starting the request as a coroutine, called once per attempt
+        delay (float): Seconds to wait before sending the duplicate, or None to never send one
+        budget (HedgeBudget, optional):
+            The budget the duplicate must fit in, which records this request.
+            Defaults to `None`, for no limit.
+
+    Returns:
+        The answer of whichever request succeeded first
+
+    Raises:
+        Exception: The error of the last request to fail, if both failed
+    """
+
+    tasks = [asyncio.ensure_future(call())]
+    try:
+        if delay is not None:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done and (budget is None or budget.allow()):
+                tasks.append(asyncio.ensure_future(call()))
+        if budget is not None:
+            budget.record(len(tasks) > 1)
+
+        pending = set(tasks)
+        while True:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            succeeded = [task for task in done if task.exception() is None]
+            if succeeded:
+                if len(tasks) > 1:
+                    winner = "hedge" if succeeded[0] is tasks[1] else "original"
+                    metrics.inc("aplmooc_hedges_total", winner=winner)
+                return succeeded[0].result()
+            if not pending:
+                # Every request failed, so report the last failure
+                return done.pop().result()
+    finally:
+        # Also cancels the requests if the caller gives up waiting
+        for task in tasks:
+            task.cancel()
+
+
+def grader_unavailable(error: GraderUnavailable):
+    """
+    Respond to a submission that could not be graded with HTTP 503.
+
+    Args:
+        error (GraderUnavailable): The failure
+
+    Returns:
+        The error response, with the whole number of seconds to wait in Retry-After
+    """
+
+    retry_after = max(1, math.ceil(error.retry_after))
+    return {"error": "Grader unavailable, retry later"}, 503, {"Retry-After": str(retry_after)}
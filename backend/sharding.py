@@ -0,0 +1,109 @@
+"""This file provides sharded execution of a problem's test cases for the APL MOOC grader.
+
+`⎕SE.Test.Run` runs all test cases of a problem one after another in a single
+interpreter, so grading takes as long as all the cases together. A problem with
+expensive cases can opt in to sharding with its `shards` option: its cases are
+split into contiguous shards, each shard runs as its own submission on its own
+connection in parallel, and the shard results are merged into the result the
+serial run would have given.
+
+Each shard holds cases of only one test set, and is run as a problem whose basic
+cases are the shard's cases. The merge then replays the control flow of `Test.Run`
+over the shards in order: the first basic shard that errors or times out decides
+the result, then a failed basic case fails the submission, then the edge shards
+are looked at in the same way, except that errors in edge cases only fail the edge
+cases. Failed cases are reported with the last case of their test set, as in the
+serial run.
+"""
+
+import json
+
+TEST_SETS = ("basic", "edge")
+
+
+def split_tests(config: dict, count: int) -> list[tuple[str, dict]]:
+    """
+    Split the test cases of a problem into shards.
+    Shards are divided between the test sets in proportion to their number of cases.
+
+    Args:
+        config (dict): The problem configuration, as described in grader/README.md
+        count (int): The number of shards to split the cases into
+
+    Returns:
+        list:
+            The test set and problem configuration of each shard, in the order the
+            serial run tests them, or an empty list if there is nothing to split
+    """
+
+    cases = {tests: list(config["tests"].get(tests, [])) for tests in TEST_SETS}
+    total = sum(len(values) for values in cases.values())
+    count = min(count, total)
+    if count <= 1 or not cases["basic"]:
+        return []
+
+    # Every test set with cases gets at least one shard, and no shard is left empty
+    basic = count
+    if cases["edge"]:
+        basic = max(1, min(count - 1, round(count * len(cases["basic"]) / total)))
+        basic = max(basic, count - len(cases["edge"]))
+    counts = {"basic": basic, "edge": count - basic}
+
+    shards = []
+    for tests in TEST_SETS:
+        values, parts = cases[tests], counts[tests]
+        for part in range(parts):
+            chunk = values[part * len(values) // parts:(part + 1) * len(values) // parts]
+            shards.append((tests, {**config, "tests": {"basic": chunk}}))
+    return shards
+
+
+def _completed(response: dict) -> bool:
+    return not response["timed_out"] and response["status_value"] == 0
+
+
+def _respond(response: dict, output: dict, status: int) -> dict:
+    output = {key: value for key, value in output.items() if key not in ("error", "report")}
+    return {**response, "stdout": json.dumps({**output, "status": status})}
+
+
+def merge_responses(sets: list[str], responses: list[dict]) -> dict:
+    """
+    Merge the responses of the shards of a submission into the response of a serial run.
+
+    Args:
+        sets (list): The test set of each shard, as returned by `split_tests`
+        responses (list): The response from the execution backend for each shard
+
+    Returns:
+        dict: The response the serial run of all test cases would have given
+    """
+
+    last, last_response = None, None
+    for tests in TEST_SETS:
+        shards = [
+            response for shard_tests, response in zip(sets, responses) if shard_tests == tests
+        ]
+        if not shards:
+            continue
+
+        passed = True
+        for response in shards:
+            if not _completed(response):
+                return response
+
+            output = json.loads(response["stdout"])
+            if "error" in output:
+                if tests == "basic":
+                    return response
+                # Test.Run traps errors in edge cases and reports the case that raised them
+                arguments = {key: output[key] for key in ("larg", "rarg") if key in output}
+                return _respond(response, {**last, **arguments}, 1)
+            passed = passed and output["status"] == 2
+
+        last, last_response = json.loads(shards[-1]["stdout"]), shards[-1]
+        if not passed:
+            return _respond(last_response, last, 0 if tests == "basic" else 1)
+
+    # All cases passed, so the serial run would have ended with the last shard
+    return _respond(last_response, last, 2)
@@ -0,0 +1,285 @@
+"""This file provides the submission grading pipeline for the APL MOOC backend.
+
+The pipeline is shared by the synchronous `/submit` endpoint and the background
+submission queue: it runs the grader on a submission, awards the resulting points
+and builds the response shown to the student.
+
+Grading is deterministic for a given problem configuration and code, so results
+are memoised by problem ID, problem version and a hash of the normalised code.
+Resubmitting identical code then skips execution entirely. Results that depend on
+the execution backend, such as timeouts, are never memoised.
+
+Each problem runs with its own time limit. With adaptive time limits, the limit is
+tightened to a multiple of the 99th percentile of the execution times of passing
+submissions recorded by this process, so that runaway code frees its grading slot
+sooner on problems whose solutions run quickly.
+
+Identical submissions arriving while the first is still being graded, for example
+after a double click, wait for its outcome instead of running again. Other worker
+processes see the running grading as a lease in the cache table, and wait for its
+result to appear in the result cache.
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import Future
+from flask import Flask
+from . import admission
+from . import awards
+from . import cache
+from . import grader
+from . import database
+from . import metrics
+from .problems import Problem
+from .resilience import LatencyWindow
+
+_settings = {
+    "result_cache": None,
+    "leases": None,
+    "coalesce": True,
+    "poll_interval": 0.1,
+    "adaptive_time_limit": False,
+    "time_limit_multiple": 3,
+    "time_limit_min": 1,
+    "time_limit_samples": 100,
+}
+# Execution times of passing submissions in this process, by problem ID
+_durations = {}
+# Futures of the gradings running in this process, by result cache key
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+def init_app(app: Flask):
+    """
+    Configure the grading result cache and coalescing from the application config.
+
+    Args:
+        app (Flask): The Flask application instance
+    """
+
+    _settings["result_cache"] = cache.TTLCache(
+        "results",
+        ttl=app.config["RESULT_CACHE_TTL"],
+        max_entries=app.config["RESULT_CACHE_SIZE"],
+    ) if app.config["RESULT_CACHE_ENABLED"] else None
+
+    _settings["coalesce"] = app.config["COALESCE_ENABLED"]
+    _settings["poll_interval"] = app.config["COALESCE_POLL_INTERVAL"]
+    _settings["leases"] = cache.TTLCache(
+        "grading_leases",
+        ttl=app.config["COALESCE_LEASE"],
+        max_entries=10000,
+    ) if app.config["COALESCE_ENABLED"] else None
+
+    _settings["adaptive_time_limit"] = app.config["GRADER_ADAPTIVE_TIME_LIMIT"]
+    _settings["time_limit_multiple"] = app.config["GRADER_TIME_LIMIT_MULTIPLE"]
+    _settings["time_limit_min"] = app.config["GRADER_TIME_LIMIT_MIN"]
+    _settings["time_limit_samples"] = app.config["GRADER_TIME_LIMIT_SAMPLES"]
+    _durations.clear()
+
+
+def normalise_code(code: str) -> str:
+    """
+    Normalise source code so that whitespace-only changes produce the same code.
+    Line endings are unified, trailing whitespace is removed from each line,
+    and blank lines are dropped, as the grader ignores them when fixing the code.
+
+    Args:
+        code (str): The submitted APL code
+
+    Returns:
+        str: The normalised code
+    """
+
+    lines = (line.rstrip() for line in code.replace("\r\n", "\n").replace("\r", "\n").split("\n"))
+    return "\n".join(line for line in lines if line)
+
+
+def award(id_user: str, id_problem: str, result: grader.GradingStatus, feedback: str) -> dict:
+    """
+    Award points for a graded submission and build the response for the student.
+
+    Args:
+        id_user (str): The user ID
+        id_problem (str): The problem ID
+        result (GradingStatus): The outcome of grading
+        feedback (str): The feedback returned by the grader
+
+    Returns:
+        dict: The number of points awarded and the feedback to show to the student
+    """
+
+    metrics.inc("aplmooc_gradings_total", status=result.name.lower())
+
+    match result:
+        case grader.GradingStatus.PASSED_BASIC:
+            awards.insert_points(id_user, id_problem, 1)
+            return {"points": 1, "feedback": f"Passed basic tests, well done! {feedback}"}
+        case grader.GradingStatus.PASSED_ALL:
+            awards.insert_points(id_user, id_problem, 2)
+            return {"points": 2, "feedback": "All tests passed!"}
+        case grader.GradingStatus.ERROR | grader.GradingStatus.FAILED | _:
+            awards.insert_points(id_user, id_problem, 0)
+            return {"points": 0, "feedback": feedback}
+
+
+def time_limit(problem: Problem) -> float:
+    """
+    Get the time limit to run a submission for a problem with.
+
+    Args:
+        problem (Problem): The problem
+
+    Returns:
+        float:
+            The time limit of the problem in seconds, tightened to a multiple of the
+            99th percentile of recorded passing execution times if adaptive time limits
+            are enabled and enough executions have been recorded
+    """
+
+    limit = grader.time_limit(problem.config)
+    durations = _durations.get(problem.id)
+    if not _settings["adaptive_time_limit"] or durations is None:
+        return limit
+
+    p99 = durations.quantile(0.99)
+    if p99 is None:
+        return limit
+    return min(limit, max(_settings["time_limit_min"], _settings["time_limit_multiple"] * p99))
+
+
+def _execute(problem: Problem, code: str, key: str) -> tuple[grader.GradingStatus, str]:
+    # End the read transaction, so the database connection is not held while grading
+    database.db.session.commit()
+    timeout = time_limit(problem)
+    with admission.grading_slot(), metrics.in_flight("aplmooc_gradings_in_flight"), \
+            metrics.timer(metrics.STAGE_SECONDS, stage="execute"):
+        start = time.perf_counter()
+        response = grader.loop.run(
+            grader.execute(code, problem.config, problem.options_aplcode, timeout, problem.shards)
+        )
+        elapsed = time.perf_counter() - start
+
+    if response["timed_out"]:
+        metrics.inc("aplmooc_grading_timeouts_total")
+    with metrics.timer(metrics.STAGE_SECONDS, stage="parse"):
+        result, feedback = grader.parse_response(response, timeout)
+
+    if result in (grader.GradingStatus.PASSED_BASIC, grader.GradingStatus.PASSED_ALL):
+        durations = _durations.get(problem.id)
+        if durations is None:
+            durations = _durations.setdefault(problem.id, LatencyWindow(
+                size=1000, min_samples=_settings["time_limit_samples"],
+            ))
+        durations.add(elapsed)
+
+    result_cache = _settings["result_cache"]
+    if result_cache and grader.is_deterministic(response):
+        result_cache.set(key, [result.value, feedback])
+
+    return result, feedback
+
+
+def _execute_once_per_host(problem: Problem, code: str,
+                           key: str) -> tuple[grader.GradingStatus, str]:
+    leases, result_cache = _settings["leases"], _settings["result_cache"]
+    if leases is None or result_cache is None:
+        return _execute(problem, code, key)
+
+    # Another process is grading the same code, so wait for its result to be cached.
+    # If it finishes without caching a result, or its lease expires, grade the code here.
+    while not leases.add(key, os.getpid()):
+        time.sleep(_settings["poll_interval"])
+        cached = result_cache.get(key, None, count=False)
+        if cached is not None:
+            metrics.inc("aplmooc_coalesced_total", scope="host")
+            return grader.GradingStatus(cached[0]), cached[1]
+
+    try:
+        return _execute(problem, code, key)
+    finally:
+        leases.delete(key)
+
+
+def execute_once(problem: Problem, code: str, key: str) -> tuple[grader.GradingStatus, str]:
+    """
+    Grade a submission, sharing the outcome with identical submissions graded at the same time.
+    Within a process, later callers wait for the first one. Across processes, they wait
+    for the first one to store its result in the result cache.
+
+    Args:
+        problem (Problem): The problem the code was submitted for
+        code (str): The submitted APL code
+        key (str): The result cache key of the problem and normalised code
+
+    Returns:
+        GradingStatus:
+            A value describing whether tests passed fully, passed partially,
+            failed, or errors were encountered.
+        str:
+            Information about the evaluation
+
+    Raises:
+        Overloaded: If the code needs grading while all grading slots are in use
+    """
+
+    if not _settings["coalesce"]:
+        return _execute(problem, code, key)
+
+    with _inflight_lock:
+        future = _inflight.get(key)
+        leader = future is None
+        if leader:
+            future = _inflight[key] = Future()
+
+    if not leader:
+        metrics.inc("aplmooc_coalesced_total", scope="process")
+        return future.result()
+
+    try:
+        outcome = _execute_once_per_host(problem, code, key)
+    except BaseException as error:
+        future.set_exception(error)
+        raise
+    else:
+        future.set_result(outcome)
+    finally:
+        with _inflight_lock:
+            del _inflight[key]
+
+    return outcome
+
+
+def grade(id_user: str, problem: Problem, code: str) -> dict:
+    """
+    Grade a submission on the worker's event loop and award the resulting points.
+    Submissions breaking the problem's source rules are rejected without running them.
+
+    Args:
+        id_user (str): The user ID
+        problem (Problem): The problem the code was submitted for
+        code (str): The submitted APL code
+
+    Returns:
+        dict: The number of points awarded and the feedback to show to the student
+
+    Raises:
+        Overloaded: If the code needs grading while all grading slots are in use
+    """
+
+    result_cache = _settings["result_cache"]
+    key = cache.hash_key(problem.id, problem.version, normalise_code(code))
+
+    rejection = problem.rules.check(code)
+    cached = result_cache.get(key, None) if result_cache and rejection is None else None
+    if rejection is not None:
+        result, feedback = rejection
+    elif cached is not None:
+        result, feedback = grader.GradingStatus(cached[0]), cached[1]
+    else:
+        result, feedback = execute_once(problem, code, key)
+
+    with metrics.timer(metrics.STAGE_SECONDS, stage="award"):
+        return award(id_user, problem.id, result, feedback)
@@ -0,0 +1,5 @@
+"""Benchmarks for the APL MOOC backend.
+
+Each benchmark is a script printing machine-readable JSON results,
+run from the repository root with `poetry run python -m benchmarks.<name>`.
+"""
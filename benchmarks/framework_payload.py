@@ -0,0 +1,99 @@
+"""Compare the framework payload and grading latency of sending the test framework
+with every submission and of preloading it in local interpreters.
+
+The `dyalog_run` backend uploads the test framework with every submission. By
+default it is measured against a local dyalog.run stand-in, which measures payload
+transfer and packing only. Pass `--url wss://dyalog.run/api/v0/ws/execute` to
+include interpretation of the framework on the real service. The `local` backend
+loads the framework into each interpreter before a submission arrives, and is
+measured when its interpreter command is installed.
+"""
+
+import argparse
+import json
+import shlex
+import shutil
+import statistics
+import time
+from backend import create_app, grader
+from backend.config import GRADER_LOCAL_COMMAND
+from grader.grader_namespace import setup_framework
+from tests.standins import DyalogRunStandin, apl_response
+
+OPTIONS = {
+    "id": "benchmark",
+    "entrypoint": "F",
+    "tests": {"basic": ["1"]},
+    "reference": "F←{⍵}",
+    "post": "⊢",
+}
+CODE = "F←{⍵}"
+
+
+def measure(config: dict, iterations: int) -> dict:
+    """
+    Grade a trivial submission repeatedly using one execution backend.
+
+    Args:
+        config (dict): The application configuration selecting the backend
+        iterations (int): The number of submissions to grade
+
+    Returns:
+        dict: The framework bytes sent per submission and latency percentiles in milliseconds
+    """
+
+    create_app(True, config)
+
+    grader.loop.run(grader.evaluate(CODE, OPTIONS))  # Warm up the connection or interpreter pool
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        grader.loop.run(grader.evaluate(CODE, OPTIONS))
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    preloaded = config["GRADER_BACKEND"] == "local"
+    quantiles = statistics.quantiles(latencies, n=100)
+    return {
+        "backend": config["GRADER_BACKEND"],
+        "framework_bytes": 0 if preloaded else len(setup_framework.encode()),
+        "latency_ms": {
+            "p50": quantiles[49],
+            "p95": quantiles[94],
+            "mean": statistics.fmean(latencies),
+        },
+    }
+
+
+def main():
+    """
+    Run the benchmark and print the results as JSON.
+    """
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--url", help="Execution service URL. Defaults to a local stand-in.")
+    parser.add_argument("--local-command", default=GRADER_LOCAL_COMMAND,
+                        help="Interpreter command for the local backend")
+    parser.add_argument("--iterations", type=int, default=50)
+    args = parser.parse_args()
+
+    standin = None
+    url = args.url
+    if url is None:
+        standin = DyalogRunStandin(lambda request: apl_response('{"status":2}'))
+        url = standin.start()
+
+    try:
+        results = [measure({"GRADER_BACKEND": "dyalog_run", "GRADER_URL": url}, args.iterations)]
+        if shutil.which(shlex.split(args.local_command)[0]) is not None:
+            results.append(measure({
+                "GRADER_BACKEND": "local", "GRADER_LOCAL_COMMAND": args.local_command,
+            }, args.iterations))
+    finally:
+        if standin is not None:
+            standin.stop()
+
+    print(json.dumps({"benchmark": "framework_payload", "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
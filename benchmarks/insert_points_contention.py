@@ -0,0 +1,148 @@
+"""Measure point award throughput with several processes writing to one SQLite database.
+
+Each process mimics a gunicorn worker whose threads award points to random users
+and problems as fast as they can. Run with `--journal-mode delete` to compare
+against SQLite's default rollback journal, and with `--durability group` or
+`--durability async` to compare against buffered awards.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.sql import func
+from backend import awards as award_buffer, create_app, database
+
+
+def award_points_thread(app, seed: int, awards: int, users: int) -> int:
+    """
+    Award random points from one thread of a worker process.
+
+    Args:
+        app (Flask): The application created by the parent process
+        seed (int): The random seed for this thread
+        awards (int): The number of awards to make
+        users (int): The number of users to choose from
+
+    Returns:
+        int: The number of failed awards
+    """
+
+    generator = random.Random(seed)
+    failures = 0
+    with app.app_context():
+        for _ in range(awards):
+            try:
+                award_buffer.insert_points(
+                    str(generator.randrange(users)),
+                    f"p{generator.randrange(50)}",
+                    generator.choice((0, 0, 1, 2)),
+                )
+            except OperationalError:
+                database.db.session.rollback()
+                failures += 1
+    return failures
+
+
+def award_points(app, seed: int, args: argparse.Namespace, results):
+    """
+    Award random points in a forked worker process.
+
+    Args:
+        app (Flask): The application created by the parent process
+        seed (int): The random seed for this worker
+        args (Namespace): The benchmark parameters
+        results (Queue): A queue receiving the number of failed awards
+    """
+
+    with app.app_context():
+        database.db.engine.dispose(close=False)
+    with ThreadPoolExecutor(args.threads) as executor:
+        failures = sum(executor.map(
+            lambda index: award_points_thread(
+                app, seed * args.threads + index, args.awards // args.threads, args.users,
+            ),
+            range(args.threads),
+        ))
+    # Buffered awards and attempts count once they are written
+    award_buffer.stop()
+    results.put(failures)
+
+
+def main():
+    """
+    Run the benchmark and print the results as JSON.
+    """
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--awards", type=int, default=2000, help="Awards per process")
+    parser.add_argument("--threads", type=int, default=1, help="Threads per process")
+    parser.add_argument("--users", type=int, default=2000,
+                        help="Users to award points to. Fewer users make more no-op awards.")
+    parser.add_argument("--journal-mode", default="wal")
+    parser.add_argument("--durability", default="sync", choices=award_buffer.DURABILITY_MODES)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        problems = os.path.join(directory, "problems")
+        os.makedirs(problems)
+        app = create_app(True, {
+            "SQLALCHEMY_DATABASE_URI": f"sqlite:///{os.path.join(directory, 'bench.db')}",
+            "SQLITE_JOURNAL_MODE": args.journal_mode,
+            "AWARDS_DURABILITY": args.durability,
+            "PROBLEMS_DIR": problems,
+        })
+        with app.app_context():
+            database.db.create_all()
+            database.db.engine.dispose()
+
+        context = multiprocessing.get_context("fork")
+        results = context.Queue()
+        workers = [
+            context.Process(target=award_points, args=(app, seed, args, results))
+            for seed in range(args.processes)
+        ]
+
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        failures = sum(results.get() for _ in workers)
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+
+        with app.app_context():
+            consistent = database.get_all_points() == [
+                {"id_user": row[0], "points": row[1]}
+                for row in database.db.session.execute(
+                    database.db.select(database.Points.id_user, func.sum(database.Points.points))
+                    .group_by(database.Points.id_user)
+                    .order_by(database.Points.id_user)
+                ).all()
+            ]
+            attempts = sum(problem["attempts"] for problem in database.get_problem_stats())
+
+    total = args.processes * (args.awards // args.threads * args.threads)
+    print(json.dumps({
+        "benchmark": "insert_points_contention",
+        "processes": args.processes,
+        "threads": args.threads,
+        "journal_mode": args.journal_mode,
+        "durability": args.durability,
+        "awards": total,
+        "failed_awards": failures,
+        "seconds": elapsed,
+        "awards_per_second": total / elapsed,
+        "totals_consistent": consistent,
+        "attempts_counted": attempts,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+"""Measure the latency and throughput of `/submit` and `/get` under a steady request rate.
+
+The backend is served in-process by a threaded HTTP server, grading against the
+local dyalog.run stand-in and resolving users against the local mooc.fi stand-in,
+so the results reflect the backend alone. With `--gunicorn-threads`, it is
+instead served by gunicorn with `gunicorn.conf.py` and a single worker with that
+many threads. Every request holds its thread until it is answered, including
+while it waits for mooc.fi or for its grading, so this measures the request
+rate at which the threads of a worker run out. Requests are sent open-loop: each one is
+scheduled at a fixed rate and its latency is measured from its scheduled time,
+so that a slow server cannot hide queueing delay by slowing the load generator.
+The load generator shares the interpreter with the server, so compare results
+between commits on the same machine rather than as absolute numbers.
+"""
+
+import argparse
+import base64
+import json
+import logging
+import os
+import random
+import socket
+import statistics
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from werkzeug.serving import make_server
+from backend import create_app, database
+from tests.standins import DyalogRunStandin, MoocStandin, canned_handler
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROBLEMS_DIR = os.path.join(ROOT, "tests", "problems")
+
+
+def percentiles(latencies: list) -> dict:
+    """
+    Summarise request latencies.
+
+    Args:
+        latencies (list): The latencies in seconds
+
+    Returns:
+        dict: The median, 95th and 99th percentile and maximum latency in milliseconds
+    """
+
+    if len(latencies) < 2:
+        latencies = latencies * 2 or [0, 0]
+    cuts = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {
+        "p50_ms": cuts[49] * 1000,
+        "p95_ms": cuts[94] * 1000,
+        "p99_ms": cuts[98] * 1000,
+        "max_ms": max(latencies) * 1000,
+    }
+
+
+def summarise(samples: list, elapsed: float) -> dict:
+    """
+    Summarise the outcome of a set of requests.
+
+    Args:
+        samples (list): The (status code, latency) of each request, with status 0 for errors
+        elapsed (float): The duration of the run in seconds
+
+    Returns:
+        dict: The request count, throughput, error rate and latency percentiles
+    """
+
+    errors = sum(1 for status, _ in samples if not 200 <= status < 400)
+    return {
+        "requests": len(samples),
+        "throughput_per_second": len(samples) / elapsed,
+        "error_rate": errors / len(samples) if samples else 0,
+        **percentiles([latency for _, latency in samples]),
+    }
+
+
+class LoadGenerator:  # pylint: disable=too-few-public-methods
+    """
+    Sends a mix of `/submit` and `/get` requests at a fixed rate.
+    """
+
+    def __init__(self, url: str, args: argparse.Namespace):
+        self.url = url
+        self.args = args
+        self.generator = random.Random(args.seed)
+        self.samples = {"submit": [], "get": []}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._common = [f"F←{{⍵+{index}}}" for index in range(args.distinct_codes)]
+
+    def _session(self) -> requests.Session:
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def _plan(self, index: int) -> tuple:
+        if self.generator.random() < self.args.get_ratio:
+            return "get", None
+
+        if self.generator.random() < self.args.unique_ratio:
+            code = f"F←{{⍵×{index}}}"
+        else:
+            code = self.generator.choice(self._common)
+        return "submit", {
+            "id_problem": "test_p1",
+            "mooc_token": f"user-{self.generator.randrange(self.args.users)}",
+            "code_encoded": base64.b64encode(code.encode()).decode(),
+        }
+
+    def _send(self, scheduled: float, endpoint: str, body: dict | None):
+        time.sleep(max(0.0, scheduled - time.perf_counter()))
+        try:
+            if endpoint == "get":
+                response = self._session().get(f"{self.url}/get", timeout=60)
+            else:
+                response = self._session().post(f"{self.url}/submit", json=body, timeout=60)
+            status = response.status_code
+        except requests.RequestException:
+            status = 0
+
+        latency = time.perf_counter() - scheduled
+        with self._lock:
+            self.samples[endpoint].append((status, latency))
+
+    def run(self) -> float:
+        """
+        Send all requests and wait for their responses.
+
+        Returns:
+            float: The duration of the run in seconds
+        """
+
+        count = int(self.args.rate * self.args.duration)
+        plans = [self._plan(index) for index in range(count)]
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(self.args.clients) as executor:
+            for index, (endpoint, body) in enumerate(plans):
+                executor.submit(self._send, start + index / self.args.rate, endpoint, body)
+        return time.perf_counter() - start
+
+
+def current_commit() -> str | None:
+    """
+    Get the commit being benchmarked, so that results can be compared across commits.
+
+    Returns:
+        str: The commit hash, or None outside a git checkout
+    """
+
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, check=True, text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def start_gunicorn(directory: str, config: dict, threads: int) -> tuple[str, subprocess.Popen]:
+    """
+    Serve the backend with gunicorn in a single gthread worker, as configured by
+    `gunicorn.conf.py`, and wait until it accepts connections.
+
+    Args:
+        directory (str): The working directory of the server, which holds its instance folder
+        config (dict): Configuration values, passed as `FLASK_`-prefixed environment variables
+        threads (int): The number of threads of the worker
+
+    Returns:
+        str: The URL of the server
+        Popen: The server process
+    """
+
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+
+    process = subprocess.Popen(  # pylint: disable=consider-using-with
+        ["gunicorn", "--config", os.path.join(ROOT, "gunicorn.conf.py"), "backend:create_app()"],
+        cwd=directory,
+        env={
+            **os.environ,
+            **{f"FLASK_{name}": str(value) for name, value in config.items()},
+            "PYTHONPATH": ROOT,
+            "GUNICORN_BIND": f"127.0.0.1:{port}",
+            "GUNICORN_WORKERS": "1",
+            "GUNICORN_THREADS": str(threads),
+        },
+        stderr=subprocess.DEVNULL,
+    )
+
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            requests.get(f"http://127.0.0.1:{port}/get", timeout=1)
+            return f"http://127.0.0.1:{port}", process
+        except requests.RequestException:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("gunicorn did not start")
+
+
+def main():
+    """
+    Run the benchmark and print the results as JSON.
+    """
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rate", type=float, default=50, help="Requests per second")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds of load")
+    parser.add_argument("--get-ratio", type=float, default=0.2, help="Fraction of /get requests")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--distinct-codes", type=int, default=20,
+                        help="Number of commonly submitted solutions")
+    parser.add_argument("--unique-ratio", type=float, default=0.5,
+                        help="Fraction of submissions with code nobody else submitted")
+    parser.add_argument("--grader-latency", type=float, default=0.2,
+                        help="Seconds the dyalog.run stand-in takes per execution")
+    parser.add_argument("--timeout-rate", type=float, default=0.01,
+                        help="Fraction of executions that time out")
+    parser.add_argument("--mooc-latency", type=float, default=0.05,
+                        help="Seconds the mooc.fi stand-in takes per lookup")
+    parser.add_argument("--clients", type=int, default=256, help="Concurrent client connections")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--gunicorn-threads", type=int,
+                        help="Serve with gunicorn and one worker with this many threads")
+    args = parser.parse_args()
+
+    grader_server = DyalogRunStandin(
+        canned_handler(
+            {"passed_all": 5, "passed_basic": 2, "failed": 2, "error": 1},
+            timeout_rate=args.timeout_rate,
+            seed=args.seed,
+        ),
+        latency=args.grader_latency,
+    )
+    mooc_server = MoocStandin(latency=args.mooc_latency)
+
+    with tempfile.TemporaryDirectory() as directory:
+        config = {
+            "SQLALCHEMY_DATABASE_URI": f"sqlite:///{os.path.join(directory, 'bench.db')}",
+            "PROBLEMS_DIR": PROBLEMS_DIR,
+            "GRADER_URL": grader_server.start(),
+            "MOOC_API": mooc_server.start(),
+        }
+        app = create_app(True, config)
+        with app.app_context():
+            database.db.create_all()
+
+        if args.gunicorn_threads is None:
+            logging.getLogger("werkzeug").setLevel(logging.WARNING)
+            server = make_server("127.0.0.1", 0, app, threaded=True)
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+            url = f"http://127.0.0.1:{server.server_port}"
+            stop = server.shutdown
+        else:
+            url, process = start_gunicorn(directory, config, args.gunicorn_threads)
+
+            def stop():
+                process.terminate()
+                process.wait()
+
+        try:
+            load = LoadGenerator(url, args)
+            elapsed = load.run()
+        finally:
+            stop()
+            grader_server.stop()
+            mooc_server.stop()
+
+    print(json.dumps({
+        "benchmark": "loadtest",
+        "commit": current_commit(),
+        "parameters": vars(args),
+        "seconds": elapsed,
+        "executions": len(grader_server.requests),
+        "user_lookups": mooc_server.requests,
+        "overall": summarise(load.samples["submit"] + load.samples["get"], elapsed),
+        "submit": summarise(load.samples["submit"], elapsed),
+        "get": summarise(load.samples["get"], elapsed),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
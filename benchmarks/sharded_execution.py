@@ -0,0 +1,131 @@
+"""Compare the grading latency of a problem with expensive tests run serially and in shards.
+
+By default submissions are graded against a local dyalog.run stand-in, which takes
+a fixed time to start each run plus a fixed time per test case. Pass
+`--url wss://dyalog.run/api/v0/ws/execute` to grade on the real service, where
+each test case computes an outer product of a few thousand numbers.
+"""
+
+import argparse
+import asyncio
+import json
+import re
+import time
+from backend import create_app, grader
+from benchmarks.loadtest import percentiles
+from tests.standins import DyalogRunStandin, apl_response
+
+CODE = "F←{+/,∘.×⍨⍳⍵}"
+
+
+def problem(cases: int, edge: int, shards: int) -> dict:
+    """
+    Build a problem whose test cases all take about the same time.
+
+    Args:
+        cases (int): The number of test cases
+        edge (int): How many of the cases are edge cases
+        shards (int): The number of shards
+
+    Returns:
+        dict: The problem configuration
+    """
+
+    values = [str(3000 + i) for i in range(cases)]
+    return {
+        "id": "benchmark",
+        "entrypoint": "F",
+        "tests": {"basic": values[:cases - edge], "edge": values[cases - edge:]},
+        "reference": CODE,
+        "post": "⊢",
+        "shards": shards,
+    }
+
+
+def standin_handler(startup: float, per_case: float):
+    """
+    Mimic dyalog.run starting an interpreter and running each test case of a submission.
+
+    Args:
+        startup (float): Seconds to start a run
+        per_case (float): Seconds to run one test case
+
+    Returns:
+        The request handler
+    """
+
+    async def handler(request):
+        options = re.search(r"opts←0⎕JSON'(.*)'", request["code"]).group(1)
+        tests = json.loads(options.replace("''", "'"))["tests"]
+        await asyncio.sleep(startup + per_case * sum(len(cases) for cases in tests.values()))
+        return apl_response('{"status":2}')
+
+    return handler
+
+
+def measure(options: dict, iterations: int) -> dict:
+    """
+    Grade a correct submission repeatedly.
+
+    Args:
+        options (dict): The problem configuration
+        iterations (int): The number of submissions to grade
+
+    Returns:
+        dict: The number of shards, the grading status and latency percentiles
+    """
+
+    status, _ = grader.loop.run(grader.evaluate(CODE, options))  # Warm up the connection pool
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        grader.loop.run(grader.evaluate(CODE, options))
+        latencies.append(time.perf_counter() - start)
+
+    return {"shards": options["shards"], "status": status.name, **percentiles(latencies)}
+
+
+def main():
+    """
+    Run the benchmark and print the results as JSON.
+    """
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--url", help="Execution service URL. Defaults to a local stand-in.")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--cases", type=int, default=12, help="Test cases of the problem")
+    parser.add_argument("--edge", type=int, default=4, help="How many of the cases are edge cases")
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--startup-ms", type=float, default=50,
+                        help="Stand-in time to start a run")
+    parser.add_argument("--case-ms", type=float, default=50,
+                        help="Stand-in time to run one test case")
+    args = parser.parse_args()
+
+    standin = None
+    url = args.url
+    if url is None:
+        standin = DyalogRunStandin(standin_handler(args.startup_ms / 1000, args.case_ms / 1000))
+        url = standin.start()
+
+    try:
+        # Runs of every size share one latency window, so hedging would duplicate the longer ones
+        create_app(True, {"GRADER_URL": url, "GRADER_HEDGE_ENABLED": False})
+        results = [
+            measure(problem(args.cases, args.edge, shards), args.iterations)
+            for shards in args.shards
+        ]
+    finally:
+        if standin is not None:
+            standin.stop()
+
+    print(json.dumps({
+        "benchmark": "sharded_execution",
+        "cases": args.cases,
+        "edge": args.edge,
+        "results": results,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+"""Gunicorn settings for serving the APL MOOC backend.
+
+Each worker process handles requests on a pool of threads. Grading I/O is awaited
+on the worker's shared event loop, but the request's thread waits for it, and the
+mooc.fi lookup blocks its thread directly. Every pending request therefore holds
+a thread, so a worker serves at most `threads` requests at once, and
+`benchmarks/loadtest.py --gunicorn-threads` measures where that limit lies. The
+settings can be overridden with `GUNICORN_`-prefixed environment variables.
+"""
+
+import os
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:20001")
+workers = int(os.environ.get("GUNICORN_WORKERS", "4"))
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", "128"))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "60"))
+keepalive = 5
+
+
+def on_starting(server):
+    """
+    Remove the metrics snapshots left by the previous run of the server.
+    """
+
+    del server
+    from backend import metrics  # pylint: disable=import-outside-toplevel
+    metrics.clear(os.path.join(os.getcwd(), "instance", "metrics"))
+
+
+def worker_exit(server, worker):
+    """
+    Write the point awards and attempt counts still buffered by a worker before it exits.
+    """
+
+    del server, worker
+    from backend import awards  # pylint: disable=import-outside-toplevel
+    awards.stop()
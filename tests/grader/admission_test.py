@@ -0,0 +1,102 @@
+"""This file contains the tests for the admission control of the APL MOOC backend.
+
+Submissions are graded against a local stand-in server instead of dyalog.run.
+"""
+
+import asyncio
+import base64
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from backend import admission, create_app, database, grader
+from tests.standins import DyalogRunStandin, apl_response
+from . import helper
+
+
+class TestAdmission(unittest.TestCase):
+    """Test class for per-user rate limits and the grading limit of each worker."""
+
+    def setUp(self):
+        async def slow_response(request):
+            del request
+            await asyncio.sleep(self.latency)
+            return apl_response('{"status":2}')
+
+        self.latency = 0
+        self.server = DyalogRunStandin(slow_response)
+        self.app = helper.create_hermetic_app(self.server.start(), {
+            "ADMISSION_MAX_IN_FLIGHT": 1,
+            "ADMISSION_USER_RATE": 0.1,
+            "ADMISSION_USER_BURST": 2,
+        })
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_user_rate_limited(self):
+        """
+        Test that a user submitting too often is turned away without affecting other users.
+        """
+
+        statuses = [helper.submit_as(self.client, f"F←{{⍵+{i}}}").status_code for i in range(2)]
+        rejected = helper.submit_as(self.client, "F←{⍵+2}")
+        other = helper.submit_as(self.client, "F←{⍵+3}", id_user="2")
+
+        self.assertListEqual(statuses, [200, 200])
+        self.assertEqual(rejected.status_code, 429)
+        self.assertEqual(rejected.headers["Retry-After"], "10")
+        self.assertEqual(other.status_code, 200)
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_in_flight_limited(self):
+        """
+        Test that submissions beyond the grading limit are turned away while others run,
+        and admitted again once they finish.
+        """
+
+        self.latency = 0.5
+
+        def submit(id_user):
+            return self.app.test_client().post("/submit", json={
+                "id_problem": "test_p1",
+                "mooc_token": id_user,
+                "code_encoded": base64.b64encode(f"F←{{⍵+{id_user}}}".encode()).decode(),
+            })
+
+        with mock.patch.object(grader, "get_user_id", side_effect=lambda token: token):
+            with ThreadPoolExecutor(2) as executor:
+                first = executor.submit(submit, "1")
+                time.sleep(0.2)
+                second = executor.submit(submit, "2")
+                statuses = [first.result().status_code, second.result().status_code]
+            third = submit("3")
+
+        self.assertListEqual(statuses, [200, 429])
+        self.assertEqual(third.status_code, 200)
+
+    def test_token_bucket_refills(self):
+        """
+        Test that a token bucket refills over time up to its capacity.
+        """
+
+        with self.app.app_context():
+            self.assertEqual(database.take_token("key", rate=1000, burst=1), 0)
+            time.sleep(0.01)
+            self.assertEqual(database.take_token("key", rate=1000, burst=1), 0)
+            self.assertGreater(database.take_token("key", rate=0.001, burst=1), 0)
+
+    def test_limit_split_between_workers(self):
+        """
+        Test that the grading limit is divided between the worker processes,
+        and that a user rate which could never admit a submission is refused.
+        """
+
+        create_app(True, {"ADMISSION_MAX_IN_FLIGHT": 64, "ADMISSION_WORKERS": 8})
+        self.assertEqual(admission._settings["max_in_flight"], 8)  # pylint: disable=protected-access
+        create_app(True, {"ADMISSION_MAX_IN_FLIGHT": 2, "ADMISSION_WORKERS": 8})
+        self.assertEqual(admission._settings["max_in_flight"], 1)  # pylint: disable=protected-access
+
+        with self.assertRaises(ValueError):
+            create_app(True, {"ADMISSION_USER_RATE": 0})
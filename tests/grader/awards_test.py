@@ -0,0 +1,147 @@
+"""This file contains the tests for the write-behind buffer of point awards.
+
+These tests call the award functions directly, without grading any code.
+"""
+
+import time
+import unittest
+from sqlalchemy import event
+from backend import awards, database
+from . import helper
+from .points_test import reference_totals
+
+
+class TestAwardBuffer(unittest.TestCase):
+    """Test class for buffered point awards."""
+
+    def create_app(self, durability: str, **config):
+        """
+        Create an application writing awards in the given durability mode,
+        and use it for the rest of the test.
+
+        Returns:
+            The Flask application
+        """
+
+        app = helper.create_hermetic_app("ws://127.0.0.1:1", {
+            "AWARDS_DURABILITY": durability,
+            "AWARDS_FLUSH_INTERVAL": 60,
+            **config,
+        })
+        context = app.app_context()
+        context.push()
+        self.addCleanup(context.pop)
+        self.addCleanup(awards.stop)
+        return app
+
+    def test_async_read_your_writes(self):
+        """
+        Test that pending awards keep only the best result per user and problem,
+        are shown by /get before they are written, and are all written together.
+        """
+
+        app = self.create_app("async")
+        database.insert_points("1", "p1", 1)
+        awards.insert_points("1", "p1", 2)
+        awards.insert_points("1", "p1", 0)
+        awards.insert_points("1", "p2", 1)
+        awards.insert_points("2", "p1", 0)
+
+        self.assertListEqual(reference_totals(), [{"id_user": "1", "points": 1}])
+        response = app.test_client().get("/get")
+        self.assertListEqual(response.json["points"], [
+            {"id_user": "1", "points": 3},
+            {"id_user": "2", "points": 0},
+        ])
+
+        awards.flush()
+        self.assertListEqual(reference_totals(), response.json["points"])
+        self.assertListEqual(database.get_all_points(), response.json["points"])
+        self.assertEqual(database.get_problem_stats("p1")[0], {
+            "id_problem": "p1",
+            "attempts": 4,
+            "users": 2,
+            "outcomes": {"0": 1, "1": 0, "2": 1},
+        })
+        self.assertNotEqual(app.test_client().get("/get").headers["ETag"],
+                            response.headers["ETag"])
+
+    def test_group_waits_for_commit(self):
+        """
+        Test that an award in group mode returns only once it has been committed.
+        """
+
+        self.create_app("group", AWARDS_FLUSH_INTERVAL=0.05)
+        awards.insert_points("1", "p1", 2)
+
+        self.assertListEqual(reference_totals(), [{"id_user": "1", "points": 2}])
+
+    def test_group_timeout_writes_alone(self):
+        """
+        Test that an award in group mode is written on its own if its batch is not committed
+        in time, and that its attempt is still counted once.
+        """
+
+        self.create_app("group", AWARDS_GROUP_TIMEOUT=0.1)
+        buffer = awards._settings["buffer"]  # pylint: disable=protected-access
+        with buffer._write_lock:  # pylint: disable=protected-access
+            awards.insert_points("1", "p1", 2)
+            self.assertListEqual(reference_totals(), [{"id_user": "1", "points": 2}])
+
+        awards.flush()
+        self.assertEqual(database.get_problem_stats("p1")[0]["attempts"], 1)
+
+    def test_written_when_full(self):
+        """
+        Test that awards are written early once enough are pending.
+        """
+
+        self.create_app("async", AWARDS_FLUSH_SIZE=2)
+        awards.insert_points("1", "p1", 2)
+        awards.insert_points("2", "p1", 1)
+
+        deadline = time.monotonic() + 5
+        while len(reference_totals()) < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(len(reference_totals()), 2)
+
+    def test_written_on_stop(self):
+        """
+        Test that pending awards are written when buffering stops.
+        """
+
+        self.create_app("async")
+        awards.insert_points("1", "p1", 2)
+        awards.stop()
+
+        self.assertListEqual(reference_totals(), [{"id_user": "1", "points": 2}])
+
+    def test_no_op_awards_write_nothing(self):
+        """
+        Test that awards not raising a user's points commit nothing, and that their
+        attempts are still counted once the counts are written.
+        """
+
+        self.create_app("sync")
+        awards.insert_points("1", "p1", 2)
+
+        statements, commits = [], []
+        engine = database.db.engine
+        listeners = (
+            (engine, "before_cursor_execute", lambda *args: statements.append(args[2])),
+            (engine, "commit", lambda *args: commits.append(None)),
+        )
+        for target, name, listener in listeners:
+            event.listen(target, name, listener)
+            self.addCleanup(event.remove, target, name, listener)
+
+        awards.insert_points("1", "p1", 1)
+        self.assertListEqual(statements, [])
+
+        awards._settings["known"].clear()  # pylint: disable=protected-access
+        awards.insert_points("1", "p1", 2)
+        self.assertListEqual(commits, [])
+
+        awards.flush()
+        self.assertEqual(database.get_problem_stats("p1")[0]["attempts"], 3)
+        self.assertListEqual(reference_totals(), [{"id_user": "1", "points": 2}])
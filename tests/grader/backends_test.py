@@ -0,0 +1,153 @@
+"""This file contains the tests for the execution backends of the APL MOOC backend.
+
+The local interpreter pool is tested with a fake interpreter
+instead of a real APL installation. The default sandbox needs root, so most tests
+run the fake interpreter without it, and the sandbox itself and a real `dyalog`
+are only tested where they are available.
+"""
+
+import asyncio
+import json
+import os
+import shutil
+import sys
+import unittest
+from backend import config, create_app, grader
+from backend.backends import LocalInterpreterPool
+
+FAKE_INTERPRETER = os.path.join(os.path.dirname(__file__), "fake_interpreter.py")
+SANDBOX_AVAILABLE = (
+    os.geteuid() == 0
+    and all(shutil.which(tool) for tool in ("unshare", "setpriv", "prlimit"))
+)
+
+
+class TestLocalInterpreterPool(unittest.TestCase):
+    """Test class for the local interpreter pool backend."""
+
+    def setUp(self):
+        create_app(True, {
+            "GRADER_BACKEND": "local",
+            "GRADER_LOCAL_COMMAND": [sys.executable, FAKE_INTERPRETER],
+            "GRADER_LOCAL_SANDBOX": "env",
+            "GRADER_LOCAL_USER": None,
+            "GRADER_LOCAL_POOL_SIZE": 2,
+        })
+
+    def tearDown(self):
+        create_app(True)
+
+    def test_framework_preloaded(self):
+        """
+        Test that submissions run on interpreters that already loaded the framework,
+        and that the framework is not sent again with the submission.
+        """
+
+        result = grader.loop.run(grader.evaluate("F←{⍵}", {"id": "test"}))
+        self.assertEqual(result, (grader.GradingStatus.PASSED_ALL, ""))
+
+        response = grader.loop.run(grader.run_apl("F←{⍵}"))
+        output = json.loads(response["stdout"])
+        self.assertTrue(output["preloaded"])
+        self.assertFalse(output["framework_sent_again"])
+        self.assertEqual(output["limits"], {
+            "as": 1024 * 1024 * 1024,
+            "core": 0,
+            "cpu": 60,
+            "fsize": 16 * 1024 * 1024,
+            "nproc": 1024,
+        })
+
+    def test_processes_recycled(self):
+        """
+        Test that each submission runs on a fresh interpreter process.
+        """
+
+        pids = {
+            json.loads(grader.loop.run(grader.run_apl(""))["stdout"])["pid"]
+            for _ in range(4)
+        }
+        self.assertEqual(len(pids), 4)
+
+    def test_timeout(self):
+        """
+        Test that runaway submissions time out and the pool keeps working afterwards.
+        """
+
+        response = grader.loop.run(grader.run_apl("LOOP"))
+        self.assertTrue(response["timed_out"])
+
+        response = grader.loop.run(grader.run_apl(""))
+        self.assertFalse(response["timed_out"])
+
+    def test_start_failure_reported(self):
+        """
+        Test that a submission fails at once when its interpreter cannot be started.
+        """
+
+        pool = LocalInterpreterPool([os.path.join(os.path.dirname(__file__), "missing")], "",
+                                    size=1, acquire_timeout=5)
+        pool._limited_command = lambda: pool.command  # pylint: disable=protected-access
+
+        with self.assertRaises(FileNotFoundError):
+            asyncio.run(pool.execute("", 1))
+
+    def test_sandbox_required(self):
+        """
+        Test that the local backend refuses to start without a sandbox.
+        """
+
+        with self.assertRaises(ValueError):
+            create_app(True, {"GRADER_BACKEND": "local", "GRADER_LOCAL_SANDBOX": ""})
+
+
+@unittest.skipUnless(SANDBOX_AVAILABLE, "The default sandbox needs root and util-linux")
+class TestLocalSandbox(unittest.TestCase):
+    """Test class for running the local interpreter pool in the default sandbox."""
+
+    def tearDown(self):
+        create_app(True)
+
+    @unittest.skipUnless(os.path.exists("/usr/bin/python3"), "No system Python")
+    def test_isolated(self):
+        """
+        Test that interpreters run as the sandbox user without network access.
+        """
+
+        # The sandbox user may not be able to read this checkout, so the fake
+        # interpreter is passed as a program text to a system-wide Python
+        with open(FAKE_INTERPRETER, encoding="utf-8") as file:
+            source = file.read()
+        create_app(True, {
+            "GRADER_BACKEND": "local",
+            "GRADER_LOCAL_COMMAND": ["/usr/bin/python3", "-c", source],
+            "GRADER_LOCAL_POOL_SIZE": 1,
+        })
+
+        output = json.loads(grader.loop.run(grader.run_apl(""))["stdout"])
+        self.assertEqual(output["uid"], config.GRADER_LOCAL_USER)
+        self.assertEqual(output["interfaces"], ["lo"])
+        self.assertEqual(output["limits"]["cpu"], config.GRADER_LOCAL_CPU_LIMIT)
+
+    @unittest.skipUnless(shutil.which("dyalog"), "Dyalog APL is not installed")
+    def test_dyalog(self):
+        """
+        Test grading with a real interpreter, which also checks that its startup
+        and the framework print nothing that would corrupt the result.
+        """
+
+        create_app(True, {"GRADER_BACKEND": "local", "GRADER_LOCAL_POOL_SIZE": 1})
+
+        options = {
+            "id": "test",
+            "entrypoint": "F",
+            "tests": {"basic": ["1", "2 3"]},
+            "reference": "F←{⍵}",
+            "post": "⊢",
+        }
+        self.assertEqual(
+            grader.loop.run(grader.evaluate("F←{⍵}", options)),
+            (grader.GradingStatus.PASSED_ALL, ""),
+        )
+        status, _ = grader.loop.run(grader.evaluate("F←{-⍵}", options))
+        self.assertEqual(status, grader.GradingStatus.FAILED)
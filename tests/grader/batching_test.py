@@ -0,0 +1,180 @@
+"""This file contains the tests for batched execution in the APL MOOC grader.
+
+Batches are run against a local stand-in server that mimics
+the output of the test framework for each submission.
+"""
+
+import asyncio
+import json
+import re
+import unittest
+from backend import create_app, grader
+from backend.batching import SubmissionBatcher
+from tests.standins import DyalogRunStandin, apl_response
+
+
+def fake_test_run(request: dict) -> dict:
+    """
+    Mimic dyalog.run running one submission or a batch of submissions.
+    Submissions containing `LOOP` time out, and those containing `FAIL` fail their tests.
+
+    Args:
+        request (dict): The unpacked request
+
+    Returns:
+        dict: The response
+    """
+
+    codes = re.findall(r"user_code←0⎕JSON'(.*)'", request["code"])
+    if any("LOOP" in code for code in codes):
+        return apl_response(timed_out=True)
+
+    outputs = [json.dumps({"status": 0 if "FAIL" in code else 2}) for code in codes]
+    tags = re.findall(r"⎕←'([0-9a-f]+:\d+:)'", request["code"])
+    if not tags:
+        return apl_response(outputs[0])
+    return apl_response("\n".join(tag + output for tag, output in zip(tags, outputs)))
+
+
+class TestBatching(unittest.TestCase):
+    """Test class for the submission batcher."""
+
+    def setUp(self):
+        self.server = DyalogRunStandin(fake_test_run)
+        create_app(True, {
+            "GRADER_URL": self.server.start(),
+            "GRADER_BATCH_SIZE": 4,
+            "GRADER_BATCH_TRUSTED": True,
+            "GRADER_BATCH_LINGER": 0.5,
+        })
+
+    def tearDown(self):
+        create_app(True)
+        self.server.stop()
+
+    @staticmethod
+    def evaluate_all(codes: list) -> list:
+        """
+        Evaluate several submissions concurrently.
+
+        Args:
+            codes (list): The submitted code of each submission
+
+        Returns:
+            list: The grading status of each submission
+        """
+
+        async def evaluate():
+            return await asyncio.gather(*(grader.evaluate(code, {"id": "test"}) for code in codes))
+
+        return [status for status, _ in grader.loop.run(evaluate())]
+
+    def test_batch_demultiplexed(self):
+        """
+        Test that concurrent submissions run in one batch and each gets its own result.
+        """
+
+        statuses = self.evaluate_all(["F←{⍵}", "F←{FAIL}", "F←{⍵}", "F←{FAIL}"])
+
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertListEqual(statuses, [
+            grader.GradingStatus.PASSED_ALL,
+            grader.GradingStatus.FAILED,
+            grader.GradingStatus.PASSED_ALL,
+            grader.GradingStatus.FAILED,
+        ])
+
+    def test_failure_attributed_to_entry(self):
+        """
+        Test that a submission timing out the batch is retried alone
+        and the other submissions still get their results.
+        """
+
+        statuses = self.evaluate_all(["F←{⍵}", "F←{LOOP}", "F←{FAIL}"])
+
+        self.assertEqual(len(self.server.requests), 4)
+        self.assertListEqual(statuses, [
+            grader.GradingStatus.PASSED_ALL,
+            grader.GradingStatus.ERROR,
+            grader.GradingStatus.FAILED,
+        ])
+
+    def test_batched_by_time_limit(self):
+        """
+        Test that only submissions with the same time limit are batched together,
+        and each runs with its own limit.
+        """
+
+        async def evaluate():
+            return await asyncio.gather(*(
+                grader.evaluate(code, {"id": "test", **options}) for code, options in [
+                    ("F←{⍵}", {}), ("F←{FAIL}", {"time_limit": 12}),
+                    ("F←{⍵}", {}), ("F←{⍵}", {"time_limit": 12}),
+                ]
+            ))
+
+        statuses = [status for status, _ in grader.loop.run(evaluate())]
+
+        self.assertListEqual(sorted(request["timeout"] for request in self.server.requests),
+                             [10, 12])
+        self.assertListEqual(statuses, [
+            grader.GradingStatus.PASSED_ALL,
+            grader.GradingStatus.FAILED,
+            grader.GradingStatus.PASSED_ALL,
+            grader.GradingStatus.PASSED_ALL,
+        ])
+
+    def test_batch_timeout_capped(self):
+        """
+        Test that a batch never runs longer than its submissions would have on their own.
+        """
+
+        async def evaluate():
+            return await asyncio.gather(*(
+                grader.evaluate(code, {"id": "test", "time_limit": 1})
+                for code in ["F←{⍵}", "F←{FAIL}"]
+            ))
+
+        grader.loop.run(evaluate())
+
+        self.assertListEqual([request["timeout"] for request in self.server.requests], [2])
+
+    def test_workspace_reset_between_entries(self):
+        """
+        Test that the workspace and test framework are reset before every submission.
+        """
+
+        batcher = SubmissionBatcher(
+            run=None, execute_single=None, prologue=lambda: "PROLOGUE\n",
+            encode=lambda code, _: f"CODE {code}\n", size=2, linger=0, timeout=10,
+        )
+        program = batcher.build_program("abc", [("F←1", "opts"), ("F←2", "opts")])
+
+        lines = program.splitlines()
+        self.assertEqual(program.count("⎕SE.Test←0(220⌶)¯2(219⌶)⎕SE.T"), 2)
+        for code in ("F←1", "F←2"):
+            before = lines[:lines.index(f"CODE {code}")]
+            self.assertEqual(before[-1], "⎕SE.Test←0(220⌶)¯2(219⌶)⎕SE.T")
+            self.assertIn("⎕EX ⎕NL⍳9", before[-9:])
+            self.assertIn("⎕IO←1", before[-9:])
+
+    def test_untrusted_batching_refused(self):
+        """
+        Test that batching is only enabled once every submitter is confirmed to be trusted.
+        """
+
+        with self.assertRaises(ValueError):
+            create_app(True, {"GRADER_URL": self.server.url, "GRADER_BATCH_SIZE": 4})
+
+    def test_split_output_ignores_forged_lines(self):
+        """
+        Test that result lines printed more than once are not trusted.
+        """
+
+        outputs = SubmissionBatcher.split_output("abc", "\n".join([
+            'abc:0:{"status":0}',
+            'abc:1:{"status":2}',
+            'abc:1:{"status":0}',
+            'xyz:2:{"status":2}',
+        ]))
+        self.assertDictEqual(outputs, {0: '{"status":0}'})
@@ -0,0 +1,124 @@
+"""This file contains the tests for the persistent caches of the APL MOOC backend."""
+
+import unittest
+from unittest import mock
+from backend import cache, database, grader
+from tests.standins import MoocStandin
+from . import helper
+
+
+def mooc_response(status_code: int, id_user: str | None = None):
+    """
+    Build a fake mooc.fi response for a UserInfo query.
+
+    Args:
+        status_code (int): The HTTP status code
+        id_user (str, optional): The user ID, or None for an unknown token
+
+    Returns:
+        A mock response object
+    """
+
+    user = {"id": id_user} if id_user else None
+    response = mock.Mock(status_code=status_code)
+    response.json.return_value = {"data": {"currentUser": user}}
+    return response
+
+
+class TestCache(unittest.TestCase):
+    """Test class for the database-backed TTL cache."""
+
+    def setUp(self):
+        self.app = helper.create_hermetic_app("ws://127.0.0.1:1")
+        self.context = self.app.app_context()
+        self.context.push()
+
+    def tearDown(self):
+        self.context.pop()
+
+    def test_hits_and_expiry(self):
+        """
+        Test that cached values are returned until they expire.
+        """
+
+        ttl_cache = cache.TTLCache("test", ttl=60, max_entries=10)
+        self.assertIs(ttl_cache.get("a"), cache.MISSING)
+
+        ttl_cache.set("a", {"value": 1})
+        ttl_cache.set("b", None, ttl=-1)
+        self.assertDictEqual(ttl_cache.get("a"), {"value": 1})
+        self.assertIs(ttl_cache.get("b"), cache.MISSING)
+        self.assertEqual((ttl_cache.hits, ttl_cache.misses), (1, 2))
+
+        self.assertEqual(ttl_cache.get("a", count=False), {"value": 1})
+        self.assertIs(ttl_cache.get("c", count=False), cache.MISSING)
+        self.assertEqual((ttl_cache.hits, ttl_cache.misses), (1, 2))
+
+    def test_lru_eviction(self):
+        """
+        Test that the least recently used entries are evicted above the size limit.
+        """
+
+        ttl_cache = cache.TTLCache("test", ttl=60, max_entries=2, evict_every=1, touch_fraction=0)
+        ttl_cache.set("a", 1)
+        ttl_cache.set("b", 2)
+        ttl_cache.get("a")
+        ttl_cache.set("c", 3)
+
+        self.assertEqual(ttl_cache.get("a"), 1)
+        self.assertIs(ttl_cache.get("b"), cache.MISSING)
+        self.assertEqual(ttl_cache.get("c"), 3)
+
+    def test_recent_use_not_rewritten(self):
+        """
+        Test that a hit only records its use once the last record is old enough.
+        """
+
+        ttl_cache = cache.TTLCache("test", ttl=60, max_entries=2)
+        with mock.patch("time.time", return_value=1000):
+            ttl_cache.set("a", 1)
+        with mock.patch("time.time", return_value=1005):
+            self.assertEqual(ttl_cache.get("a"), 1)
+        self.assertEqual(database.db.session.get(database.CacheEntries, ("test", "a")).last_used,
+                         1000)
+        with mock.patch("time.time", return_value=1007):
+            self.assertEqual(ttl_cache.get("a"), 1)
+        self.assertEqual(database.db.session.get(database.CacheEntries, ("test", "a")).last_used,
+                         1007)
+
+    def test_user_id_cached(self):
+        """
+        Test that repeated lookups of a token only query mooc.fi once,
+        including for rejected tokens, but not after server errors.
+        """
+
+        with mock.patch.object(grader.session, "post", return_value=mooc_response(200, "7")) as post:
+            self.assertEqual(grader.get_user_id("valid"), "7")
+            self.assertEqual(grader.get_user_id("valid"), "7")
+            self.assertEqual(post.call_count, 1)
+
+        with mock.patch.object(grader.session, "post", return_value=mooc_response(200)) as post:
+            self.assertIsNone(grader.get_user_id("invalid"))
+            self.assertIsNone(grader.get_user_id("invalid"))
+            self.assertEqual(post.call_count, 1)
+
+        with mock.patch.object(grader.session, "post", return_value=mooc_response(502)) as post:
+            self.assertIsNone(grader.get_user_id("unlucky"))
+            self.assertIsNone(grader.get_user_id("unlucky"))
+            self.assertEqual(post.call_count, 2)
+
+    def test_user_id_from_standin(self):
+        """
+        Test that tokens are resolved over HTTP against the mooc.fi stand-in.
+        """
+
+        server = MoocStandin(users={"token": "42"})
+        with mock.patch.dict(grader._settings, {"mooc_api": server.start()}):  # pylint: disable=protected-access
+            try:
+                self.assertEqual(grader.get_user_id("token"), "42")
+                self.assertEqual(grader.get_user_id("user-7"), "7")
+                self.assertIsNone(grader.get_user_id("forged"))
+                self.assertEqual(grader.get_user_id("token"), "42")
+                self.assertEqual(server.requests, 3)
+            finally:
+                server.stop()
@@ -0,0 +1,37 @@
+"""A fake APL interpreter used to test the local interpreter pool.
+
+It reads the test framework from standard input up to the line `⎕CS #`,
+then reads the submission and prints a `⎕SE.Test.Run`-style JSON result.
+Submissions containing `LOOP` never finish.
+"""
+
+import json
+import os
+import resource
+import socket
+import sys
+import time
+
+preloaded = False
+for line in sys.stdin:
+    if line.strip() == "⎕CS #":
+        preloaded = True
+        break
+
+submission = sys.stdin.read()
+if "LOOP" in submission:
+    while True:
+        time.sleep(1)
+
+print(json.dumps({
+    "status": 2,
+    "pid": os.getpid(),
+    "preloaded": preloaded,
+    "framework_sent_again": "⎕CS ⎕SE" in submission,
+    "limits": {
+        name: resource.getrlimit(getattr(resource, f"RLIMIT_{name.upper()}"))[0]
+        for name in ("as", "core", "cpu", "fsize", "nproc")
+    },
+    "uid": os.getuid(),
+    "interfaces": [name for _, name in socket.if_nameindex()],
+}))
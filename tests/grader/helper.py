@@ -1,6 +1,8 @@
 """Helper functions for the grader and database tests."""
 
 import base64
+from unittest import mock
+from backend import create_app, database, grader
 
 
 def submit_code(client, path: str, id_user: str = "1", id_problem: str = "ch0_p0_example1"):
@@ -41,3 +43,47 @@ def submit_repeated_correct(client, user_problems: tuple):
 
     for id_user, id_problem in user_problems:
         submit_code(client, "tests/grader/RankingFull.aplf", id_user, id_problem)
+
+
+def create_hermetic_app(grader_url: str, config: dict | None = None):
+    """
+    Helper function used to create an application with an initialised database
+    that grades against a local stand-in server instead of dyalog.run.
+
+    Args:
+        grader_url (str): The websocket URL of the dyalog.run stand-in
+        config (dict, optional): Additional configuration values
+
+    Returns:
+        The Flask application
+    """
+
+    app = create_app(True, {
+        "GRADER_URL": grader_url,
+        "PROBLEMS_DIR": "tests/problems",
+        **(config or {}),
+    })
+    with app.app_context():
+        database.db.create_all()
+    return app
+
+
+def submit_as(client, code: str, id_user: str = "1", id_problem: str = "test_p1"):
+    """
+    Helper function used to submit a piece of APL code as a given user
+    without contacting mooc.fi.
+
+    Args:
+        code (str): The APL code to submit
+        id_user (str, optional): The user the mooc.fi token resolves to
+
+    Returns:
+        A response object from the test client
+    """
+
+    with mock.patch.object(grader, "get_user_id", return_value=id_user):
+        return client.post("/submit", json={
+            "id_problem": id_problem,
+            "mooc_token": "token",
+            "code_encoded": base64.b64encode(code.encode()).decode("utf-8"),
+        })
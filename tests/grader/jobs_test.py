@@ -0,0 +1,119 @@
+"""This file contains the tests for the submission queue of the APL MOOC backend.
+
+Submissions are graded against a local stand-in server instead of dyalog.run.
+"""
+
+import time
+import unittest
+from backend import database, jobs
+from tests.standins import DyalogRunStandin, apl_response
+from . import helper
+
+
+class TestJobs(unittest.TestCase):
+    """Test class for the queued submission endpoints."""
+
+    def setUp(self):
+        def handler(request):
+            del request
+            if self.failing:
+                raise RuntimeError("injected fault")
+            return apl_response('{"status":2}')
+
+        self.failing = False
+        self.server = DyalogRunStandin(handler)
+        self.app = helper.create_hermetic_app(self.server.start(), {
+            "QUEUE_ENABLED": True,
+            "QUEUE_MAX_ATTEMPTS": 2,
+            "QUEUE_RETRY_DELAY": 0.2,
+            "GRADER_BREAKER_ENABLED": False,
+        })
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        jobs.stop_workers()
+        self.server.stop()
+
+    def test_submit_returns_job(self):
+        """
+        Test that submitting returns a job ID whose result can be polled.
+        """
+
+        response = helper.submit_as(self.client, "F←{⍵}")
+        self.assertEqual(response.status_code, 202)
+        id_job = response.json["job_id"]
+
+        response = self.client.get(f"/result/{id_job}?wait=10")
+        self.assertEqual(response.status_code, 200)
+        self.assertDictEqual(response.json, {
+            "job_id": id_job,
+            "status": "done",
+            "points": 2,
+            "feedback": "All tests passed!",
+        })
+
+        response = self.client.get("/get")
+        self.assertListEqual(response.json["points"], [{"id_user": "1", "points": 2}])
+
+    def test_abandoned_job_resumed(self):
+        """
+        Test that a job left running by a crashed worker is graded again.
+        """
+
+        with self.app.app_context():
+            id_job = database.enqueue_job("1", "test_p1", "F←{⍵}")
+            database.db.session.execute(
+                database.db.update(database.Jobs)
+                .values(status="running", updated=time.time() - 3600)
+            )
+            database.db.session.commit()
+
+        response = self.client.get(f"/result/{id_job}?wait=10")
+        self.assertEqual(response.json["status"], "done")
+        self.assertEqual(response.json["points"], 2)
+
+    def test_unavailable_grader_retried(self):
+        """
+        Test that a job the grader could not answer is queued again after a delay
+        and graded once the grader recovers.
+        """
+
+        self.failing = True
+        id_job = helper.submit_as(self.client, "F←{⍵}").json["job_id"]
+
+        with self.app.app_context():
+            deadline = time.monotonic() + 5
+            job = database.get_job(id_job)
+            while job.status != "queued" or job.attempts == 0:
+                self.assertLess(time.monotonic(), deadline)
+                time.sleep(0.01)
+                job = database.get_job(id_job)
+            self.assertGreater(job.updated, time.time())
+
+        self.failing = False
+        response = self.client.get(f"/result/{id_job}?wait=10")
+        self.assertEqual(response.json["status"], "done")
+        self.assertEqual(response.json["points"], 2)
+
+    def test_unavailable_grader_attempts_limited(self):
+        """
+        Test that a job fails once the grader has been unavailable for all its attempts.
+        """
+
+        self.failing = True
+        id_job = helper.submit_as(self.client, "F←{⍵}").json["job_id"]
+
+        response = self.client.get(f"/result/{id_job}?wait=10")
+        self.assertDictEqual(response.json, {
+            "job_id": id_job,
+            "status": "failed",
+            "feedback": "The grader is unavailable, please submit again.",
+        })
+
+    def test_unknown_job(self):
+        """
+        Test that polling an unknown job returns an HTTP 404 response.
+        """
+
+        response = self.client.get("/result/unknown")
+        self.assertEqual(response.status_code, 404)
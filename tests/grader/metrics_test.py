@@ -0,0 +1,149 @@
+"""This file contains the tests for the metrics of the APL MOOC backend.
+
+Submissions are graded against a local stand-in server instead of dyalog.run.
+"""
+
+import json
+import os
+import subprocess
+import unittest
+from backend import metrics
+from tests.standins import DyalogRunStandin, apl_response
+from . import helper
+
+
+class TestMetrics(unittest.TestCase):
+    """Test class for the metrics endpoint."""
+
+    def setUp(self):
+        self.server = DyalogRunStandin(lambda request: apl_response('{"status":2}'))
+        self.app = helper.create_hermetic_app(self.server.start())
+        self.client = self.app.test_client()
+        metrics.recorder.reset()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def write_snapshot(self, pid: int, snapshot: dict, start: str | None = None):
+        """
+        Write a metrics snapshot as if it came from another worker process.
+        """
+
+        start = start or metrics._process_start(pid) or "0"  # pylint: disable=protected-access
+        path = os.path.join(self.app.instance_path, "metrics", f"{pid}-{start}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(snapshot, f)
+
+    def test_submission_stages(self):
+        """
+        Test that a graded submission is counted and each of its stages is timed.
+        """
+
+        helper.submit_as(self.client, "F←{⍵}")
+        response = self.client.get("/metrics")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.content_type.startswith("text/plain"))
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertIn('aplmooc_gradings_total{status="passed_all"} 1', lines)
+        self.assertIn("aplmooc_gradings_in_flight 0", lines)
+        stages = (
+            "user_lookup", "problem_lookup", "connect", "send", "recv", "execute", "parse", "award",
+        )
+        for stage in stages:
+            self.assertIn(f'aplmooc_stage_seconds_count{{stage="{stage}"}} 1', lines)
+
+    def test_cache_lookups_counted(self):
+        """
+        Test that result cache hits and misses are counted.
+        """
+
+        helper.submit_as(self.client, "F←{⍵}")
+        helper.submit_as(self.client, "F←{⍵}")
+
+        lines = self.client.get("/metrics").get_data(as_text=True).splitlines()
+        self.assertIn('aplmooc_cache_lookups_total{cache="results",result="miss"} 1', lines)
+        self.assertIn('aplmooc_cache_lookups_total{cache="results",result="hit"} 1', lines)
+
+    def test_timeouts_counted(self):
+        """
+        Test that timed out executions are counted.
+        """
+
+        self.server.handler = lambda request: apl_response(timed_out=True)
+        helper.submit_as(self.client, "F←{∇⍵}")
+
+        lines = self.client.get("/metrics").get_data(as_text=True).splitlines()
+        self.assertIn("aplmooc_grading_timeouts_total 1", lines)
+        self.assertIn('aplmooc_gradings_total{status="error"} 1', lines)
+
+    def test_aggregated_across_processes(self):
+        """
+        Test that snapshots of other workers are summed, ignoring the gauges of exited workers.
+        """
+
+        with subprocess.Popen(["true"]) as exited:
+            exited.wait()
+
+        snapshot = {
+            "counters": [["aplmooc_grading_timeouts_total", "", 2]],
+            "gauges": [["aplmooc_gradings_in_flight", "", 3]],
+            "histograms": [],
+        }
+        self.write_snapshot(os.getppid(), snapshot)
+        self.write_snapshot(exited.pid, snapshot)
+        metrics.inc("aplmooc_grading_timeouts_total")
+
+        lines = self.client.get("/metrics").get_data(as_text=True).splitlines()
+        self.assertIn("aplmooc_grading_timeouts_total 5", lines)
+        self.assertIn("aplmooc_gradings_in_flight 3", lines)
+
+    def test_exited_processes_retained(self):
+        """
+        Test that the counters of exited workers are folded into one retained snapshot,
+        including those of a worker whose process id was reused, and counted once.
+        """
+
+        snapshot = {
+            "counters": [["aplmooc_grading_timeouts_total", "", 2]],
+            "gauges": [["aplmooc_gradings_in_flight", "", 3]],
+            "histograms": [[metrics.STAGE_SECONDS, 'stage="execute"', [1] + [0] * 12]],
+        }
+        self.write_snapshot(os.getppid(), snapshot, start="1")
+        with subprocess.Popen(["true"]) as exited:
+            exited.wait()
+        self.write_snapshot(exited.pid, snapshot)
+
+        for _ in range(2):
+            lines = self.client.get("/metrics").get_data(as_text=True).splitlines()
+            self.assertIn("aplmooc_grading_timeouts_total 4", lines)
+            self.assertFalse([line for line in lines if line.startswith("aplmooc_gradings_in_")])
+            self.assertIn('aplmooc_stage_seconds_count{stage="execute"} 2', lines)
+
+        directory = os.path.join(self.app.instance_path, "metrics")
+        pid = os.getpid()
+        self.assertEqual(
+            sorted(name for name in os.listdir(directory) if name.endswith(".json")),
+            sorted([metrics.RETIRED, f"{pid}-{metrics._process_start(pid)}.json"]),  # pylint: disable=protected-access
+        )
+
+        metrics.clear(directory)
+        metrics.recorder.reset()
+        lines = self.client.get("/metrics").get_data(as_text=True).splitlines()
+        self.assertNotIn("aplmooc_grading_timeouts_total 4", lines)
+
+    def test_histogram_buckets(self):
+        """
+        Test that histogram buckets are cumulative and end with the total count.
+        """
+
+        for value in (0.003, 0.2, 0.2, 30):
+            metrics.observe(metrics.STAGE_SECONDS, value, stage="execute")
+
+        lines = self.client.get("/metrics").get_data(as_text=True).splitlines()
+        self.assertIn('aplmooc_stage_seconds_bucket{stage="execute",le="0.005"} 1', lines)
+        self.assertIn('aplmooc_stage_seconds_bucket{stage="execute",le="0.1"} 1', lines)
+        self.assertIn('aplmooc_stage_seconds_bucket{stage="execute",le="0.25"} 3', lines)
+        self.assertIn('aplmooc_stage_seconds_bucket{stage="execute",le="+Inf"} 4', lines)
+        self.assertIn('aplmooc_stage_seconds_count{stage="execute"} 4', lines)
+        self.assertIn('aplmooc_stage_seconds_sum{stage="execute"} 30.403', lines)
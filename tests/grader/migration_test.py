@@ -0,0 +1,99 @@
+"""This file contains the tests for upgrading a database created by an earlier release.
+
+Each test starts from the tables of the first release, as a deployed database would.
+"""
+
+import json
+import unittest
+from sqlalchemy import inspect, text
+from backend import create_app, database
+from backend.problems import registry
+
+BASELINE_SCHEMA = (
+    "CREATE TABLE points (id INTEGER NOT NULL PRIMARY KEY, id_user VARCHAR NOT NULL, "
+    "id_problem VARCHAR NOT NULL, points INTEGER NOT NULL, "
+    "CONSTRAINT unique_user_problem UNIQUE (id_user, id_problem))",
+    "CREATE TABLE problems (id INTEGER NOT NULL PRIMARY KEY, "
+    "id_problem VARCHAR NOT NULL UNIQUE, config VARCHAR NOT NULL)",
+)
+
+
+class TestMigration(unittest.TestCase):
+    """Test class for running init_db on a database with the baseline schema."""
+
+    def setUp(self):
+        self.app = create_app(True, {"PROBLEMS_DIR": "tests/problems"})
+        self.context = self.app.app_context()
+        self.context.push()
+
+        with database.db.engine.begin() as connection:
+            for statement in BASELINE_SCHEMA:
+                connection.execute(text(statement))
+            with open("tests/problems/test_p1.json", "r", encoding="utf-8") as f:
+                config = json.dumps(json.load(f))
+            connection.execute(
+                text("INSERT INTO problems (id_problem, config) VALUES ('test_p1', :config)"),
+                {"config": config},
+            )
+            connection.execute(
+                text("INSERT INTO points (id_user, id_problem, points) VALUES (:u, :p, :n)"),
+                [{"u": "1", "p": "p1", "n": 2}, {"u": "1", "p": "p2", "n": 1},
+                 {"u": "2", "p": "p1", "n": 0}],
+            )
+
+    def tearDown(self):
+        self.context.pop()
+
+    def init_db(self):
+        """
+        Run the init_db command and check that it succeeded.
+        """
+
+        result = self.app.test_cli_runner().invoke(args=["init_db"])
+        self.assertEqual(result.exit_code, 0, result.output)
+
+    def test_problem_columns_added(self):
+        """
+        Test that init_db adds the problem version columns, after which
+        problems can be synchronised and loaded.
+        """
+
+        self.init_db()
+        columns = {column["name"] for column in inspect(database.db.engine).get_columns("problems")}
+        self.assertTrue({"content_hash", "version"} <= columns)
+
+        result = self.app.test_cli_runner().invoke(args=["sync_problems"])
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual(database.get_problem_versions(), {"test_p1": 2})
+
+        registry.clear()
+        self.assertIsNotNone(registry.get("test_p1"))
+
+        with database.db.engine.begin() as connection:
+            self.assertListEqual(database.add_missing_columns(connection), [])
+
+    def test_totals_backfilled(self):
+        """
+        Test that init_db fills the point totals and problem statistics
+        from the points awarded before they existed.
+        """
+
+        self.init_db()
+
+        response = self.app.test_client().get("/get")
+        self.assertListEqual(response.json["points"], [
+            {"id_user": "1", "points": 3},
+            {"id_user": "2", "points": 0},
+        ])
+        self.assertGreater(response.json["seq"], 0)
+        self.assertDictEqual(database.get_problem_stats("p1")[0], {
+            "id_problem": "p1", "attempts": 2, "users": 2, "outcomes": {"0": 1, "1": 0, "2": 1},
+        })
+
+        # Running init_db again leaves the maintained totals alone
+        database.insert_points("2", "p1", 1)
+        self.init_db()
+        self.assertListEqual(database.get_all_points(), [
+            {"id_user": "1", "points": 3},
+            {"id_user": "2", "points": 1},
+        ])
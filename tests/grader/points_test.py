@@ -0,0 +1,251 @@
+"""This file contains the tests for point storage in the APL MOOC backend.
+
+These tests call the database functions directly, without grading any code.
+"""
+
+import gzip
+import json
+import os
+import random
+import unittest
+from sqlalchemy.sql import func
+from backend import database
+from . import helper
+
+
+def reference_totals() -> list:
+    """
+    Compute the point totals directly from the Points table.
+
+    Returns:
+        list: A list of dictionaries containing the user IDs and total points
+    """
+
+    rows = database.db.session.execute(
+        database.db.select(database.Points.id_user, func.sum(database.Points.points))
+        .group_by(database.Points.id_user)
+        .order_by(database.Points.id_user)
+    ).all()
+    return [{"id_user": row[0], "points": row[1]} for row in rows]
+
+
+class TestPoints(unittest.TestCase):
+    """Test class for storing and totalling points."""
+
+    def setUp(self):
+        self.app = helper.create_hermetic_app("ws://127.0.0.1:1")
+        self.context = self.app.app_context()
+        self.context.push()
+
+    def tearDown(self):
+        self.context.pop()
+
+    def test_totals_consistent(self):
+        """
+        Test that the maintained totals always match totals computed from the Points table.
+        """
+
+        generator = random.Random(0)
+        for _ in range(300):
+            database.insert_points(
+                str(generator.randrange(20)),
+                f"p{generator.randrange(10)}",
+                generator.randrange(3),
+            )
+
+        self.assertListEqual(database.get_all_points(), reference_totals())
+
+    def test_rebuild_totals(self):
+        """
+        Test that the rebuild_totals command repairs totals that drifted from the Points table.
+        """
+
+        database.insert_points("1", "p1", 2)
+        database.insert_points("2", "p1", 1)
+        database.db.session.execute(database.db.update(database.UserTotals).values(points=99))
+        database.db.session.commit()
+
+        result = self.app.test_cli_runner().invoke(args=["rebuild_totals"])
+        self.assertEqual(result.exit_code, 0)
+        self.assertListEqual(database.get_all_points(), [
+            {"id_user": "1", "points": 2},
+            {"id_user": "2", "points": 1},
+        ])
+
+    def test_get_etag(self):
+        """
+        Test that /get answers with HTTP 304 until a total changes.
+        """
+
+        client = self.app.test_client()
+        database.insert_points("1", "p1", 1)
+
+        response = client.get("/get")
+        etag = response.headers["ETag"]
+        response = client.get("/get", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+
+        database.insert_points("1", "p1", 0)
+        response = client.get("/get", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+
+        database.insert_points("1", "p1", 2)
+        response = client.get("/get", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers["ETag"], etag)
+
+    def test_get_since(self):
+        """
+        Test that /get?since= only returns the totals changed after the cursor.
+        """
+
+        client = self.app.test_client()
+        database.insert_points("1", "p1", 1)
+        database.insert_points("2", "p1", 1)
+        seq = client.get("/get").json["seq"]
+
+        database.insert_points("2", "p2", 2)
+        database.insert_points("3", "p1", 0)
+        response = client.get(f"/get?since={seq}")
+        self.assertListEqual(response.json["points"], [
+            {"id_user": "2", "points": 3},
+            {"id_user": "3", "points": 0},
+        ])
+
+        response = client.get(f"/get?since={response.json['seq']}")
+        self.assertListEqual(response.json["points"], [])
+
+    def test_unchanged_totals_not_written(self):
+        """
+        Test that awards that do not raise a user's best score leave the totals unchanged.
+        """
+
+        database.insert_points("1", "p1", 2)
+        seq = database.get_points_seq()[1]
+
+        database.insert_points("1", "p1", 1)
+        database.insert_points("1", "p2", 0)
+        self.assertEqual(database.get_points_seq()[1], seq)
+
+        database.insert_points("1", "p2", 1)
+        self.assertEqual(database.get_points_seq()[1], seq + 1)
+        self.assertListEqual(database.get_all_points(), [{"id_user": "1", "points": 3}])
+
+    def test_export_pages(self):
+        """
+        Test that /export streams totals in user ID order and pages through them with `after`.
+        """
+
+        client = self.app.test_client()
+        for id_user in ("3", "1", "4", "2"):
+            database.insert_points(id_user, "p1", int(id_user) % 3)
+
+        first = client.get("/export?limit=3")
+        rows = [json.loads(line) for line in first.get_data(as_text=True).splitlines()]
+        self.assertEqual(first.mimetype, "application/x-ndjson")
+        self.assertListEqual([row["id_user"] for row in rows], ["1", "2", "3"])
+
+        second = client.get(f"/export?limit=3&after={rows[-1]['id_user']}")
+        self.assertListEqual(
+            second.get_data(as_text=True).splitlines(), ['{"id_user": "4", "points": 1}'],
+        )
+        self.assertEqual(client.get("/export?format=xml").status_code, 400)
+
+    def test_export_csv_gzip(self):
+        """
+        Test that /export writes CSV and compresses it for clients accepting gzip.
+        """
+
+        database.insert_points("1", "p1", 2)
+        database.insert_points("2", "p1", 1)
+
+        response = self.app.test_client().get(
+            "/export?format=csv", headers={"Accept-Encoding": "gzip"},
+        )
+
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertEqual(
+            gzip.decompress(response.get_data()).decode(), "id_user,points\r\n1,2\r\n2,1\r\n",
+        )
+
+    def test_problem_stats(self):
+        """
+        Test that the per-problem counters follow awards and match a rebuild from Points.
+        """
+
+        generator = random.Random(1)
+        for _ in range(300):
+            database.insert_points(
+                str(generator.randrange(20)),
+                f"p{generator.randrange(5)}",
+                generator.randrange(3),
+            )
+
+        stats = self.app.test_client().get("/stats").json["problems"]
+        self.assertEqual(sum(problem["attempts"] for problem in stats), 300)
+        for problem in stats:
+            self.assertEqual(sum(problem["outcomes"].values()), problem["users"])
+
+        result = self.app.test_cli_runner().invoke(args=["rebuild_stats"])
+        self.assertEqual(result.exit_code, 0)
+        self.assertListEqual(database.get_problem_stats(), stats)
+        self.assertListEqual(
+            self.app.test_client().get("/stats?id_problem=p0").json["problems"], stats[:1],
+        )
+
+
+class TestReadReplica(unittest.TestCase):
+    """Test class for routing reads to a separate database."""
+
+    def setUp(self):
+        self.app = helper.create_hermetic_app("ws://127.0.0.1:1", {
+            "DATABASE_READ_URI": f"sqlite:///{os.path.abspath('instance_test/replica.db')}",
+            "DATABASE_POOL_SIZE": 3,
+        })
+        self.context = self.app.app_context()
+        self.context.push()
+
+    def tearDown(self):
+        self.context.pop()
+
+    def replicate(self):
+        """
+        Copy the primary database to the replica, as streaming replication would.
+        """
+
+        database.db.session.commit()
+        primary = database.db.engine.raw_connection()
+        replica = self.app.extensions["aplmooc_read_engine"].raw_connection()
+        try:
+            primary.driver_connection.backup(replica.driver_connection)
+        finally:
+            primary.close()
+            replica.close()
+
+    def test_reads_routed(self):
+        """
+        Test that /get reads from the replica while awards are written to the primary.
+        """
+
+        database.insert_points("1", "p1", 2)
+        self.replicate()
+        database.insert_points("2", "p1", 1)
+
+        client = self.app.test_client()
+        self.assertListEqual(client.get("/get").json["points"], [{"id_user": "1", "points": 2}])
+        self.assertListEqual(reference_totals(), [
+            {"id_user": "1", "points": 2},
+            {"id_user": "2", "points": 1},
+        ])
+
+        self.replicate()
+        self.assertEqual(len(client.get("/get").json["points"]), 2)
+
+    def test_pool_options(self):
+        """
+        Test that the pool options apply to both the primary and the replica.
+        """
+
+        for engine in (database.db.engine, self.app.extensions["aplmooc_read_engine"]):
+            self.assertEqual(engine.pool.size(), 3)
+            self.assertTrue(engine.pool._pre_ping)  # pylint: disable=protected-access
@@ -0,0 +1,120 @@
+"""This file contains the tests for the pooled dyalog.run connections of the APL MOOC backend.
+
+These tests run against a local stand-in server instead of dyalog.run.
+"""
+
+import asyncio
+import socket
+import time
+import unittest
+from types import SimpleNamespace
+from backend import create_app, grader, resilience
+from backend.pool import ConnectionPool
+from tests.standins import DyalogRunStandin, apl_response
+
+
+class TestPool(unittest.TestCase):
+    """Test class for the websocket connection pool."""
+
+    def setUp(self):
+        self.server = DyalogRunStandin(lambda request: apl_response(request["code"]))
+        self.url = self.server.start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_connections_reused(self):
+        """
+        Test that sequential executions share a single connection.
+        """
+
+        create_app(True, {"GRADER_URL": self.url})
+
+        for i in range(5):
+            response = grader.loop.run(grader.run_apl(f"code {i}"))
+            self.assertEqual(response["stdout"], f"code {i}")
+
+        self.assertEqual(self.server.connections, 1)
+
+    def test_pool_size_bounds_connections(self):
+        """
+        Test that concurrent executions never open more connections than the pool size.
+        """
+
+        create_app(True, {"GRADER_URL": self.url, "GRADER_POOL_SIZE": 2})
+
+        async def run_many():
+            return await asyncio.gather(*(grader.run_apl(str(i)) for i in range(10)))
+
+        responses = grader.loop.run(run_many())
+        self.assertListEqual([r["stdout"] for r in responses], [str(i) for i in range(10)])
+        self.assertLessEqual(self.server.connections, 2)
+
+    def test_reconnect_after_server_close(self):
+        """
+        Test that connections closed by the server are replaced transparently.
+        """
+
+        self.server.close_after_response = True
+        # The server closes each connection just after answering, so the pool may not know yet
+        # when the connection is reused, and only a ping finds out
+        create_app(True, {"GRADER_URL": self.url, "GRADER_POOL_PING_AFTER": 0})
+
+        for i in range(3):
+            response = grader.loop.run(grader.run_apl(f"code {i}"))
+            self.assertEqual(response["stdout"], f"code {i}")
+
+        self.assertEqual(self.server.connections, 3)
+
+    def test_unreachable_server_backs_off(self):
+        """
+        Test that connecting to an unreachable server fails after retrying with backoff.
+        """
+
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+
+        pool = ConnectionPool(f"ws://127.0.0.1:{port}", backoff_initial=0.01)
+
+        async def acquire():
+            await pool.acquire()
+
+        with self.assertRaises(OSError):
+            asyncio.run(acquire())
+        self.assertGreater(pool._backoff, 0)  # pylint: disable=protected-access
+
+    def test_request_not_resent_after_send(self):
+        """
+        Test that a request is not sent again when the connection closes while awaiting the answer.
+        """
+
+        def handler(request):
+            raise RuntimeError(request["code"])
+
+        self.server.handler = handler
+        create_app(True, {"GRADER_URL": self.url, "GRADER_HEDGE_ENABLED": False})
+
+        with self.assertRaises(resilience.GraderUnavailable):
+            grader.loop.run(grader.run_apl("code"))
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_recently_used_connection_not_pinged(self):
+        """
+        Test that only connections idle for a while are pinged before reuse.
+        """
+
+        async def ping():
+            raise asyncio.TimeoutError
+
+        # A connection that never answers pings
+        unresponsive = SimpleNamespace(close_code=None, ping=ping)
+        pool = ConnectionPool(self.url, ping_after=5)
+
+        async def healthy(idle):
+            return await pool._healthy(  # pylint: disable=protected-access
+                unresponsive, time.monotonic() - idle,
+            )
+
+        self.assertTrue(asyncio.run(healthy(1)))
+        self.assertFalse(asyncio.run(healthy(10)))
@@ -0,0 +1,127 @@
+"""This file contains the tests for the problem registry of the APL MOOC backend."""
+
+import json
+import os
+import tempfile
+import unittest
+from backend import database, grader
+from backend.problems import registry
+from . import helper
+
+
+class TestProblems(unittest.TestCase):
+    """Test class for the in-memory problem registry."""
+
+    def setUp(self):
+        self.app = helper.create_hermetic_app("ws://127.0.0.1:1", {"PROBLEMS_CHECK_INTERVAL": 0})
+        self.context = self.app.app_context()
+        self.context.push()
+
+    def tearDown(self):
+        self.context.pop()
+
+    def test_problem_prepared(self):
+        """
+        Test that problems are loaded immutable and with their options pre-encoded.
+        """
+
+        problem = registry.get("test_p1")
+        self.assertEqual(problem.config["entrypoint"], "F")
+        self.assertEqual(problem.options_aplcode, grader.compile_options(
+            database.get_problem_config("test_p1")
+        ))
+        with self.assertRaises(TypeError):
+            problem.config["entrypoint"] = "G"
+        self.assertIsNone(registry.get("INVALID_PROBLEM"))
+
+    def test_reload_on_version_change(self):
+        """
+        Test that the registry picks up a new problem set when the version stamp changes.
+        """
+
+        self.assertIsNotNone(registry.get("test_p1"))
+        config = {**database.get_problem_config("test_p1"), "id": "test_p2"}
+        database.db.session.add(database.Problems(id_problem="test_p2", config=json.dumps(config)))
+        database.db.session.commit()
+        self.assertIsNone(registry.get("test_p2"))
+
+        with database.db.engine.begin() as connection:
+            database.bump_version(connection, "problems_version")
+        self.assertEqual(registry.get("test_p2").id, "test_p2")
+
+    def test_sync_writes_only_changed_problems(self):
+        """
+        Test that syncing the problem files only rewrites and reloads the changed problems.
+        """
+
+        with open("tests/problems/test_p1.json", "r", encoding="utf-8") as f:
+            config = json.load(f)
+
+        with tempfile.TemporaryDirectory() as problems_dir:
+            def write(id_problem: str, entrypoint: str):
+                path = os.path.join(problems_dir, f"{id_problem}.json")
+                with open(path, "w", encoding="utf-8") as f:
+                    json.dump({**config, "id": id_problem, "entrypoint": entrypoint}, f)
+
+            def sync() -> dict:
+                with database.db.engine.begin() as connection:
+                    return database.sync_problem_files(connection, problems_dir)
+
+            write("test_p1", "F")
+            write("test_p2", "F")
+            self.assertEqual(sync(), {
+                "added": ["test_p2"], "updated": ["test_p1"], "removed": [],
+                "invalid": [], "duplicates": [],
+            })
+            unchanged = registry.get("test_p2")
+            version = database.get_version("problems_version")
+
+            self.assertEqual(sync(), {
+                "added": [], "updated": [], "removed": [], "invalid": [], "duplicates": [],
+            })
+            self.assertEqual(database.get_version("problems_version"), version)
+
+            write("test_p1", "G")
+            self.assertEqual(sync()["updated"], ["test_p1"])
+            self.assertEqual(database.get_problem_versions(), {"test_p1": 3, "test_p2": 1})
+            self.assertEqual(registry.get("test_p1").config["entrypoint"], "G")
+            self.assertIs(registry.get("test_p2"), unchanged)
+
+            os.remove(os.path.join(problems_dir, "test_p2.json"))
+            self.assertEqual(sync()["removed"], ["test_p2"])
+            self.assertIsNone(registry.get("test_p2"))
+
+    def test_sync_skips_bad_files(self):
+        """
+        Test that invalid problem files are skipped without removing their problem,
+        and that a problem defined by two files is only taken from the first.
+        """
+
+        with open("tests/problems/test_p1.json", "r", encoding="utf-8") as f:
+            config = json.load(f)
+
+        with tempfile.TemporaryDirectory() as problems_dir:
+            def write(name: str, content: str):
+                with open(os.path.join(problems_dir, name), "w", encoding="utf-8") as f:
+                    f.write(content)
+
+            def sync() -> dict:
+                with database.db.engine.begin() as connection:
+                    return database.sync_problem_files(connection, problems_dir)
+
+            write("a.json", json.dumps({**config, "id": "test_p1"}))
+            write("b.json", json.dumps({**config, "id": "test_p1", "entrypoint": "G"}))
+            write("c.json", json.dumps({**config, "id": "test_p2"}))
+            sync()
+            versions = database.get_problem_versions()
+
+            result = sync()
+            self.assertListEqual(result["duplicates"], ["b.json"])
+            self.assertEqual(database.get_problem_versions(), versions)
+            self.assertEqual(registry.get("test_p1").config["entrypoint"], "F")
+
+            write("c.json", "{")
+            result = sync()
+            self.assertListEqual(result["invalid"], ["c.json"])
+            self.assertListEqual(result["removed"], [])
+            self.assertEqual(registry.get("test_p2").id, "test_p2")
@@ -0,0 +1,175 @@
+"""This file contains the tests for hedged requests and the grader circuit breaker.
+
+Faults are injected into a local stand-in server instead of dyalog.run.
+"""
+
+import asyncio
+import time
+import unittest
+from backend import grader, resilience
+from tests.standins import DyalogRunStandin, apl_response
+from . import helper
+
+
+class TestResilience(unittest.TestCase):
+    """Test class for grading against a slow or failing execution backend."""
+
+    def setUp(self):
+        async def handler(request):
+            del request
+            self.calls += 1
+            if self.failing:
+                raise RuntimeError("injected fault")
+            if self.calls in self.slow_calls:
+                await asyncio.sleep(2)
+            await asyncio.sleep(self.delay)
+            return apl_response('{"status":2}')
+
+        self.calls = 0
+        self.failing = False
+        self.slow_calls = set()
+        self.delay = 0
+        self.server = DyalogRunStandin(handler)
+        self.app = helper.create_hermetic_app(self.server.start(), {
+            "GRADER_DEADLINE_MARGIN": 0.5,
+            "GRADER_BREAKER_WINDOW": 4,
+            "GRADER_BREAKER_MIN_CALLS": 4,
+            "GRADER_BREAKER_COOLDOWN": 0.5,
+        })
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_slow_request_hedged(self):
+        """
+        Test that a request slower than usual is sent again and the faster answer is used.
+        """
+
+        for _ in range(20):
+            grader.loop.run(grader.run_apl("⎕←1"))
+        self.slow_calls = {self.calls + 1}
+
+        start = time.perf_counter()
+        response = grader.loop.run(grader.run_apl("⎕←1"))
+
+        self.assertLess(time.perf_counter() - start, 1)
+        self.assertEqual(response["stdout"], '{"status":2}')
+        self.assertEqual(len(self.server.requests), 22)
+
+    def test_latencies_per_time_limit(self):
+        """
+        Test that requests are only hedged by the response times of requests with
+        the same time limit.
+        """
+
+        for _ in range(20):
+            grader.loop.run(grader.run_apl("⎕←1"))
+        self.slow_calls = {self.calls + 1}
+
+        response = grader.loop.run(grader.run_apl("⎕←1", timeout=3))
+
+        self.assertEqual(response["stdout"], '{"status":2}')
+        self.assertEqual(len(self.server.requests), 21)
+
+    def test_hedge_budget(self):
+        """
+        Test that only the budgeted share of recent requests is hedged.
+        """
+
+        calls = []
+
+        async def call():
+            calls.append(None)
+            await asyncio.sleep(0.05)
+            return len(calls)
+
+        async def run_all():
+            budget = resilience.HedgeBudget(fraction=0.5, window=4)
+            return [len(calls) for _ in range(4) if await resilience.hedged(call, 0.01, budget)]
+
+        self.assertListEqual(asyncio.run(run_all()), [2, 3, 4, 6])
+
+    def test_deadline(self):
+        """
+        Test that a request the backend does not answer in time fails instead of hanging.
+        """
+
+        self.slow_calls = {1}
+        start = time.perf_counter()
+        with self.assertRaises(resilience.GraderUnavailable):
+            grader.loop.run(grader.run_apl("⎕←1", timeout=0))
+        self.assertLess(time.perf_counter() - start, 1.5)
+
+    def test_deadline_after_acquisition(self):
+        """
+        Test that waiting for a free connection does not count towards the deadline,
+        and that giving up on the wait does not trip the circuit breaker.
+        """
+
+        self.delay = 0.3
+        helper.create_hermetic_app(self.server.url, {
+            "GRADER_DEADLINE_MARGIN": 0.5,
+            "GRADER_BREAKER_MIN_CALLS": 2,
+            "GRADER_HEDGE_ENABLED": False,
+            "GRADER_POOL_SIZE": 1,
+            "GRADER_ACQUIRE_TIMEOUT": 1,
+        })
+
+        async def run_many(count):
+            return await asyncio.gather(
+                *(grader.run_apl("⎕←1", timeout=0) for _ in range(count)),
+                return_exceptions=True,
+            )
+
+        responses = grader.loop.run(run_many(3))
+        self.assertListEqual([response["stdout"] for response in responses], ['{"status":2}'] * 3)
+
+        responses = grader.loop.run(run_many(8))
+        failures = [r for r in responses if isinstance(r, resilience.GraderUnavailable)]
+        self.assertGreater(len(failures), 0)
+        self.assertLess(len(failures), 8)
+        self.assertEqual(grader._settings["breaker"].state, "closed")  # pylint: disable=protected-access
+
+    def test_breaker_opens_and_recovers(self):
+        """
+        Test that submissions fail fast with HTTP 503 once most requests fail,
+        and that a probe closes the breaker again after the cooldown.
+        """
+
+        self.failing = True
+        statuses = [
+            helper.submit_as(self.client, f"F←{{⍵+{i}}}", id_user=str(i)).status_code
+            for i in range(6)
+        ]
+        self.assertListEqual(statuses, [503] * 6)
+        # A request the server received is not sent again, and the breaker opens after four
+        self.assertEqual(self.calls, 4)
+
+        rejected = helper.submit_as(self.client, "F←{⍵+6}", id_user="6")
+        self.assertEqual(rejected.status_code, 503)
+        self.assertEqual(rejected.json, {"error": "Grader unavailable, retry later"})
+        self.assertEqual(rejected.headers["Retry-After"], "1")
+
+        self.failing = False
+        time.sleep(0.6)
+        recovered = helper.submit_as(self.client, "F←{⍵+7}", id_user="7")
+        self.assertEqual(recovered.status_code, 200)
+        after = helper.submit_as(self.client, "F←{⍵+8}", id_user="8")
+        self.assertEqual(after.status_code, 200)
+
+    def test_hedged_failures(self):
+        """
+        Test that a hedged request fails only once both attempts have failed.
+        """
+
+        attempts = []
+
+        async def call():
+            attempts.append(None)
+            await asyncio.sleep(0.1 if len(attempts) == 1 else 0.2)
+            raise OSError(len(attempts))
+
+        with self.assertRaises(OSError):
+            asyncio.run(resilience.hedged(call, 0.05))
+        self.assertEqual(len(attempts), 2)
@@ -0,0 +1,70 @@
+"""This file contains the tests for the source rules checked before grading in the APL MOOC backend.
+
+The expected feedback is the output of `Test.Run` in grader/grader.apln for the same submissions.
+"""
+
+import base64
+import unittest
+from backend import grader
+from tests.standins import DyalogRunStandin, apl_response
+from . import helper
+
+
+class TestSourceRules(unittest.TestCase):
+    """Test class for rejecting submissions before they are run."""
+
+    def setUp(self):
+        self.server = DyalogRunStandin(lambda request: apl_response('{"status":2}'))
+        self.app = helper.create_hermetic_app(self.server.start(), {"MAX_CODE_SIZE": 100})
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_rules_match_framework(self):
+        """
+        Test that the rules give the same feedback as the test framework.
+        """
+
+        rules = grader.SourceRules.from_options({"x": "⌸⌺"})
+        error = grader.GradingStatus.ERROR
+
+        self.assertEqual(rules.check("   "), (error, "Empty submission"))
+        self.assertEqual(rules.check("F←{⍵⌸⍵}"), (
+            error, "⌸ found in source, which is prohibited for this problem.",
+        ))
+        self.assertEqual(rules.check("F←{⌺⌸⌺}"), (
+            error, "⌸⌺ found in source, which are prohibited for this problem.",
+        ))
+        # The framework only ignores spaces when checking for an empty submission
+        self.assertIsNone(rules.check("\n"))
+        self.assertIsNone(rules.check("F←{⍵}"))
+        self.assertIsNone(grader.SourceRules.from_options({}).check("F←{⍵⌸⍵}"))
+
+    def test_rejected_without_running(self):
+        """
+        Test that submissions breaking the rules are graded without reaching the interpreter.
+        """
+
+        response = helper.submit_as(self.client, "F←{⍵⌸⍵}")
+
+        self.assertEqual(len(self.server.requests), 0)
+        self.assertDictEqual(response.json, {
+            "points": 0,
+            "feedback": "⌸ found in source, which is prohibited for this problem.",
+        })
+
+    def test_invalid_code_rejected(self):
+        """
+        Test that code which is too large or not base64-encoded UTF-8 is rejected.
+        """
+
+        def submit(code_encoded):
+            return self.client.post("/submit", json={
+                "id_problem": "test_p1", "mooc_token": "token", "code_encoded": code_encoded,
+            }).status_code
+
+        self.assertEqual(submit("not base64!"), 400)
+        self.assertEqual(submit(base64.b64encode(b"\xff\xfe").decode()), 400)
+        self.assertEqual(submit(base64.b64encode(b"F" * 101).decode()), 413)
+        self.assertEqual(len(self.server.requests), 0)
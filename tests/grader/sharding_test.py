@@ -0,0 +1,178 @@
+"""This file contains the tests for sharded execution of a problem's test cases.
+
+Test cases are named after how the submission does on them, and a Python mimic of
+`⎕SE.Test.Run` runs them, so that sharded and serial runs can be compared directly.
+"""
+
+import asyncio
+import itertools
+import json
+import re
+import time
+import unittest
+from backend import grader, sharding
+from backend.problems import Problem
+from tests.standins import DyalogRunStandin, apl_response
+from . import helper
+
+OUTCOMES = ("pass", "fail", "error", "loop")
+
+
+class Timeout(Exception):
+    """Raised by a test case that never finishes."""
+
+
+def fake_test_run(opts: dict) -> dict:
+    """
+    Mimic `⎕SE.Test.Run` on test cases whose right argument names their outcome.
+
+    Args:
+        opts (dict): The problem options
+
+    Returns:
+        dict: The response
+    """
+
+    result = {"id": opts["id"], "submission": "", "status": 0}
+
+    def run_tests(cases):
+        passed = True
+        for case in cases:
+            result["larg"], result["rarg"] = case
+            if case[1].startswith("loop"):
+                raise Timeout
+            if case[1].startswith("error"):
+                raise ValueError
+            passed = passed and case[1].startswith("pass")
+        result["status"] += passed
+
+    try:
+        try:
+            run_tests(opts["tests"]["basic"])
+        except ValueError:
+            result.update(error=-11, report="DOMAIN ERROR")
+            return {"stdout": json.dumps(result), "stderr": "", "timed_out": False,
+                    "status_value": 0}
+
+        if result["status"] and "edge" in opts["tests"]:
+            try:
+                run_tests(opts["tests"]["edge"])
+            except ValueError:
+                result["status"] = 1
+        else:
+            result["status"] *= 2
+    except Timeout:
+        return {"stdout": "", "stderr": "", "timed_out": True, "status_value": 0}
+
+    return {"stdout": json.dumps(result), "stderr": "", "timed_out": False, "status_value": 0}
+
+
+def problem(basic: list, edge: list | None = None, **options) -> dict:
+    """
+    Build a problem configuration with dyadic test cases with the given outcomes.
+    """
+
+    tests = {"basic": [[str(i), f"{outcome}{i}"] for i, outcome in enumerate(basic)]}
+    if edge is not None:
+        tests["edge"] = [
+            [str(i), f"{outcome}{i}"] for i, outcome in enumerate(edge, len(basic))
+        ]
+    return {"id": "sharded", "entrypoint": "F", "tests": tests, "reference": "F←⊢", **options}
+
+
+class TestSharding(unittest.TestCase):
+    """Test class for splitting test cases into shards and merging their results."""
+
+    def test_split(self):
+        """
+        Test that shards hold consecutive cases of one test set and are never empty.
+        """
+
+        config = problem(["pass"] * 6, ["pass"] * 2)
+        shards = sharding.split_tests(config, 4)
+
+        self.assertListEqual([tests for tests, _ in shards], ["basic"] * 3 + ["edge"])
+        self.assertListEqual(
+            [case for _, options in shards for case in options["tests"]["basic"]],
+            config["tests"]["basic"] + config["tests"]["edge"],
+        )
+        self.assertTrue(all(options["tests"]["basic"] for _, options in shards))
+
+        self.assertEqual(len(sharding.split_tests(config, 20)), 8)
+        self.assertListEqual(sharding.split_tests(config, 1), [])
+        self.assertListEqual(sharding.split_tests(problem(["pass"]), 4), [])
+        self.assertListEqual(
+            [tests for tests, _ in sharding.split_tests(problem(["pass"] * 9, ["pass"]), 2)],
+            ["basic", "edge"],
+        )
+
+    def test_merge_matches_serial(self):
+        """
+        Test that the merged result of the shards is the result of the serial run,
+        for every combination of outcomes of the test cases.
+        """
+
+        for basic, edge in itertools.product(
+            itertools.product(OUTCOMES, repeat=3), [None, *itertools.product(OUTCOMES, repeat=2)],
+        ):
+            config = problem(list(basic), None if edge is None else list(edge))
+            serial = fake_test_run(config)
+            for count in range(2, 6):
+                shards = sharding.split_tests(config, count)
+                merged = sharding.merge_responses(
+                    [tests for tests, _ in shards],
+                    [fake_test_run(options) for _, options in shards],
+                )
+                with self.subTest(basic=basic, edge=edge, shards=count):
+                    self.assertEqual(merged["timed_out"], serial["timed_out"])
+                    if not serial["timed_out"]:
+                        self.assertDictEqual(json.loads(merged["stdout"]),
+                                             json.loads(serial["stdout"]))
+
+    def test_invalid_shards(self):
+        """
+        Test that a problem with an invalid shards count is rejected.
+        """
+
+        for shards in (0, 1.5, True, "2"):
+            with self.subTest(shards=shards), self.assertRaises(ValueError):
+                Problem.from_config(problem(["pass"], shards=shards))
+        self.assertEqual(len(Problem.from_config(problem(["pass"] * 4, shards=2)).shards), 2)
+
+
+class TestShardedExecution(unittest.TestCase):
+    """Test class for grading sharded problems against a local stand-in server."""
+
+    def setUp(self):
+        async def handler(request):
+            options = re.search(r"opts←0⎕JSON'(.*)'", request["code"]).group(1)
+            opts = json.loads(options.replace("''", "'"))
+            await asyncio.sleep(0.2 * len(opts["tests"]["basic"]))
+            response = fake_test_run(opts)
+            return apl_response(response["stdout"], timed_out=response["timed_out"])
+
+        self.server = DyalogRunStandin(handler)
+        helper.create_hermetic_app(self.server.start(), {"GRADER_HEDGE_ENABLED": False})
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_shards_run_in_parallel(self):
+        """
+        Test that the shards of a submission run at the same time
+        and give the feedback of the serial run.
+        """
+
+        config = problem(["pass"] * 4, ["pass", "fail"], shards=3)
+
+        start = time.perf_counter()
+        result = grader.loop.run(grader.evaluate("F←⊢", config))
+        elapsed = time.perf_counter() - start
+
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertLess(elapsed, 0.2 * 6 / 2)
+        self.assertEqual(result, (
+            grader.GradingStatus.PASSED_BASIC,
+            "Failed test: 5 as left argument and fail5 as right argument.",
+        ))
+        self.assertEqual(result, grader.loop.run(grader.evaluate("F←⊢", {**config, "shards": 1})))
@@ -0,0 +1,268 @@
+"""This file contains the tests for the submission grading pipeline of the APL MOOC backend.
+
+Submissions are graded against a local stand-in server instead of dyalog.run.
+"""
+
+import asyncio
+import base64
+import json
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from backend import cache, database, grader, submissions
+from backend.problems import registry
+from tests.standins import DyalogRunStandin, apl_response
+from . import helper
+
+
+class TestResultCache(unittest.TestCase):
+    """Test class for grading result memoisation."""
+
+    def setUp(self):
+        self.response = apl_response('{"status":2}')
+        self.server = DyalogRunStandin(lambda request: self.response)
+        self.app = helper.create_hermetic_app(self.server.start())
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_identical_code_graded_once(self):
+        """
+        Test that resubmitting code differing only in whitespace reuses the first result.
+        """
+
+        first = helper.submit_as(self.client, "F←{⍵}\n", id_user="1")
+        second = helper.submit_as(self.client, "\r\nF←{⍵}   \r\n\r\n", id_user="2")
+
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertDictEqual(first.json, second.json)
+        self.assertListEqual(self.client.get("/get").json["points"], [
+            {"id_user": "1", "points": 2},
+            {"id_user": "2", "points": 2},
+        ])
+
+    def test_timeouts_not_cached(self):
+        """
+        Test that timed out submissions are executed again when resubmitted.
+        """
+
+        self.response = apl_response(timed_out=True)
+        helper.submit_as(self.client, "F←{∇⍵}")
+        helper.submit_as(self.client, "F←{∇⍵}")
+
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_normalise_code(self):
+        """
+        Test that normalisation keeps everything except line endings and surrounding whitespace.
+        """
+
+        self.assertEqual(
+            submissions.normalise_code(" F←{⍵} \r\n\n G←'a  b'\t\n"), " F←{⍵}\n G←'a  b'",
+        )
+
+
+class TestConcurrentGrading(unittest.TestCase):
+    """Test class for grading many submissions at once in one process."""
+
+    def setUp(self):
+        async def slow_response(request):
+            del request
+            await asyncio.sleep(0.3)
+            return apl_response('{"status":2}')
+
+        self.server = DyalogRunStandin(slow_response)
+        self.app = helper.create_hermetic_app(self.server.start(), {"GRADER_POOL_SIZE": 16})
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_pending_submissions_overlap(self):
+        """
+        Test that submissions waiting on the grader do not wait for each other.
+        """
+
+        def submit(index):
+            return self.app.test_client().post("/submit", json={
+                "id_problem": "test_p1",
+                "mooc_token": str(index),
+                "code_encoded": base64.b64encode(f"F←{{⍵+{index}}}".encode()).decode(),
+            })
+
+        start = time.monotonic()
+        with mock.patch.object(grader, "get_user_id", side_effect=lambda token: token):
+            with ThreadPoolExecutor(16) as executor:
+                responses = list(executor.map(submit, range(16)))
+        elapsed = time.monotonic() - start
+
+        self.assertTrue(all(response.status_code == 200 for response in responses))
+        self.assertEqual(len(self.server.requests), 16)
+        self.assertLess(elapsed, 16 * 0.3 / 2)
+
+
+class TestCoalescing(unittest.TestCase):
+    """Test class for sharing the outcome of identical submissions graded at the same time."""
+
+    def setUp(self):
+        async def slow_response(request):
+            del request
+            await asyncio.sleep(0.3)
+            return apl_response('{"status":2}')
+
+        self.server = DyalogRunStandin(slow_response)
+        self.app = helper.create_hermetic_app(self.server.start())
+
+    def tearDown(self):
+        self.server.stop()
+
+    def submit(self, id_user: str):
+        """
+        Submit the same code as the given user.
+        """
+
+        return self.app.test_client().post("/submit", json={
+            "id_problem": "test_p1",
+            "mooc_token": id_user,
+            "code_encoded": base64.b64encode("F←{⍵}".encode()).decode(),
+        })
+
+    def hold_lease(self, seconds: float, result: list | None = None):
+        """
+        Act as another worker grading the same code for a while,
+        optionally storing a result before releasing its lease.
+        """
+
+        settings = submissions._settings  # pylint: disable=protected-access
+        with self.app.app_context():
+            problem = registry.get("test_p1")
+            key = cache.hash_key(problem.id, problem.version, "F←{⍵}")
+            self.assertTrue(settings["leases"].add(key, 0))
+
+        def release():
+            time.sleep(seconds)
+            with self.app.app_context():
+                if result is not None:
+                    settings["result_cache"].set(key, result)
+                settings["leases"].delete(key)
+
+        thread = threading.Thread(target=release)
+        thread.start()
+        return thread
+
+    def test_identical_submissions_graded_once(self):
+        """
+        Test that identical submissions arriving together are executed once
+        and every user is awarded the points.
+        """
+
+        with mock.patch.object(grader, "get_user_id", side_effect=lambda token: token):
+            with ThreadPoolExecutor(4) as executor:
+                responses = list(executor.map(self.submit, ["1", "2", "3", "4"]))
+
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertTrue(all(response.json["points"] == 2 for response in responses))
+        self.assertEqual(len(self.app.test_client().get("/get").json["points"]), 4)
+
+    def test_waits_for_other_process(self):
+        """
+        Test that a submission being graded by another process is not executed again.
+        """
+
+        thread = self.hold_lease(0.3, [1, "Passed basic tests, well done! "])
+        with mock.patch.object(grader, "get_user_id", side_effect=lambda token: token):
+            response = self.submit("1")
+        thread.join()
+
+        self.assertEqual(len(self.server.requests), 0)
+        self.assertEqual(response.json["points"], 1)
+
+    def test_grades_after_lease_without_result(self):
+        """
+        Test that a submission is executed if the other process finishes without a result.
+        """
+
+        thread = self.hold_lease(0.3)
+        with mock.patch.object(grader, "get_user_id", side_effect=lambda token: token):
+            response = self.submit("1")
+        thread.join()
+
+        self.assertEqual(len(self.server.requests), 1)
+        self.assertEqual(response.json["points"], 2)
+
+
+class TestTimeLimits(unittest.TestCase):
+    """Test class for per-problem and adaptive execution time limits."""
+
+    def setUp(self):
+        self.response = apl_response('{"status":2}')
+        self.server = DyalogRunStandin(lambda request: self.response)
+        self.app = helper.create_hermetic_app(self.server.start(), {
+            "PROBLEMS_CHECK_INTERVAL": 0,
+            "GRADER_ADAPTIVE_TIME_LIMIT": True,
+            "GRADER_TIME_LIMIT_SAMPLES": 5,
+        })
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def check_problem_time_limit(self):
+        """
+        Check that a problem's own time limit is sent to the grader and reported on timeout.
+        """
+
+        with self.app.app_context():
+            config = {**database.get_problem_config("test_p1"), "id": "test_p2", "time_limit": 12}
+            database.db.session.add(
+                database.Problems(id_problem="test_p2", config=json.dumps(config))
+            )
+            database.db.session.commit()
+            with database.db.engine.begin() as connection:
+                database.bump_version(connection, "problems_version")
+
+        self.response = apl_response(timed_out=True)
+        response = helper.submit_as(self.client, "F←{∇⍵}", id_problem="test_p2")
+
+        self.assertEqual(self.server.requests[-1]["timeout"], 12)
+        self.assertEqual(response.json["feedback"], "Execution timed out (>12s)")
+
+    def test_problem_time_limit(self):
+        """
+        Test that a problem's own time limit is sent to the grader and reported on timeout.
+        """
+
+        self.check_problem_time_limit()
+
+    def test_problem_time_limit_batched(self):
+        """
+        Test that a problem's own time limit is kept when submissions are batched.
+        """
+
+        self.app = helper.create_hermetic_app(self.server.url, {
+            "PROBLEMS_CHECK_INTERVAL": 0,
+            "GRADER_BATCH_SIZE": 4,
+            "GRADER_BATCH_TRUSTED": True,
+            "GRADER_BATCH_LINGER": 0.01,
+        })
+        self.client = self.app.test_client()
+        self.addCleanup(helper.create_hermetic_app, self.server.url)
+
+        self.check_problem_time_limit()
+
+    def test_adaptive_time_limit(self):
+        """
+        Test that the time limit is tightened once enough passing executions are recorded.
+        """
+
+        for index in range(5):
+            helper.submit_as(self.client, f"F←{{⍵+{index}}}", id_user=str(index))
+            self.assertEqual(self.server.requests[-1]["timeout"], 5)
+
+        self.response = apl_response(timed_out=True)
+        response = helper.submit_as(self.client, "F←{∇⍵}", id_user="5")
+
+        self.assertEqual(self.server.requests[-1]["timeout"], 1)
+        self.assertEqual(response.json["feedback"], "Execution timed out (>1s)")
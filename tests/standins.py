@@ -0,0 +1,236 @@
+"""Local stand-in servers for the external services used by the APL MOOC backend.
+
+The stand-ins let tests and benchmarks exercise the backend without reaching the internet.
+"""
+
+import asyncio
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import msgpack
+from websockets import serve
+from backend.pool import EventLoopThread
+
+# Outputs of `⎕SE.Test.Run` for each grading outcome, as printed by the test framework
+TEST_RUN_OUTPUTS = {
+    "passed_all": '{"status":2}',
+    "passed_basic": '{"status":1,"rarg":"⍬"}',
+    "failed": '{"status":0,"rarg":"2 3"}',
+    "error": '{"error":1,"report":"VALUE ERROR: Undefined name: F"}',
+}
+
+
+def canned_handler(weights: dict, timeout_rate: float = 0, seed: int | None = None):
+    """
+    Build a stand-in handler answering with randomly chosen `⎕SE.Test.Run` outputs.
+
+    Args:
+        weights (dict): The relative frequency of each outcome in `TEST_RUN_OUTPUTS`
+        timeout_rate (float, optional): The fraction of runs that time out. Defaults to 0.
+        seed (int, optional): The random seed. Defaults to an unseeded generator.
+
+    Returns:
+        A handler for `DyalogRunStandin`
+    """
+
+    generator = random.Random(seed)
+    outcomes = list(weights)
+    frequencies = [weights[outcome] for outcome in outcomes]
+
+    def handler(request):
+        del request
+        if generator.random() < timeout_rate:
+            return apl_response(timed_out=True)
+        outcome = generator.choices(outcomes, frequencies)[0]
+        return apl_response(TEST_RUN_OUTPUTS[outcome])
+
+    return handler
+
+
+def apl_response(stdout: str = "", stderr: str = "", timed_out: bool = False,
+                 status_value: int = 0) -> dict:
+    """
+    Build a response in the format returned by the dyalog.run execute API.
+
+    Args:
+        stdout (str, optional): The interpreter output. Defaults to "".
+        stderr (str, optional): The interpreter error output. Defaults to "".
+        timed_out (bool, optional): Whether execution timed out. Defaults to `False`.
+        status_value (int, optional): The interpreter exit status. Defaults to 0.
+
+    Returns:
+        dict: The response fields
+    """
+
+    return {
+        "stdout": stdout.encode(),
+        "stderr": stderr.encode(),
+        "timed_out": timed_out,
+        "status_value": status_value,
+    }
+
+
+class DyalogRunStandin:  # pylint: disable=too-many-instance-attributes
+    """
+    A local msgpack websocket server mimicking `/api/v0/ws/execute` on dyalog.run.
+
+    The `handler` receives each unpacked request and returns a response dictionary
+    as built by `apl_response`. The default handler echoes an empty successful run.
+    Each response is delayed by `latency` seconds, without blocking other connections.
+    """
+
+    def __init__(self, handler=None, close_after_response: bool = False, latency: float = 0):
+        self.handler = handler or (lambda request: apl_response())
+        self.close_after_response = close_after_response
+        self.latency = latency
+        self.connections = 0
+        self.requests = []
+        self._loop = EventLoopThread()
+        self._server = None
+        self.url = None
+
+    async def _serve(self, websocket, *args):
+        del args
+        self.connections += 1
+        async for message in websocket:
+            request = msgpack.unpackb(message, raw=False)
+            self.requests.append(request)
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            response = self.handler(request)
+            if asyncio.iscoroutine(response):
+                response = await response
+            await websocket.send(msgpack.packb(response))
+            if self.close_after_response:
+                await websocket.close()
+                return
+
+    async def _start(self):
+        self._server = await serve(self._serve, "127.0.0.1", 0, max_size=None)
+        port = self._server.sockets[0].getsockname()[1]
+        self.url = f"ws://127.0.0.1:{port}/api/v0/ws/execute"
+
+    async def _stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    def start(self) -> str:
+        """
+        Start the server in a background thread.
+
+        Returns:
+            str: The websocket URL of the server
+        """
+
+        self._loop.run(self._start())
+        return self.url
+
+    def stop(self):
+        """
+        Stop the server and its background thread.
+        """
+
+        self._loop.run(self._stop())
+        self._loop.stop()
+
+
+class MoocStandin:
+    """
+    A local HTTP server mimicking the `UserInfo` GraphQL query of the mooc.fi API.
+
+    Tokens of the form `user-<id>` resolve to the user `<id>`, and tokens listed in
+    `users` resolve to the given user ID. Any other token is rejected with HTTP 401.
+    Each response is delayed by `latency` seconds.
+    """
+
+    def __init__(self, users: dict | None = None, latency: float = 0):
+        self.users = users or {}
+        self.latency = latency
+        self.requests = 0
+        self._server = None
+        self._thread = None
+        self.url = None
+
+    def resolve(self, token: str) -> str | None:
+        """
+        Find the user ID a token resolves to.
+
+        Args:
+            token (str): The bearer token of a request
+
+        Returns:
+            str: The user ID, or None if the token is rejected
+        """
+
+        if token in self.users:
+            return self.users[token]
+        if token.startswith("user-"):
+            return token.removeprefix("user-")
+        return None
+
+    def _handler(self):
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """Answers UserInfo queries."""
+
+            def do_POST(self):  # pylint: disable=invalid-name
+                """Answer a GraphQL query."""
+
+                standin.requests += 1
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                if standin.latency:
+                    time.sleep(standin.latency)
+
+                token = self.headers.get("Authorization", "").removeprefix("Bearer ")
+                id_user = standin.resolve(token)
+                if body.get("operationName") != "UserInfo":
+                    status, response = 400, {"errors": [{"message": "Unknown operation"}]}
+                elif id_user is None:
+                    status, response = 401, {"errors": [{"message": "Invalid token"}]}
+                else:
+                    status, response = 200, {"data": {"currentUser": {
+                        "id": id_user,
+                        "full_name": f"User {id_user}",
+                        "email": f"user{id_user}@example.com",
+                        "student_number": None,
+                        "username": f"user{id_user}",
+                    }}}
+
+                payload = json.dumps(response).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+                del format, args
+
+        return Handler
+
+    def start(self) -> str:
+        """
+        Start the server in a background thread.
+
+        Returns:
+            str: The URL of the GraphQL API
+        """
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}/api/v8"
+        return self.url
+
+    def stop(self):
+        """
+        Stop the server and its background thread.
+        """
+
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()